@@ -26,4 +26,79 @@ TEMPERATURE = 0
 
 
 # NVIDIA
-NVIDIA_API_KEY = os.getenv('NVIDIA_API_KEY')
\ No newline at end of file
+NVIDIA_API_KEY = os.getenv('NVIDIA_API_KEY')
+
+# OpenAI (fw5)
+OPENAI_API_KEY = os.getenv('OPENAI_API_KEY')
+OPENAI_BASE_URL = os.getenv('OPENAI_BASE_URL')  # None = api.openai.com; set to point fw5 at another server (e.g. a local stand-in)
+OPENAI_BATCH_POLL_SECONDS = float(os.getenv('OPENAI_BATCH_POLL_SECONDS', 30))
+
+# Concurrency
+MAX_CONCURRENCY = int(os.getenv('MAX_CONCURRENCY', 16))  # in-flight requests per model
+# in-flight requests shared by all models of a provider when models run side by side
+PROVIDER_MAX_CONCURRENCY = {
+    'azure': int(os.getenv('AZURE_MAX_CONCURRENCY', 32)),
+    'vertex': int(os.getenv('VERTEX_MAX_CONCURRENCY', 16)),
+    'nvidia': int(os.getenv('NVIDIA_MAX_CONCURRENCY', 8)),
+    'ollama': int(os.getenv('OLLAMA_MAX_CONCURRENCY', 4)),  # per Ollama host (see llm/ollama_pool.py)
+}
+
+# Rate limits per provider (None = unlimited); keep them a little under the quota of the deployment
+PROVIDER_RATE_LIMITS = {
+    'azure': {'requests_per_minute': int(os.getenv('AZURE_RPM', 450)), 'tokens_per_minute': int(os.getenv('AZURE_TPM', 75000))},
+    'openai': {'requests_per_minute': int(os.getenv('OPENAI_RPM', 450)), 'tokens_per_minute': int(os.getenv('OPENAI_TPM', 180000))},
+    'vertex': {'requests_per_minute': int(os.getenv('VERTEX_RPM', 55)), 'tokens_per_minute': int(os.getenv('VERTEX_TPM', 80000))},
+    'nvidia': {'requests_per_minute': int(os.getenv('NVIDIA_RPM', 35)), 'tokens_per_minute': None},
+    'ollama': {'requests_per_minute': None, 'tokens_per_minute': None},
+}
+
+# Response cache (TEMPERATURE = 0, so identical requests give identical completions)
+RESPONSE_CACHE_ENABLED = os.getenv('RESPONSE_CACHE_ENABLED', '1') == '1'
+RESPONSE_CACHE_PATH = os.getenv('RESPONSE_CACHE_PATH', os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'results', 'cache', 'responses.sqlite'))
+RESPONSE_CACHE_MAX_BYTES = int(float(os.getenv('RESPONSE_CACHE_MAX_MB', 2048)) * 1024 * 1024)
+RESPONSE_CACHE_READ_ONLY = os.getenv('RESPONSE_CACHE_READ_ONLY', '0') == '1'  # replay analysis offline, misses are not sent
+
+# Costs: USD per 1M tokens (input, output), matched on the longest prefix of the model name reported by the
+# provider (e.g. "gpt-4o-mini-2024-07-18" -> "gpt-4o-mini"). Models not listed (local Ollama models) are free.
+MODEL_PRICES_PER_1M_TOKENS = {
+    'gpt-35-turbo': (0.5, 1.5),
+    'gpt-3.5-turbo': (0.5, 1.5),
+    'gpt-4o': (5.0, 15.0),
+    'gpt-4o-mini': (0.15, 0.6),
+    'ft:gpt-4o-mini': (0.3, 1.2),
+    'gpt-4-turbo': (10.0, 30.0),
+    'gpt-4': (30.0, 60.0),
+    'claude-3-haiku': (0.25, 1.25),
+    'claude-3-5-sonnet': (3.0, 15.0),
+    'gemini-1.5-flash': (0.075, 0.3),
+    'meta/llama-3.1-405b-instruct': (5.0, 16.0),
+    'meta/llama3-70b-instruct': (0.9, 0.9),
+}
+# Spend ceilings per run in USD (None = no ceiling): above the soft one requests are slowed down,
+# at the hard one the schedulers stop sending requests
+COST_SOFT_LIMIT_USD = float(os.getenv('COST_SOFT_LIMIT_USD')) if os.getenv('COST_SOFT_LIMIT_USD') else None
+COST_HARD_LIMIT_USD = float(os.getenv('COST_HARD_LIMIT_USD')) if os.getenv('COST_HARD_LIMIT_USD') else None
+COST_THROTTLE_MAX_SECONDS = float(os.getenv('COST_THROTTLE_MAX_SECONDS', 30))  # delay per request close to the hard ceiling
+
+# Input streaming: rows per chunk when a dataset is read chunk by chunk (run scripts --chunksize, fw5 process_csv)
+INPUT_CHUNK_ROWS = int(os.getenv('INPUT_CHUNK_ROWS', 5000))
+
+# HTTP connection pools shared by the models of one endpoint (see llm/http_pool.py)
+HTTP_MAX_CONNECTIONS = int(os.getenv('HTTP_MAX_CONNECTIONS', 100))  # open connections per pool
+HTTP_MAX_KEEPALIVE_CONNECTIONS = int(os.getenv('HTTP_MAX_KEEPALIVE_CONNECTIONS', 32))  # idle connections kept open
+HTTP_KEEPALIVE_EXPIRY_SECONDS = float(os.getenv('HTTP_KEEPALIVE_EXPIRY_SECONDS', 60))
+HTTP2_ENABLED = os.getenv('HTTP2_ENABLED', '1') == '1'  # only used when the h2 package is installed
+
+# Ollama servers (see llm/ollama_pool.py): OLLAMA_HOSTS="node1:11434,node2:11434", or the single OLLAMA_HOST of `ollama serve`
+OLLAMA_HOSTS = [host for host in os.getenv('OLLAMA_HOSTS', os.getenv('OLLAMA_HOST', '127.0.0.1:11434')).split(',') if host.strip()]
+OLLAMA_KEEP_ALIVE = os.getenv('OLLAMA_KEEP_ALIVE', '30m')  # how long a model stays loaded after its last request
+OLLAMA_WARMUP_TIMEOUT_SECONDS = float(os.getenv('OLLAMA_WARMUP_TIMEOUT_SECONDS', 600))  # loading large models takes minutes
+
+# Metrics computed over result columns (metrics/*.py): worker processes of the batch scorers (None = one per CPU)
+# and pairs sent to a worker at a time
+METRICS_WORKERS = int(os.getenv('METRICS_WORKERS')) if os.getenv('METRICS_WORKERS') else None
+METRICS_CHUNK_ROWS = int(os.getenv('METRICS_CHUNK_ROWS', 2000))
+
+# Embedding store (see llm/embeddings.py): texts per embedding request, and where the stores live
+EMBED_BATCH_SIZE = int(os.getenv('EMBED_BATCH_SIZE', 256))
+EMBEDDINGS_DIR = os.getenv('EMBEDDINGS_DIR', os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'results', 'embeddings'))
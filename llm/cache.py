@@ -0,0 +1,266 @@
+import hashlib
+import json
+import os
+import sqlite3
+import threading
+import time
+
+from langchain_core.caches import BaseCache
+from langchain_core.globals import set_llm_cache
+from langchain_core.messages import AIMessage
+from langchain_core.outputs import ChatGeneration, Generation
+
+from config.settings import RESPONSE_CACHE_ENABLED, RESPONSE_CACHE_PATH, RESPONSE_CACHE_MAX_BYTES, RESPONSE_CACHE_READ_ONLY
+
+
+class CacheMissError(Exception):
+    """Raised on a cache miss in read-only mode, so that no request reaches the provider."""
+
+
+def make_cache_key(model_id, messages, temperature=None, params=None):
+    """Content hash of a request: model id, rendered messages, temperature and provider parameters."""
+    payload = json.dumps(
+        {"model": model_id, "messages": messages, "temperature": temperature, "params": params or {}},
+        sort_keys=True, default=str, ensure_ascii=False,
+    )
+    return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+
+# ---- 1/ On-disk store
+class ResponseCache:
+    """
+    Content-addressed response store backed by SQLite.
+
+    Values are JSON strings keyed by make_cache_key(). When max_bytes is set, the least recently
+    read or written entries are evicted once the stored values grow past it. In read-only mode the
+    database is opened read-only: nothing is written (not even access times) and get() misses raise
+    CacheMissError when raise_on_miss is set.
+
+    Safe to share between threads; several processes can use the same file (WAL journal).
+    """
+
+    def __init__(self, path, max_bytes=None, read_only=False):
+        self.path = path
+        self.max_bytes = max_bytes
+        self.read_only = read_only
+        self.lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.writes = 0
+        self.evictions = 0
+
+        if read_only:
+            if not os.path.exists(path):
+                raise FileNotFoundError(f"Response cache not found at {path}")
+            self.conn = sqlite3.connect(f"file:{path}?mode=ro", uri=True, check_same_thread=False)
+        else:
+            os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+            self.conn = sqlite3.connect(path, check_same_thread=False, timeout=30)
+            self.conn.execute("PRAGMA journal_mode=WAL")
+            self.conn.execute(
+                "CREATE TABLE IF NOT EXISTS responses ("
+                "key TEXT PRIMARY KEY, value TEXT NOT NULL, size INTEGER NOT NULL, "
+                "created REAL NOT NULL, last_access REAL NOT NULL)"
+            )
+            self.conn.execute("CREATE INDEX IF NOT EXISTS responses_last_access ON responses (last_access)")
+            self.conn.commit()
+        self.total_bytes = self.conn.execute("SELECT COALESCE(SUM(size), 0) FROM responses").fetchone()[0]
+
+    def get(self, key, raise_on_miss=False):
+        with self.lock:
+            row = self.conn.execute("SELECT value FROM responses WHERE key = ?", (key,)).fetchone()
+            if row is None:
+                self.misses += 1
+            else:
+                self.hits += 1
+                if not self.read_only:
+                    self.conn.execute("UPDATE responses SET last_access = ? WHERE key = ?", (time.time(), key))
+                    self.conn.commit()
+        if row is None:
+            if raise_on_miss and self.read_only:
+                raise CacheMissError(f"Response not in read-only cache {self.path} (key {key[:12]})")
+            return None
+        return row[0]
+
+    def put(self, key, value):
+        if self.read_only:
+            return
+        size = len(value.encode("utf-8"))
+        now = time.time()
+        with self.lock:
+            previous = self.conn.execute("SELECT size FROM responses WHERE key = ?", (key,)).fetchone()
+            self.conn.execute(
+                "INSERT OR REPLACE INTO responses (key, value, size, created, last_access) VALUES (?, ?, ?, ?, ?)",
+                (key, value, size, now, now),
+            )
+            self.total_bytes += size - (previous[0] if previous else 0)
+            self.writes += 1
+            if self.max_bytes is not None and self.total_bytes > self.max_bytes:
+                self._evict()
+            self.conn.commit()
+
+    def _evict(self):
+        # Least recently used first, down to 90% of the cap so eviction does not run on every put
+        target = int(self.max_bytes * 0.9)
+        evicted_keys = []
+        for key, size in self.conn.execute("SELECT key, size FROM responses ORDER BY last_access"):
+            if self.total_bytes <= target:
+                break
+            evicted_keys.append((key,))
+            self.total_bytes -= size
+        self.conn.executemany("DELETE FROM responses WHERE key = ?", evicted_keys)
+        self.evictions += len(evicted_keys)
+
+    def clear(self):
+        if self.read_only:
+            return
+        with self.lock:
+            self.conn.execute("DELETE FROM responses")
+            self.conn.commit()
+            self.total_bytes = 0
+
+    def stats(self):
+        with self.lock:
+            entries = self.conn.execute("SELECT COUNT(*) FROM responses").fetchone()[0]
+        lookups = self.hits + self.misses
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": self.hits / lookups if lookups else 0.0,
+            "writes": self.writes,
+            "evictions": self.evictions,
+            "entries": entries,
+            "size_bytes": self.total_bytes,
+            "max_bytes": self.max_bytes,
+            "read_only": self.read_only,
+        }
+
+
+# ---- 2/ LangChain adapter (fw0 - fw3)
+def _generation_to_dict(generation):
+    data = {"text": generation.text, "generation_info": generation.generation_info}
+    message = getattr(generation, "message", None)
+    if message is not None:
+        data["message"] = {
+            "content": message.content,
+            "additional_kwargs": message.additional_kwargs,
+            "response_metadata": message.response_metadata,
+            "usage_metadata": getattr(message, "usage_metadata", None),
+        }
+    return data
+
+
+def _generation_from_dict(data):
+    if "message" not in data:
+        return Generation(text=data["text"], generation_info=data.get("generation_info"))
+    message = data["message"]
+    return ChatGeneration(
+        message=AIMessage(
+            content=message["content"],
+            additional_kwargs=message.get("additional_kwargs") or {},
+            response_metadata={**(message.get("response_metadata") or {}), "cache_hit": True},
+            usage_metadata=message.get("usage_metadata"),
+        ),
+        generation_info=data.get("generation_info"),
+    )
+
+
+class LangChainResponseCache(BaseCache):
+    """
+    LangChain LLM cache on top of a ResponseCache.
+
+    LangChain calls it with the serialised messages as prompt and a string of the model class and
+    its parameters (model name, temperature, ...) as llm_string, so every chat model is covered
+    without changing the pipelines.
+    """
+
+    def __init__(self, cache):
+        self.cache = cache
+
+    def lookup(self, prompt, llm_string):
+        value = self.cache.get(make_cache_key(llm_string, prompt), raise_on_miss=True)
+        if value is None:
+            return None
+        return [_generation_from_dict(data) for data in json.loads(value)]
+
+    def update(self, prompt, llm_string, return_val):
+        value = json.dumps([_generation_to_dict(generation) for generation in return_val], default=str)
+        self.cache.put(make_cache_key(llm_string, prompt), value)
+
+    def clear(self, **kwargs):
+        self.cache.clear()
+
+
+# ---- 3/ Setup
+_response_cache = None
+_setup_lock = threading.Lock()
+
+
+def setup_response_cache(path=None, max_bytes=None, read_only=None):
+    """
+    Open the response cache and install it as the global LangChain cache.
+
+    Settings come from config/settings.py (RESPONSE_CACHE_*) unless overridden. Calling it again
+    without arguments keeps the cache already set up. Returns None when the cache is disabled.
+    """
+    global _response_cache
+    with _setup_lock:
+        overrides = (path, max_bytes, read_only) != (None, None, None)
+        if _response_cache is not None and not overrides:
+            return _response_cache
+        if not RESPONSE_CACHE_ENABLED and not overrides:
+            return None
+        _response_cache = ResponseCache(
+            path or RESPONSE_CACHE_PATH,
+            max_bytes=RESPONSE_CACHE_MAX_BYTES if max_bytes is None else max_bytes,
+            read_only=RESPONSE_CACHE_READ_ONLY if read_only is None else read_only,
+        )
+        set_llm_cache(LangChainResponseCache(_response_cache))
+        print(f"Response cache: {_response_cache.path} ({'read-only' if _response_cache.read_only else 'read-write'})")
+        return _response_cache
+
+
+def get_response_cache():
+    return setup_response_cache()
+
+
+def print_cache_stats():
+    if _response_cache is None:
+        return
+    stats = _response_cache.stats()
+    print(f"Response cache: {stats['hits']} hits, {stats['misses']} misses ({stats['hit_rate']:.1%} hit rate), "
+          f"{stats['entries']} entries, {stats['size_bytes'] / 1e6:.1f} MB, {stats['evictions']} evicted")
+
+
+# ---- 4/ OpenAI client (fw5)
+def chat_completion_cache_key(request):
+    """Cache key of an OpenAI chat.completions request body (also used for Batch API results)."""
+    params = {name: value for name, value in request.items() if name not in ("model", "messages", "temperature")}
+    return make_cache_key(request.get("model"), request.get("messages"), request.get("temperature"), params)
+
+
+def cached_chat_completion(create, **request):
+    """
+    Call create(**request) (an OpenAI chat.completions.create) through the response cache.
+
+    Hits are rebuilt as ChatCompletion objects, so callers use them exactly like live responses.
+    """
+    from openai.types.chat import ChatCompletion
+
+    cache = get_response_cache()
+    if cache is None:
+        return create(**request)
+
+    key = chat_completion_cache_key(request)
+    try:
+        value = cache.get(key, raise_on_miss=True)
+    except CacheMissError as e:
+        print(f"Skipping request: {str(e)}")
+        return None
+    if value is not None:
+        return ChatCompletion.model_validate_json(value)
+
+    completion = create(**request)
+    if completion is not None:
+        cache.put(key, completion.model_dump_json())
+    return completion
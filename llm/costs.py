@@ -0,0 +1,189 @@
+import json
+import os
+import re
+import threading
+import time
+
+from config.settings import MODEL_PRICES_PER_1M_TOKENS, COST_SOFT_LIMIT_USD, COST_HARD_LIMIT_USD, COST_THROTTLE_MAX_SECONDS
+
+
+class BudgetExceededError(Exception):
+    """Raised instead of sending a request once the hard spend ceiling of the run is reached."""
+
+
+# ---- 1/ Response inspection
+def response_model_name(response):
+    """Model name reported by a LangChain message or an OpenAI completion, or None."""
+    response_metadata = getattr(response, "response_metadata", None) or {}
+    model_name = response_metadata.get("model_name") or response_metadata.get("model")
+    if model_name is None:
+        model_name = getattr(response, "model", None)
+    return model_name if isinstance(model_name, str) else None
+
+
+def extract_token_counts(response):
+    """(input_tokens, output_tokens) reported by a LangChain message or an OpenAI completion, or (None, None)."""
+    usage_metadata = getattr(response, "usage_metadata", None)
+    if usage_metadata:
+        return usage_metadata.get("input_tokens"), usage_metadata.get("output_tokens")
+    response_metadata = getattr(response, "response_metadata", None) or {}
+    usage = response_metadata.get("token_usage") or response_metadata.get("usage")
+    if isinstance(usage, dict):
+        return (usage.get("prompt_tokens", usage.get("input_tokens")),
+                usage.get("completion_tokens", usage.get("output_tokens")))
+    usage = getattr(response, "usage", None)
+    if usage is not None:
+        return getattr(usage, "prompt_tokens", None), getattr(usage, "completion_tokens", None)
+    return None, None
+
+
+def normalize_model_name(model):
+    """Model names as written in the price table: "meta / llama3-70b-instruct" -> "meta/llama3-70b-instruct"."""
+    return re.sub(r"\s*/\s*", "/", model.strip()) if isinstance(model, str) else model
+
+
+def is_cached_response(response):
+    """Responses replayed from the response cache (see llm/cache.py) cost nothing."""
+    response_metadata = getattr(response, "response_metadata", None) or {}
+    return bool(response_metadata.get("cache_hit"))
+
+
+# ---- 2/ Ledger
+class CostLedger:
+    """
+    Spend of the run per model, from the token usage reported by the providers.
+
+    Prices come from a table of USD per 1M (input, output) tokens, matched on the longest prefix of
+    the model name, with spaces around "/" removed (so dated and fine-tuned variants resolve to their
+    base model); unlisted models are free (scripts/check_prices.py checks the hosted models of
+    llm/models.py all have a price). Every request goes through before_call() (see llm/rate_limit.py):
+    - above soft_limit, each request is delayed, up to max_delay seconds as the spend gets close
+      to hard_limit (or max_delay right away when there is no hard limit);
+    - at hard_limit, BudgetExceededError is raised and the row engine stops scheduling rows.
+
+    Thread safe.
+    """
+
+    def __init__(self, prices=None, soft_limit=None, hard_limit=None, max_delay=COST_THROTTLE_MAX_SECONDS):
+        self.prices = MODEL_PRICES_PER_1M_TOKENS if prices is None else prices
+        self.soft_limit = soft_limit
+        self.hard_limit = hard_limit
+        self.max_delay = max_delay
+        self.models = {}
+        self.total_cost = 0.0
+        self.lock = threading.Lock()
+        self._warned = set()
+
+    def price_prefix(self, model):
+        """Longest price table entry model starts with (after normalize_model_name), or None."""
+        model = normalize_model_name(model)
+        matches = [prefix for prefix in self.prices if model and model.startswith(prefix)]
+        return max(matches, key=len) if matches else None
+
+    def price(self, model):
+        """(input, output) USD per token for model, or (0.0, 0.0) when it is not in the price table."""
+        prefix = self.price_prefix(model)
+        if prefix is not None:
+            input_price, output_price = self.prices[prefix]
+            return input_price / 1_000_000, output_price / 1_000_000
+        if model not in self._warned:
+            self._warned.add(model)
+            print(f"No price for model {model}: counted as free")
+        return 0.0, 0.0
+
+    def token_costs(self, model, input_tokens, output_tokens, price_factor=1.0):
+        """(input_cost, output_cost) in USD of a request, without recording it."""
+        input_price, output_price = self.price(model)
+        return ((input_tokens or 0) * input_price * price_factor,
+                (output_tokens or 0) * output_price * price_factor)
+
+    def record(self, model, input_tokens, output_tokens, price_factor=1.0):
+        """Add one request to the ledger and return its cost."""
+        input_cost, output_cost = self.token_costs(model, input_tokens, output_tokens, price_factor)
+        cost = input_cost + output_cost
+        with self.lock:
+            entry = self.models.setdefault(normalize_model_name(model) or "unknown", {"calls": 0, "input_tokens": 0, "output_tokens": 0, "cost": 0.0})
+            entry["calls"] += 1
+            entry["input_tokens"] += input_tokens or 0
+            entry["output_tokens"] += output_tokens or 0
+            entry["cost"] += cost
+            previous_total = self.total_cost
+            self.total_cost += cost
+        if self.soft_limit is not None and previous_total < self.soft_limit <= self.total_cost:
+            print(f"Soft spend ceiling reached (${self.total_cost:.2f} >= ${self.soft_limit:.2f}): slowing down requests")
+        return cost
+
+    def record_response(self, response, price_factor=1.0):
+        """Record the usage reported by a response (cache hits are free and skipped)."""
+        if response is None or is_cached_response(response):
+            return 0.0
+        input_tokens, output_tokens = extract_token_counts(response)
+        if input_tokens is None and output_tokens is None:
+            return 0.0
+        return self.record(response_model_name(response), input_tokens, output_tokens, price_factor)
+
+    @property
+    def exhausted(self):
+        return self.hard_limit is not None and self.total_cost >= self.hard_limit
+
+    def throttle_delay(self):
+        """Seconds to wait before the next request given the spend so far."""
+        if self.soft_limit is None or self.total_cost < self.soft_limit:
+            return 0.0
+        if self.hard_limit is None or self.hard_limit <= self.soft_limit:
+            return self.max_delay
+        return self.max_delay * min(1.0, (self.total_cost - self.soft_limit) / (self.hard_limit - self.soft_limit))
+
+    def before_call(self):
+        """Raise BudgetExceededError at the hard ceiling, otherwise return the throttle delay."""
+        if self.exhausted:
+            raise BudgetExceededError(f"Hard spend ceiling reached: ${self.total_cost:.2f} >= ${self.hard_limit:.2f}")
+        return self.throttle_delay()
+
+    def wait_before_call(self):
+        delay = self.before_call()
+        if delay > 0:
+            time.sleep(delay)
+
+    async def await_before_call(self):
+        import asyncio
+
+        delay = self.before_call()
+        if delay > 0:
+            await asyncio.sleep(delay)
+
+    def summary(self):
+        """Per-model spend as a DataFrame, most expensive first."""
+        import pandas as pd
+
+        with self.lock:
+            rows = [{"model": model, **entry} for model, entry in self.models.items()]
+        summary = pd.DataFrame(rows, columns=["model", "calls", "input_tokens", "output_tokens", "cost"])
+        return summary.sort_values("cost", ascending=False, ignore_index=True)
+
+    def write_summary(self, path):
+        """Write the per-model spend to path (CSV) and the totals and ceilings to the matching .json."""
+        os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+        self.summary().to_csv(path, index=False)
+        with open(os.path.splitext(path)[0] + ".json", "w", encoding="utf-8") as file:
+            json.dump({"total_cost": self.total_cost, "soft_limit": self.soft_limit, "hard_limit": self.hard_limit,
+                       "exhausted": self.exhausted}, file, indent=2)
+        print(f"Spend: ${self.total_cost:.4f} over {len(self.models)} models, summary saved to {path}")
+
+    def reset(self):
+        with self.lock:
+            self.models = {}
+            self.total_cost = 0.0
+
+
+_cost_ledger = None
+_cost_ledger_lock = threading.Lock()
+
+
+def get_cost_ledger():
+    """Ledger shared by every pipeline of the run, with the ceilings of config/settings.py (COST_*)."""
+    global _cost_ledger
+    with _cost_ledger_lock:
+        if _cost_ledger is None:
+            _cost_ledger = CostLedger(soft_limit=COST_SOFT_LIMIT_USD, hard_limit=COST_HARD_LIMIT_USD)
+        return _cost_ledger
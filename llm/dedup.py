@@ -0,0 +1,66 @@
+from llm.cache import make_cache_key
+
+
+def request_key(model_id, messages):
+    """Content hash of one chat request: model id and rendered messages (LangChain messages or role/content dicts)."""
+    rendered = [
+        (message["role"], message["content"]) if isinstance(message, dict) else (message.type, message.content)
+        for message in messages
+    ]
+    return make_cache_key(model_id, rendered)
+
+
+class RequestPlan:
+    """
+    Rows grouped by identical request, built before anything is sent.
+
+    add() each row with its request_key() and rendered request: the first row of every group is a
+    leader and is the only one sent, with the request kept for it (request_for()), so the payload is
+    rendered once and is exactly what the key was computed from; the others follow it and get its
+    response (rows_for()). Identical requests sent at the
+    same time would all miss the response cache, so this is what keeps them to one call; requests
+    repeated in a later plan (next input chunk, another experiment) are answered by the cache.
+    """
+
+    def __init__(self):
+        self.leader_by_key = {}
+        self.groups = {}  # leader idx -> [leader idx, follower idx, ...]
+        self.requests = {}  # leader idx -> rendered request
+        self.rows = 0
+
+    def add(self, idx, key, request=None):
+        """Register row idx; returns True when it is a leader (its request must be sent)."""
+        self.rows += 1
+        leader = self.leader_by_key.get(key)
+        if leader is None:
+            self.leader_by_key[key] = idx
+            self.groups[idx] = [idx]
+            self.requests[idx] = request
+            return True
+        self.groups[leader].append(idx)
+        return False
+
+    def is_leader(self, idx):
+        return idx in self.groups
+
+    def request_for(self, leader):
+        return self.requests[leader]
+
+    def rows_for(self, leader):
+        """Every row answered by the request of leader, leader first."""
+        return self.groups[leader]
+
+    @property
+    def unique(self):
+        return len(self.groups)
+
+    @property
+    def saved(self):
+        return self.rows - self.unique
+
+
+def print_plan_stats(name, rows, unique):
+    """Rows, unique requests and calls saved over every plan of a run."""
+    saved = rows - unique
+    rate = saved / rows * 100 if rows else 0.0
+    print(f"Request plan for {name}: {rows} rows, {unique} unique requests, {saved} calls saved ({rate:.1f}%)")
@@ -0,0 +1,197 @@
+import hashlib
+import os
+import re
+import sqlite3
+import threading
+
+import numpy as np
+
+from config.settings import EMBED_BATCH_SIZE, EMBEDDINGS_DIR
+from llm.rate_limit import get_rate_limiter
+
+
+def text_hash(text):
+    """Content hash of a text, the key of its vector in an EmbeddingStore."""
+    return hashlib.blake2b(text.encode("utf-8"), digest_size=16).hexdigest()
+
+
+def is_text(text):
+    # Missing values (failed responses) and empty strings are not sent: providers reject empty inputs
+    return isinstance(text, str) and bool(text.strip())
+
+
+# ---- 1/ Stand-in embedder
+class HashingEmbedder:
+    """
+    Offline stand-in for an embedding model, with the embed_documents / embed_query interface of
+    LangChain embeddings.
+
+    Vectors are L2-normalised bags of hashed, lowercased words (dim buckets): deterministic, and texts
+    sharing words get a positive cosine similarity. Counts its requests and texts, to check batching
+    and deduplication without a provider (scripts/check_embeddings.py).
+    """
+
+    def __init__(self, dim=256):
+        self.dim = dim
+        self.requests = 0
+        self.texts = 0
+
+    def _embed(self, text):
+        vector = np.zeros(self.dim, dtype=np.float32)
+        for word in re.findall(r"\w+", text.lower()):
+            digest = hashlib.blake2b(word.encode("utf-8"), digest_size=8).digest()
+            bucket = int.from_bytes(digest[:4], "little") % self.dim
+            vector[bucket] += 1.0 if digest[4] & 1 else -1.0
+        norm = np.linalg.norm(vector)
+        return (vector / norm if norm else vector).tolist()
+
+    def embed_documents(self, texts):
+        self.requests += 1
+        self.texts += len(texts)
+        return [self._embed(text) for text in texts]
+
+    def embed_query(self, text):
+        return self.embed_documents([text])[0]
+
+
+# ---- 2/ Store
+class EmbeddingStore:
+    """
+    Vectors of one embedding model, computed once per distinct text.
+
+    Stored in a directory: vectors.f32, an append-only float32 matrix (one row per text, memory-mapped
+    for reading), and index.sqlite, the text hash -> row index. embed() only sends the texts that are
+    not in the store yet, deduplicated and in requests of batch_size texts, through the provider's
+    rate limiter; each request is appended and indexed before the next one is sent, so an interrupted
+    run keeps what it paid for. The model id is recorded on creation, and opening the store with
+    another model raises ValueError (its vectors would not be comparable).
+
+    Thread safe within a process.
+    """
+
+    def __init__(self, path, embedder, model_id, batch_size=EMBED_BATCH_SIZE, provider=None):
+        self.path = path
+        self.embedder = embedder
+        self.model_id = model_id
+        self.batch_size = batch_size
+        self.provider = provider
+        self.lock = threading.Lock()
+        self.sent = 0  # texts embedded by this instance
+        self.reused = 0  # texts answered from the store
+
+        os.makedirs(path, exist_ok=True)
+        self.vectors_path = os.path.join(path, "vectors.f32")
+        self.conn = sqlite3.connect(os.path.join(path, "index.sqlite"), check_same_thread=False, timeout=30)
+        self.conn.execute("CREATE TABLE IF NOT EXISTS meta (key TEXT PRIMARY KEY, value TEXT NOT NULL)")
+        self.conn.execute("CREATE TABLE IF NOT EXISTS vectors (hash TEXT PRIMARY KEY, row INTEGER NOT NULL)")
+        self.conn.commit()
+
+        meta = dict(self.conn.execute("SELECT key, value FROM meta").fetchall())
+        if meta.get("model_id", model_id) != model_id:
+            raise ValueError(f"Embedding store {path} holds vectors of {meta['model_id']}, not {model_id}")
+        self.dim = int(meta["dim"]) if "dim" in meta else None
+        self.rows = self.conn.execute("SELECT COUNT(*) FROM vectors").fetchone()[0]
+        # Rows appended by a run interrupted before it indexed them are dropped: the file is cut to the
+        # committed rows (to nothing when the first batch was never indexed and the dimension is unknown)
+        committed_bytes = self.rows * (self.dim or 0) * 4
+        if os.path.exists(self.vectors_path) and os.path.getsize(self.vectors_path) > committed_bytes:
+            with open(self.vectors_path, "r+b") as file:
+                file.truncate(committed_bytes)
+        self._vectors = None
+
+    def __len__(self):
+        return self.rows
+
+    def __contains__(self, text):
+        if not is_text(text):
+            return False
+        digest = text_hash(text)
+        with self.lock:
+            return digest in self._lookup([digest])
+
+    @property
+    def vectors(self):
+        """Read-only (rows, dim) float32 memory map of every stored vector."""
+        with self.lock:
+            if self._vectors is None or len(self._vectors) != self.rows:
+                if not self.rows:
+                    return np.empty((0, self.dim or 0), dtype=np.float32)
+                self._vectors = np.memmap(self.vectors_path, dtype=np.float32, mode="r", shape=(self.rows, self.dim))
+            return self._vectors
+
+    def _lookup(self, hashes):
+        found = {}
+        hashes = list(hashes)
+        for start in range(0, len(hashes), 500):  # SQLite limit on query parameters
+            batch = hashes[start:start + 500]
+            query = f"SELECT hash, row FROM vectors WHERE hash IN ({','.join('?' * len(batch))})"
+            found.update(self.conn.execute(query, batch).fetchall())
+        return found
+
+    def _append(self, hashes, vectors):
+        vectors = np.asarray(vectors, dtype=np.float32)
+        if vectors.ndim != 2 or len(vectors) != len(hashes):
+            raise ValueError(f"Embedder returned {len(vectors)} vectors for {len(hashes)} texts")
+        if self.dim is None:
+            self.dim = vectors.shape[1]
+            self.conn.executemany("INSERT INTO meta (key, value) VALUES (?, ?)",
+                                  [("model_id", self.model_id), ("dim", str(self.dim))])
+        elif vectors.shape[1] != self.dim:
+            raise ValueError(f"Embedder returned vectors of dimension {vectors.shape[1]}, store has {self.dim}")
+        with open(self.vectors_path, "ab") as file:
+            file.write(vectors.tobytes())
+            file.flush()
+            os.fsync(file.fileno())
+        self.conn.executemany("INSERT INTO vectors (hash, row) VALUES (?, ?)",
+                              [(digest, self.rows + offset) for offset, digest in enumerate(hashes)])
+        self.conn.commit()
+        self.rows += len(hashes)
+
+    def rows_for(self, texts):
+        """
+        Store row of each text (an int array, -1 for missing texts or failed requests), embedding the
+        texts not stored yet. store.vectors[rows] gives the vectors without copying the whole matrix.
+        """
+        texts = list(texts)
+        hashes = [text_hash(text) if is_text(text) else None for text in texts]
+        with self.lock:
+            unique = dict.fromkeys(digest for digest in hashes if digest is not None)
+            found = self._lookup(unique)
+            pending = [digest for digest in unique if digest not in found]
+            texts_by_hash = {digest: text for digest, text in zip(hashes, texts) if digest in unique}
+            self.reused += len(unique) - len(pending)
+
+            limiter = get_rate_limiter(self.provider)
+            for start in range(0, len(pending), self.batch_size):
+                batch = pending[start:start + self.batch_size]
+                vectors = limiter.call(self.embedder.embed_documents, [texts_by_hash[digest] for digest in batch])
+                if vectors is None:
+                    print(f"Embedding request failed: {len(pending) - start} texts left without a vector")
+                    break
+                first_row = self.rows
+                self._append(batch, vectors)
+                found.update((digest, first_row + offset) for offset, digest in enumerate(batch))
+                self.sent += len(batch)
+        return np.array([found.get(digest, -1) if digest is not None else -1 for digest in hashes], dtype=np.int64)
+
+    def embed(self, texts):
+        """(len(texts), dim) float32 vectors of texts, NaN rows for missing texts (see rows_for)."""
+        rows = self.rows_for(texts)
+        vectors = np.full((len(rows), self.dim or 0), np.nan, dtype=np.float32)
+        if len(rows) and self.rows:
+            vectors[rows >= 0] = self.vectors[rows[rows >= 0]]
+        return vectors
+
+    def stats(self):
+        return {"path": self.path, "model_id": self.model_id, "rows": self.rows, "dim": self.dim,
+                "sent": self.sent, "reused": self.reused}
+
+    def close(self):
+        with self.lock:
+            self._vectors = None
+            self.conn.close()
+
+
+def open_embedding_store(model_id, embedder, **kwargs):
+    """Store of model_id under EMBEDDINGS_DIR (one directory per model)."""
+    return EmbeddingStore(os.path.join(EMBEDDINGS_DIR, re.sub(r"[^\w.-]+", "_", model_id)), embedder, model_id, **kwargs)
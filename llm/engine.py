@@ -0,0 +1,126 @@
+import asyncio
+import threading
+
+from tqdm import tqdm
+
+from config.settings import MAX_CONCURRENCY, PROVIDER_MAX_CONCURRENCY
+from llm.costs import BudgetExceededError
+
+
+# ---- 1/ Event loop helpers
+def run_sync(coro):
+    """
+    Run a coroutine to completion from synchronous code.
+
+    Uses asyncio.run when no loop is running; inside a running loop (e.g. a notebook)
+    the coroutine is run on a fresh loop in a helper thread instead.
+    """
+    try:
+        asyncio.get_running_loop()
+    except RuntimeError:
+        return asyncio.run(coro)
+
+    result = {}
+
+    def target():
+        try:
+            result["value"] = asyncio.run(coro)
+        except BaseException as e:
+            result["error"] = e
+
+    thread = threading.Thread(target=target)
+    thread.start()
+    thread.join()
+    if "error" in result:
+        raise result["error"]
+    return result["value"]
+
+
+# ---- 2/ Row engine
+async def run_rows_async(row_fn, jobs, max_concurrency=MAX_CONCURRENCY, on_result=None, desc=None, total=None,
+                         semaphore=None, position=None):
+    """
+    Run the coroutine function row_fn over jobs with at most max_concurrency calls in flight.
+
+    Args:
+        row_fn: async function called as row_fn(*args) for each job.
+        jobs: iterable of (idx, args) tuples. It is consumed lazily, so generators are fine.
+        max_concurrency (int): maximum number of rows being processed at the same time.
+        on_result: optional callback on_result(idx, result), called as each row completes.
+            Exceptions raised by row_fn are reported and passed on as a None result. A
+            BudgetExceededError (hard spend ceiling, see llm/costs.py) stops the run instead: the
+            rows not started yet are left out.
+        desc (str): progress bar description.
+        total (int): number of jobs, for the progress bar.
+        semaphore (asyncio.Semaphore): optional budget shared with other runs (e.g. all models of one
+            provider). Each row holds it while row_fn runs.
+        position (int): progress bar line, when several runs share the terminal.
+    """
+    jobs = iter(jobs)
+    max_concurrency = max(1, int(max_concurrency))
+    stopped = False
+
+    with tqdm(total=total, desc=desc, position=position) as progress:
+        async def worker():
+            nonlocal stopped
+            # Workers share the jobs iterator; next() never awaits so there is no race.
+            for idx, args in jobs:
+                if stopped:
+                    break
+                try:
+                    if semaphore is None:
+                        result = await row_fn(*args)
+                    else:
+                        async with semaphore:
+                            result = await row_fn(*args)
+                except BudgetExceededError as e:
+                    if not stopped:
+                        print(f"Stopping{f' {desc}' if desc else ''}: {str(e)}")
+                    stopped = True
+                    break
+                except Exception as e:
+                    print(f"Error processing row {idx}: {str(e)}")
+                    result = None
+                if on_result is not None:
+                    on_result(idx, result)
+                progress.update(1)
+
+        await asyncio.gather(*(worker() for _ in range(max_concurrency)))
+
+
+def run_rows(row_fn, jobs, max_concurrency=MAX_CONCURRENCY, on_result=None, desc=None, total=None):
+    """Blocking wrapper around run_rows_async."""
+    return run_sync(run_rows_async(row_fn, jobs, max_concurrency=max_concurrency, on_result=on_result, desc=desc, total=total))
+
+
+# ---- 3/ Model scheduler
+def create_provider_semaphores(llms, limits=None):
+    """
+    One concurrency budget per provider found in llms (see the "provider" key in llm/llm_config.py).
+
+    Must be called from the event loop that will use the semaphores.
+    """
+    limits = PROVIDER_MAX_CONCURRENCY if limits is None else limits
+    providers = {llm_data.get("provider", "default") for llm_data in llms.values()}
+    return {provider: asyncio.Semaphore(limits.get(provider, MAX_CONCURRENCY)) for provider in providers}
+
+
+async def run_models_async(model_coros):
+    """
+    Run one coroutine per model at the same time.
+
+    Args:
+        model_coros (dict): llm_name -> coroutine producing that model's results.
+
+    Returns:
+        dict: llm_name -> result, or None for a model whose run raised.
+    """
+    names = list(model_coros)
+    outputs = await asyncio.gather(*model_coros.values(), return_exceptions=True)
+    results = {}
+    for llm_name, output in zip(names, outputs):
+        if isinstance(output, BaseException):
+            print(f"Error processing {llm_name}: {str(output)}")
+            output = None
+        results[llm_name] = output
+    return results
@@ -0,0 +1,221 @@
+import asyncio
+import importlib.util
+import threading
+import weakref
+
+import httpx
+
+from config.settings import HTTP_MAX_CONNECTIONS, HTTP_MAX_KEEPALIVE_CONNECTIONS, HTTP_KEEPALIVE_EXPIRY_SECONDS, HTTP2_ENABLED
+
+
+def http2_available():
+    """HTTP/2 needs the optional h2 package (pip install httpx[http2])."""
+    return importlib.util.find_spec("h2") is not None
+
+
+# ---- 1/ Statistics
+class PoolStats:
+    """
+    Counters of one connection pool.
+
+    New TCP connections and TLS handshakes are counted from httpcore's trace events, so
+    requests - connections_opened is the number of requests served on a kept-alive connection.
+    """
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.requests = 0
+        self.responses = 0
+        self.errors = 0  # responses with a 4xx/5xx status
+        self.connections_opened = 0
+        self.tls_handshakes = 0
+
+    def add(self, counter, value=1):
+        with self.lock:
+            setattr(self, counter, getattr(self, counter) + value)
+
+    def trace(self, event_name):
+        if event_name == "connection.connect_tcp.complete":
+            self.add("connections_opened")
+        elif event_name == "connection.start_tls.complete":
+            self.add("tls_handshakes")
+
+
+def _open_connections(transport):
+    # httpcore's pool is private API: report what it exposes, nothing when it changes
+    pool = getattr(transport, "_pool", None)
+    connections = list(getattr(pool, "connections", None) or [])
+    idle = sum(1 for connection in connections if getattr(connection, "is_idle", lambda: False)())
+    return len(connections), idle
+
+
+class LoopLocalAsyncTransport(httpx.AsyncBaseTransport):
+    """
+    Async transport with one connection pool per event loop.
+
+    Async connections belong to the loop that opened them, and run_sync() may start a fresh loop
+    for every call (see llm/engine.py). Dispatching each request to the pool of the running loop
+    lets a single AsyncClient be handed to the model clients once and used from any loop.
+    """
+
+    def __init__(self, **transport_kwargs):
+        self.transport_kwargs = transport_kwargs
+        self.transports = weakref.WeakKeyDictionary()  # event loop -> AsyncHTTPTransport
+        self.lock = threading.Lock()
+
+    def _transport(self):
+        loop = asyncio.get_running_loop()
+        with self.lock:
+            transport = self.transports.get(loop)
+            if transport is None:
+                # Pools of loops that have been closed can no longer be used
+                for closed_loop in [other for other in self.transports if other.is_closed()]:
+                    del self.transports[closed_loop]
+                transport = httpx.AsyncHTTPTransport(**self.transport_kwargs)
+                self.transports[loop] = transport
+        return transport
+
+    async def handle_async_request(self, request):
+        return await self._transport().handle_async_request(request)
+
+    async def aclose(self):
+        with self.lock:
+            transport = self.transports.pop(asyncio.get_running_loop(), None)
+        if transport is not None:
+            await transport.aclose()
+
+    def open_connections(self):
+        with self.lock:
+            transports = list(self.transports.values())
+        counts = [_open_connections(transport) for transport in transports]
+        return sum(total for total, _ in counts), sum(idle for _, idle in counts)
+
+
+# ---- 2/ Pools
+class HttpClientPool:
+    """
+    Pooled httpx clients (sync and async) shared by every model talking to the same endpoint.
+
+    Connections are kept alive between requests (keepalive_expiry seconds), at most max_connections
+    are open per pool (max_keepalive_connections of them idle), and HTTP/2 is used when enabled and
+    the h2 package is installed. Timeouts are set per request by the provider SDKs. Clients are built
+    on first use; stats() reports requests, new connections and reuse. Thread safe.
+    """
+
+    def __init__(self, name, max_connections=HTTP_MAX_CONNECTIONS, max_keepalive_connections=HTTP_MAX_KEEPALIVE_CONNECTIONS,
+                 keepalive_expiry=HTTP_KEEPALIVE_EXPIRY_SECONDS, http2=HTTP2_ENABLED):
+        self.name = name
+        self.max_connections = max_connections
+        self.max_keepalive_connections = max_keepalive_connections
+        self.keepalive_expiry = keepalive_expiry
+        self.http2 = http2 and http2_available()
+        self.stats_counters = PoolStats()
+        self._client = None
+        self._async_client = None
+        self._lock = threading.Lock()
+
+    def _transport_kwargs(self):
+        limits = httpx.Limits(max_connections=self.max_connections, max_keepalive_connections=self.max_keepalive_connections,
+                              keepalive_expiry=self.keepalive_expiry)
+        return {"limits": limits, "http2": self.http2}
+
+    def _on_request(self, request):
+        self.stats_counters.add("requests")
+        request.extensions["trace"] = lambda event_name, info: self.stats_counters.trace(event_name)
+
+    async def _aon_request(self, request):
+        self.stats_counters.add("requests")
+
+        async def trace(event_name, info):
+            self.stats_counters.trace(event_name)
+
+        request.extensions["trace"] = trace
+
+    def _on_response(self, response):
+        self.stats_counters.add("responses")
+        if response.status_code >= 400:
+            self.stats_counters.add("errors")
+
+    async def _aon_response(self, response):
+        self._on_response(response)
+
+    @property
+    def client(self):
+        """httpx.Client, e.g. for http_client= of the OpenAI / AzureChatOpenAI clients."""
+        if self._client is None:
+            with self._lock:
+                if self._client is None:
+                    self._client = httpx.Client(
+                        transport=httpx.HTTPTransport(**self._transport_kwargs()),
+                        event_hooks={"request": [self._on_request], "response": [self._on_response]},
+                    )
+        return self._client
+
+    @property
+    def async_client(self):
+        """httpx.AsyncClient usable from any event loop, e.g. for http_async_client= of AzureChatOpenAI."""
+        if self._async_client is None:
+            with self._lock:
+                if self._async_client is None:
+                    transport = LoopLocalAsyncTransport(**self._transport_kwargs())
+                    self._async_client = httpx.AsyncClient(
+                        transport=transport,
+                        event_hooks={"request": [self._aon_request], "response": [self._aon_response]},
+                    )
+        return self._async_client
+
+    def stats(self):
+        counters = self.stats_counters
+        with counters.lock:
+            stats = {
+                "pool": self.name,
+                "http2": self.http2,
+                "requests": counters.requests,
+                "responses": counters.responses,
+                "errors": counters.errors,
+                "connections_opened": counters.connections_opened,
+                "tls_handshakes": counters.tls_handshakes,
+            }
+        stats["reused"] = max(0, stats["requests"] - stats["connections_opened"])
+        open_total, idle = 0, 0
+        if self._client is not None:
+            open_total, idle = _open_connections(self._client._transport)
+        if self._async_client is not None:
+            async_total, async_idle = self._async_client._transport.open_connections()
+            open_total, idle = open_total + async_total, idle + async_idle
+        stats["open_connections"] = open_total
+        stats["idle_connections"] = idle
+        return stats
+
+    def close(self):
+        """Close the sync client (async pools are closed with their event loop)."""
+        with self._lock:
+            if self._client is not None:
+                self._client.close()
+                self._client = None
+
+
+_http_pools = {}
+_http_pools_lock = threading.Lock()
+
+
+def get_http_pool(name):
+    """Shared HttpClientPool per endpoint name (e.g. "azure", "openai")."""
+    with _http_pools_lock:
+        if name not in _http_pools:
+            _http_pools[name] = HttpClientPool(name)
+        return _http_pools[name]
+
+
+def print_http_stats():
+    """One line per pool that sent requests."""
+    with _http_pools_lock:
+        pools = list(_http_pools.values())
+    for pool in pools:
+        stats = pool.stats()
+        if not stats["requests"]:
+            continue
+        reuse_rate = stats["reused"] / stats["requests"] * 100
+        print(f"HTTP pool {stats['pool']}: {stats['requests']} requests over {stats['connections_opened']} connections "
+              f"({reuse_rate:.1f}% reused, {stats['tls_handshakes']} TLS handshakes, {stats['errors']} errors, "
+              f"HTTP/{'2' if stats['http2'] else '1.1'}), {stats['open_connections']} open")
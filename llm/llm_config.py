@@ -1,3 +1,4 @@
+from llm.registry import ModelDescriptor, ModelRegistry
 from llm.models import (
     get_gpt3_model,
     get_gpt4o_model,
@@ -19,100 +20,117 @@ from llm.models import (
 )
 
 # ---- 2/ LLM definition ----
+# Clients are only built the first time llms[name]["model"] is used (see llm/registry.py)
 
-llms = {
+llms = ModelRegistry({
     # ----- OpenAI models -----
-    # "llm_gpt3": {
-    #     "model_name": "gpt3.5",
-    #     "model": get_gpt3_model(),
-    #     "type":'closed'
-    # },
-    "llm_gpt4o": {
-        "model_name": "gpt4o",
-        "model": get_gpt4o_model(),
-        "type":'closed'
-    },
-    # "llm_gpt4omini": {
-    #     "model_name": "gpt4o-mini",
-    #     "model": get_gpt4omini_model(),
-    #     "price_per_input_token": extract_price("PRICE_PER_INPUT_TOKEN_GPT4omini", costs_content),
-    #     "price_per_output_token": extract_price("PRICE_PER_OUTPUT_TOKEN_GPT4omini", costs_content)
-    # },
-    "llm_gpt4turbo": {
-        "model_name": "gpt4-turbo",
-        "model": get_gpt4turbo_model(),
-        "type":'closed'
-    },
+    # "llm_gpt3": ModelDescriptor(
+    #     model_name="gpt3.5",
+    #     factory=get_gpt3_model,
+    #     type='closed',
+    #     provider='azure',
+    # ),
+    "llm_gpt4o": ModelDescriptor(
+        model_name="gpt4o",
+        factory=get_gpt4o_model,
+        type='closed',
+        provider='azure',
+    ),
+    # "llm_gpt4omini": ModelDescriptor(
+    #     model_name="gpt4o-mini",
+    #     factory=get_gpt4omini_model,
+    #     price_per_input_token=extract_price("PRICE_PER_INPUT_TOKEN_GPT4omini", costs_content),
+    #     price_per_output_token=extract_price("PRICE_PER_OUTPUT_TOKEN_GPT4omini", costs_content)
+    # ),
+    "llm_gpt4turbo": ModelDescriptor(
+        model_name="gpt4-turbo",
+        factory=get_gpt4turbo_model,
+        type='closed',
+        provider='azure',
+    ),
     # ---- claude ----
-    "llm_haiku": {
-        "model_name": "claude-3-haiku",
-        "model": get_haiku(),
-        "type":'closed'
-    },
-    "llm_sonnet3_5": {
-        "model_name": "claude-3-sonnet3.5",
-        "model": get_sonnet3_5(),
-        "type":'closed'
-    },
+    "llm_haiku": ModelDescriptor(
+        model_name="claude-3-haiku",
+        factory=get_haiku,
+        type='closed',
+        provider='vertex',
+    ),
+    "llm_sonnet3_5": ModelDescriptor(
+        model_name="claude-3-sonnet3.5",
+        factory=get_sonnet3_5,
+        type='closed',
+        provider='vertex',
+    ),
     # ---- gemini flash
-    "llm_gemini_3_5_flash": {
-        "model_name": "gemini-3-5-flash",
-        "model": get_gemini_3_5_flash(),
-        "type":'closed'
-    },
+    "llm_gemini_3_5_flash": ModelDescriptor(
+        model_name="gemini-3-5-flash",
+        factory=get_gemini_3_5_flash,
+        type='closed',
+        provider='vertex',
+    ),
     # ==== OLLAMA
    # ----- Mixtral -----
-    "llm_mixtral_nemo": {
-        "model_name": "mistral-nemo",
-        "model": get_mistral_nemo(),
-        "type":'open'
-    },
-    # "llm_mixtral_8x22b": {
-    #     "model_name": "Mixtral-8x22B",
-    #     "model": get_mixtral_8x22b(),
-    #     "type":'open'
-    # },
-    "llm_mistral_7b": {
-        "model_name": "mistral-7b",
-        "model": get_mistral_7b(),
-        "type":'open'
-    },
+    "llm_mixtral_nemo": ModelDescriptor(
+        model_name="mistral-nemo",
+        factory=get_mistral_nemo,
+        type='open',
+        provider='ollama',
+    ),
+    # "llm_mixtral_8x22b": ModelDescriptor(
+    #     model_name="Mixtral-8x22B",
+    #     factory=get_mixtral_8x22b,
+    #     type='open',
+    #     provider='ollama',
+    # ),
+    "llm_mistral_7b": ModelDescriptor(
+        model_name="mistral-7b",
+        factory=get_mistral_7b,
+        type='open',
+        provider='ollama',
+    ),
     # ----- LLaMas -----
-    "llm_llama3_8b": {
-        "model_name": "llama3_8b",
-        "model": get_llama3_8b(),
-        "type":'open'
-    },
-    # "llm_llama3_70b": {
-    #     "model_name": "llama3_70b",
-    #     "model": get_llama3_70b(),
-    #     "type":'open'
-    # },
-    "llm_llama3_1_8b": {
-        "model_name": "llama3_1_8b",
-        "model": get_llama3_1_8b(),
-        "type":'open'
-    },
+    "llm_llama3_8b": ModelDescriptor(
+        model_name="llama3_8b",
+        factory=get_llama3_8b,
+        type='open',
+        provider='ollama',
+    ),
+    # "llm_llama3_70b": ModelDescriptor(
+    #     model_name="llama3_70b",
+    #     factory=get_llama3_70b,
+    #     type='open',
+    #     provider='ollama',
+    # ),
+    "llm_llama3_1_8b": ModelDescriptor(
+        model_name="llama3_1_8b",
+        factory=get_llama3_1_8b,
+        type='open',
+        provider='ollama',
+    ),
     # ----- GEMMA -----
-    "llm_llm_gemma2_2b": {
-        "model_name": "gemma-2-2b",
-        "model": get_gemma2_2b(),
-        "type":'open'
-    },
-    "llm_gemma2_9b": {
-        "model_name": "gemma-2-9b",
-        "model": get_gemma2_9b(),
-        "type":'open'
-    },
+    "llm_llm_gemma2_2b": ModelDescriptor(
+        model_name="gemma-2-2b",
+        factory=get_gemma2_2b,
+        type='open',
+        provider='ollama',
+    ),
+    "llm_gemma2_9b": ModelDescriptor(
+        model_name="gemma-2-9b",
+        factory=get_gemma2_9b,
+        type='open',
+        provider='ollama',
+    ),
     # === NVIDIA
-    "llm_nvidia_llama3.1_403b": {
-        "model_name": "llama3.1-403b",
-        "model": get_nvidia_llama3_1_403b(),
-        "type":'nvidia',
-    },
-    "llm_nvidia_llama3.70b": {
-        "model_name": "llama3-70b",
-        "model": get_nvidia_llama3_70b(),
-        "type":'nvidia',
-    },
-}
\ No newline at end of file
+    "llm_nvidia_llama3.1_403b": ModelDescriptor(
+        model_name="llama3.1-403b",
+        factory=get_nvidia_llama3_1_403b,
+        type='nvidia',
+        provider='nvidia',
+    ),
+    "llm_nvidia_llama3.70b": ModelDescriptor(
+        model_name="llama3-70b",
+        factory=get_nvidia_llama3_70b,
+        type='nvidia',
+        provider='nvidia',
+    ),
+})
@@ -1,22 +1,31 @@
 from config.settings import TEMPERATURE
+# Provider SDKs are imported inside the loaders, so that only the providers actually used get imported
+
 #---- 1/ OpenAI models ----
 
-from langchain_openai import AzureChatOpenAI
 from config.settings import AZURE_OPENAI_API_VERSION, AZURE_OPENAI_CHAT_DEPLOYMENT_NAME_GPT3
 from config.settings import AZURE_OPENAI_CHAT_DEPLOYMENT_NAME_GPT4o
 # from config.settings import AZURE_OPENAI_CHAT_DEPLOYMENT_NAME_GPT4omini
 from config.settings import AZURE_OPENAI_CHAT_DEPLOYMENT_NAME_GPT4turbo
 
+def load_azure_model(deployment):
+    from langchain_openai import AzureChatOpenAI
+    from llm.http_pool import get_http_pool
+    # All deployments live on the same endpoint: they share its kept-alive connections (see llm/http_pool.py)
+    http_pool = get_http_pool("azure")
+    return AzureChatOpenAI(
+        openai_api_version=AZURE_OPENAI_API_VERSION,
+        azure_deployment=deployment,
+        temperature=TEMPERATURE,
+        http_client=http_pool.client,
+        http_async_client=http_pool.async_client
+    )
 # -------
 
 def get_gpt3_model():
     print(f"API Version: {AZURE_OPENAI_API_VERSION}")
     print(f"Deployment: {AZURE_OPENAI_CHAT_DEPLOYMENT_NAME_GPT3}")
-    return AzureChatOpenAI(
-        openai_api_version=AZURE_OPENAI_API_VERSION,
-        azure_deployment=AZURE_OPENAI_CHAT_DEPLOYMENT_NAME_GPT3,
-        temperature=TEMPERATURE
-    )
+    return load_azure_model(AZURE_OPENAI_CHAT_DEPLOYMENT_NAME_GPT3)
     
 # def get_gpt3_model():
 #     return AzureChatOpenAI(
@@ -26,11 +35,7 @@ def get_gpt3_model():
 #     )
     
 def get_gpt4o_model():
-    return AzureChatOpenAI(
-        openai_api_version=AZURE_OPENAI_API_VERSION,
-        azure_deployment=AZURE_OPENAI_CHAT_DEPLOYMENT_NAME_GPT4o,
-        temperature=TEMPERATURE
-    )
+    return load_azure_model(AZURE_OPENAI_CHAT_DEPLOYMENT_NAME_GPT4o)
     
 # def get_gpt4omini_model():
 #     return AzureChatOpenAI(
@@ -40,20 +45,36 @@ def get_gpt4o_model():
 #     )
     
 def get_gpt4turbo_model():
-    return AzureChatOpenAI(
+    return load_azure_model(AZURE_OPENAI_CHAT_DEPLOYMENT_NAME_GPT4turbo)
+
+# ----- Embeddings -----
+from config.settings import AZURE_OPENAI_CHAT_DEPLOYMENT_NAME_EMBED_LARG, EMBED_BATCH_SIZE
+
+def get_embed_larg_model():
+    # Batched and cached on disk by llm/embeddings.py (EmbeddingStore)
+    from langchain_openai import AzureOpenAIEmbeddings
+    from llm.http_pool import get_http_pool
+    http_pool = get_http_pool("azure")
+    return AzureOpenAIEmbeddings(
         openai_api_version=AZURE_OPENAI_API_VERSION,
-        azure_deployment=AZURE_OPENAI_CHAT_DEPLOYMENT_NAME_GPT4turbo,
-        temperature=TEMPERATURE
+        azure_deployment=AZURE_OPENAI_CHAT_DEPLOYMENT_NAME_EMBED_LARG,
+        chunk_size=EMBED_BATCH_SIZE,
+        http_client=http_pool.client,
+        http_async_client=http_pool.async_client
     )
 
 #---- 2/ Open-source models ----
 
-from langchain_community.chat_models import ChatOllama
-
 # Function to load a HuggingFace model
 def load_ollama_model(model_name):
+    from langchain_community.chat_models import ChatOllama
+    from llm.ollama_pool import get_ollama_pool
+    # Each model sticks to one of the OLLAMA_HOSTS and stays loaded there (see llm/ollama_pool.py)
+    ollama_pool = get_ollama_pool()
     return ChatOllama(
     model=model_name,
+    base_url=ollama_pool.host_for(model_name),
+    keep_alive=ollama_pool.keep_alive,
     temperature=TEMPERATURE
 )
 # -------
@@ -86,14 +107,11 @@ def get_gemma2_9b():
 
 # --- 3/Vertex models ---
 
-from langchain_google_vertexai.model_garden import ChatAnthropicVertex
-from langchain_google_vertexai import ChatVertexAI
-
-
 project ="gifted-course-432415-m9"
 location="europe-west1"
 
 def load_anthropic_model(name):
+    from langchain_google_vertexai.model_garden import ChatAnthropicVertex
     return ChatAnthropicVertex(model_name=name, temperature=TEMPERATURE, project=project, location=location)
 
 # ----- Anthropic ----
@@ -107,6 +125,7 @@ def get_sonnet3_5():
 # ----- Gemini ----
 
 def load_gemini_model(name):
+    from langchain_google_vertexai import ChatVertexAI
     return ChatVertexAI(model_name=name, temperature=TEMPERATURE)
 
 def get_gemini_3_5_flash():
@@ -131,13 +150,13 @@ def get_gemini_3_5_flash():
 #               NVIDIA MODELS
 # =================================================
 from config.settings import NVIDIA_API_KEY
-from langchain_nvidia_ai_endpoints import ChatNVIDIA
 
 def load_nvidia_model(name):
+    from langchain_nvidia_ai_endpoints import ChatNVIDIA
     return ChatNVIDIA(model=name, api_key=NVIDIA_API_KEY , temperature=TEMPERATURE)
 
 # --
-def get_nvidia_llama3.1_403b():
+def get_nvidia_llama3_1_403b():
     return load_nvidia_model("meta / llama-3.1-405b-instruct")
 
 def get_nvidia_llama3_70b():
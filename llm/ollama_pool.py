@@ -0,0 +1,121 @@
+import asyncio
+import threading
+import time
+import weakref
+
+from config.settings import OLLAMA_HOSTS, OLLAMA_KEEP_ALIVE, OLLAMA_WARMUP_TIMEOUT_SECONDS, PROVIDER_MAX_CONCURRENCY
+
+
+def normalize_host(host):
+    """OLLAMA_HOST style "127.0.0.1:11434" -> "http://127.0.0.1:11434"."""
+    host = host.strip().rstrip("/")
+    return host if "://" in host else f"http://{host}"
+
+
+class OllamaHostPool:
+    """
+    Ollama servers shared by the open models.
+
+    Each model is pinned to one host (the one with the fewest models when it is first seen), so its
+    weights stay loaded there, and models spread over the hosts. On a host the models run one after
+    another (run_on_host): the next model only starts once the previous one has finished all its rows,
+    so models never evict each other's weights mid-run. Before its rows are scheduled a model is loaded
+    with an empty generate request, and keep_alive keeps it in memory between requests.
+    Per host at most max_concurrency requests are in flight.
+    """
+
+    def __init__(self, hosts=None, keep_alive=OLLAMA_KEEP_ALIVE, max_concurrency=None, warmup_timeout=OLLAMA_WARMUP_TIMEOUT_SECONDS):
+        self.hosts = [normalize_host(host) for host in (OLLAMA_HOSTS if hosts is None else hosts)]
+        if not self.hosts:
+            raise ValueError("No Ollama host configured (OLLAMA_HOSTS / OLLAMA_HOST)")
+        self.keep_alive = keep_alive
+        self.max_concurrency = max_concurrency or PROVIDER_MAX_CONCURRENCY.get('ollama', 4)
+        self.warmup_timeout = warmup_timeout
+        self.assignments = {}  # model name -> host
+        self.lock = threading.Lock()
+        self._loop_state = weakref.WeakKeyDictionary()  # event loop -> {"locks": {host: Lock}, "semaphores": {host: Semaphore}}
+
+    # ---- Host assignment
+    def host_for(self, model_name):
+        with self.lock:
+            host = self.assignments.get(model_name)
+            if host is None:
+                load = {host: 0 for host in self.hosts}
+                for assigned in self.assignments.values():
+                    load[assigned] += 1
+                host = min(self.hosts, key=lambda candidate: load[candidate])
+                self.assignments[model_name] = host
+            return host
+
+    def _state(self):
+        loop = asyncio.get_running_loop()
+        with self.lock:
+            state = self._loop_state.get(loop)
+            if state is None:
+                state = {"locks": {}, "semaphores": {}}
+                self._loop_state[loop] = state
+        return state
+
+    def semaphore(self, host):
+        """Concurrency budget of host, for the running event loop."""
+        return self._state()["semaphores"].setdefault(host, asyncio.Semaphore(self.max_concurrency))
+
+    # ---- Model loading
+    async def awarm_up(self, model_name, host=None):
+        """Load model_name on its host (empty generate request) and keep it loaded for keep_alive."""
+        from llm.http_pool import get_http_pool
+
+        host = host or self.host_for(model_name)
+        start_time = time.time()
+        try:
+            response = await get_http_pool("ollama").async_client.post(
+                f"{host}/api/generate", json={"model": model_name, "keep_alive": self.keep_alive}, timeout=self.warmup_timeout
+            )
+            response.raise_for_status()
+        except Exception as e:
+            # Not fatal: the first request loads the model instead
+            print(f"Warm-up of {model_name} on {host} failed: {str(e)}")
+            return False
+        print(f"Loaded {model_name} on {host} in {time.time() - start_time:.1f}s (keep_alive={self.keep_alive})")
+        return True
+
+    async def run_on_host(self, model_name, coro, host=None):
+        """Await coro (the run of model_name) once the host is free, after warming the model up."""
+        host = host or self.host_for(model_name)
+        async with self._state()["locks"].setdefault(host, asyncio.Lock()):
+            await self.awarm_up(model_name, host)
+            return await coro
+
+
+_ollama_pool = None
+_ollama_pool_lock = threading.Lock()
+
+
+def get_ollama_pool():
+    """Host pool of the run, from OLLAMA_HOSTS (comma separated) or OLLAMA_HOST."""
+    global _ollama_pool
+    with _ollama_pool_lock:
+        if _ollama_pool is None:
+            _ollama_pool = OllamaHostPool()
+        return _ollama_pool
+
+
+async def _run_ollama_model(llm_data, semaphore, make_coro):
+    llm = llm_data.get("model")
+    if llm is None:
+        return await make_coro(semaphore=semaphore)
+    pool = get_ollama_pool()
+    host = normalize_host(getattr(llm, "base_url", None) or pool.host_for(llm.model))
+    return await pool.run_on_host(llm.model, make_coro(semaphore=pool.semaphore(host)), host=host)
+
+
+def schedule_model(llm_data, semaphore, make_coro):
+    """
+    Coroutine for the run of one model, built by make_coro(semaphore=...).
+
+    Other providers get semaphore as is. Ollama models get the concurrency budget of their host
+    instead and go through OllamaHostPool.run_on_host (one model at a time per host, warmed up first).
+    """
+    if llm_data.get("provider") != "ollama":
+        return make_coro(semaphore=semaphore)
+    return _run_ollama_model(llm_data, semaphore, make_coro)
@@ -0,0 +1,182 @@
+import hashlib
+import json
+import os
+import time
+
+from config.settings import OPENAI_API_KEY, OPENAI_BASE_URL, OPENAI_BATCH_POLL_SECONDS
+from llm.cache import get_response_cache, chat_completion_cache_key
+from llm.costs import get_cost_ledger
+
+CHAT_COMPLETIONS_ENDPOINT = "/v1/chat/completions"
+FINAL_BATCH_STATUSES = {"completed", "failed", "expired", "cancelled"}
+BATCH_PRICE_DISCOUNT = 0.5  # Batch API requests are billed at half price
+
+
+def make_openai_client(api_key=None, base_url=None, **kwargs):
+    """
+    OpenAI client; base_url (or OPENAI_BASE_URL) points it at another server, e.g. a local stand-in.
+
+    Requests go through the shared "openai" connection pool (see llm/http_pool.py) unless http_client is given.
+    """
+    from openai import OpenAI
+    from llm.http_pool import get_http_pool
+
+    kwargs.setdefault("http_client", get_http_pool("openai").client)
+    return OpenAI(api_key=api_key or OPENAI_API_KEY, base_url=base_url or OPENAI_BASE_URL, **kwargs)
+
+
+# ---- 1/ Batch input
+def batch_request_line(custom_id, body, endpoint=CHAT_COMPLETIONS_ENDPOINT):
+    return {"custom_id": str(custom_id), "method": "POST", "url": endpoint, "body": body}
+
+
+def write_batch_file(requests, path, endpoint=CHAT_COMPLETIONS_ENDPOINT):
+    """
+    Write requests ({custom_id: request body}) as a Batch API input file, one request per line.
+
+    Returns the sha256 of the file, which identifies the batch content.
+    """
+    os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+    digest = hashlib.sha256()
+    with open(path, "w", encoding="utf-8") as file:
+        for custom_id, body in requests.items():
+            line = json.dumps(batch_request_line(custom_id, body, endpoint), ensure_ascii=False) + "\n"
+            file.write(line)
+            digest.update(line.encode("utf-8"))
+    return digest.hexdigest()
+
+
+# ---- 2/ Submission and polling
+def submit_batch(client, input_path, endpoint=CHAT_COMPLETIONS_ENDPOINT, completion_window="24h", metadata=None):
+    with open(input_path, "rb") as file:
+        input_file = client.files.create(file=file, purpose="batch")
+    return client.batches.create(
+        input_file_id=input_file.id,
+        endpoint=endpoint,
+        completion_window=completion_window,
+        metadata=metadata,
+    )
+
+
+def wait_for_batch(client, batch_id, poll_interval=None, timeout=None):
+    """Poll a batch until it reaches a final status (or timeout seconds pass) and return it."""
+    poll_interval = OPENAI_BATCH_POLL_SECONDS if poll_interval is None else poll_interval
+    start_time = time.time()
+    while True:
+        batch = client.batches.retrieve(batch_id)
+        counts = batch.request_counts
+        progress = f" ({counts.completed}/{counts.total} done, {counts.failed} failed)" if counts is not None else ""
+        print(f"Batch {batch_id}: {batch.status}{progress}")
+        if batch.status in FINAL_BATCH_STATUSES:
+            return batch
+        if timeout is not None and time.time() - start_time > timeout:
+            raise TimeoutError(f"Batch {batch_id} still {batch.status} after {timeout} seconds")
+        time.sleep(poll_interval)
+
+
+# ---- 3/ Results
+def _read_file_lines(client, file_id):
+    if not file_id:
+        return []
+    content = client.files.content(file_id).text
+    return [json.loads(line) for line in content.splitlines() if line.strip()]
+
+
+def read_batch_results(client, batch):
+    """
+    Completions of a finished batch by custom_id.
+
+    Successful requests give a ChatCompletion; failed ones (error file, non-200 status) give None
+    and are reported.
+    """
+    from openai.types.chat import ChatCompletion
+
+    results = {}
+    for line in _read_file_lines(client, batch.output_file_id) + _read_file_lines(client, batch.error_file_id):
+        custom_id = line.get("custom_id")
+        response = line.get("response") or {}
+        if line.get("error") or response.get("status_code") != 200:
+            print(f"Batch request {custom_id} failed: {line.get('error') or response.get('body')}")
+            results[custom_id] = None
+            continue
+        results[custom_id] = ChatCompletion.model_validate(response["body"])
+    return results
+
+
+# ---- 4/ Runner
+def run_batch(requests, input_path, client=None, state_path=None, poll_interval=None, timeout=None,
+              completion_window="24h", use_cache=True):
+    """
+    Send chat completion requests through the Batch API and return {custom_id: ChatCompletion or None}.
+
+    Args:
+        requests (dict): custom_id -> chat.completions request body (model, messages, ...).
+        input_path (str): where the batch input JSONL is written.
+        client: OpenAI client (see make_openai_client), e.g. one pointed at a local stand-in server.
+        state_path (str): JSON file recording the submitted batch. If the same input was already submitted,
+            the run waits for that batch instead of submitting it again (e.g. after an interrupted poll),
+            unless it failed, expired or was cancelled.
+        poll_interval (float): seconds between status checks (default OPENAI_BATCH_POLL_SECONDS).
+        timeout (float): give up polling after this many seconds (the batch keeps running).
+        use_cache (bool): answer requests from the response cache when possible and store the batch
+            results in it, so batch and synchronous runs share completions.
+    """
+    client = client or make_openai_client()
+    cache = get_response_cache() if use_cache else None
+
+    # Cached requests never leave the machine
+    results = {}
+    pending = {}
+    for custom_id, body in requests.items():
+        value = cache.get(chat_completion_cache_key(body)) if cache is not None else None
+        if value is not None:
+            from openai.types.chat import ChatCompletion
+            results[str(custom_id)] = ChatCompletion.model_validate_json(value)
+        else:
+            pending[str(custom_id)] = body
+    print(f"Batch: {len(results)} requests answered from the cache, {len(pending)} to submit")
+    if not pending:
+        return results
+    if cache is not None and cache.read_only:
+        print(f"Skipping {len(pending)} requests: response cache is read-only")
+        return {**results, **{custom_id: None for custom_id in pending}}
+
+    input_hash = write_batch_file(pending, input_path)
+    ledger = get_cost_ledger()
+
+    # Reattach to a batch already submitted for this exact input
+    batch_id = None
+    if state_path is not None and os.path.exists(state_path):
+        with open(state_path, "r", encoding="utf-8") as file:
+            state = json.load(file)
+        if state.get("input_hash") == input_hash:
+            status = client.batches.retrieve(state["batch_id"]).status
+            if status in FINAL_BATCH_STATUSES and status != "completed":
+                # failed / expired / cancelled: its requests are submitted again in a new batch
+                print(f"Batch {state['batch_id']} ended with status {status}: submitting the requests again")
+                os.remove(state_path)
+            else:
+                batch_id = state["batch_id"]
+                print(f"Resuming batch {batch_id} ({status})")
+    if batch_id is None:
+        ledger.before_call()  # no new batch once the hard spend ceiling is reached
+        batch = submit_batch(client, input_path, completion_window=completion_window)
+        batch_id = batch.id
+        print(f"Submitted batch {batch_id} ({len(pending)} requests)")
+        if state_path is not None:
+            with open(state_path, "w", encoding="utf-8") as file:
+                json.dump({"batch_id": batch_id, "input_hash": input_hash, "input_path": input_path}, file)
+
+    batch = wait_for_batch(client, batch_id, poll_interval=poll_interval, timeout=timeout)
+    if batch.status != "completed":
+        print(f"Batch {batch_id} ended with status {batch.status}")
+
+    batch_results = read_batch_results(client, batch)
+    for custom_id, body in pending.items():
+        completion = batch_results.get(custom_id)
+        if completion is not None:
+            ledger.record_response(completion, price_factor=BATCH_PRICE_DISCOUNT)
+            if cache is not None:
+                cache.put(chat_completion_cache_key(body), completion.model_dump_json())
+        results[custom_id] = completion
+    return results
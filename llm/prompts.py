@@ -1,47 +1,134 @@
+import hashlib
 import os
+import threading
+
+PROMPTS_DIR = os.path.join(os.path.dirname(os.path.dirname(__file__)), 'prompts')
+
+# Prompt text name -> (folder under prompts/, file name)
+PROMPT_FILES = {
+    # ============ PIPELINE 0
+    # Experiment 0
+    'exp0_system_prompt': ('prompt0', 'exp0_system_prompt.txt'),
+    'exp0_user_prompt': ('prompt0', 'exp0_user_prompt.txt'),
+
+    # ============ PIPELINE 1
+    # Experiment 1
+    'exp1_system_prompt': ('prompt1', 'exp1_system_prompt.txt'),
+    'exp1_user_prompt': ('prompt1', 'exp1_user_prompt.txt'),
+    'exp1_specific_question': ('prompt1', 'exp1_specific_question.txt'),
+
+    # ============ PIPELINE 2
+    # Experiment 2
+    'exp2_system_prompt': ('prompt2', 'exp2_system_prompt.txt'),
+    'exp2_user_prompt': ('prompt2', 'exp2_user_prompt.txt'),
+    # Experiment 3
+    'exp3_system_prompt': ('prompt3', 'exp3_system_prompt.txt'),
+    'exp3_user_prompt': ('prompt3', 'exp3_user_prompt.txt'),
+    # Experiment 4
+    'exp4_system_prompt': ('prompt4', 'exp4_system_prompt.txt'),
+    'exp4_user_prompt': ('prompt4', 'exp4_user_prompt.txt'),
+
+    # ============ PIPELINE 3 -> NO LABEL
+    # Experiment 5
+    'exp5_system_prompt': ('prompt6', 'exp5_system_prompt.txt'),
+    'exp5_user_prompt': ('prompt6', 'exp5_user_prompt.txt'),
+
+    # ======== EXPERIMENT 6 -> FT
+    ## MCQ
+    'exp6_system_prompt_mcq': ('prompt5_mcq', 'exp6_system_prompt_mcq.txt'),
+    'exp6_user_prompt_mcq': ('prompt5_mcq', 'exp6_user_prompt_mcq.txt'),
+    ## XPL
+    'exp6_system_prompt_xpl': ('prompt5_xpl', 'exp6_system_prompt_xpl.txt'),
+    'exp6_user_prompt_xpl': ('prompt5_xpl', 'exp6_user_prompt_xpl.txt'),
+}
+
+# Chat template name -> messages, as (role, prompt text name)
+PROMPT_TEMPLATES = {
+    'exp0': [('system', 'exp0_system_prompt'), ('user', 'exp0_user_prompt')],
+    'exp1': [('system', 'exp1_system_prompt'), ('user', 'exp1_user_prompt')],
+    'exp1_specific_question': [('user', 'exp1_specific_question')],
+    'exp2': [('system', 'exp2_system_prompt'), ('user', 'exp2_user_prompt')],
+    'exp3': [('system', 'exp3_system_prompt'), ('user', 'exp3_user_prompt')],
+    'exp4': [('system', 'exp4_system_prompt'), ('user', 'exp4_user_prompt')],
+    'exp5': [('system', 'exp5_system_prompt'), ('user', 'exp5_user_prompt')],
+    'exp6_mcq': [('system', 'exp6_system_prompt_mcq'), ('user', 'exp6_user_prompt_mcq')],
+    'exp6_xpl': [('system', 'exp6_system_prompt_xpl'), ('user', 'exp6_user_prompt_xpl')],
+}
+
+
+def content_hash(parts):
+    return hashlib.sha256("\n\0".join(parts).encode('utf-8')).hexdigest()
+
 
 def load_prompt(experiment, filename):
-    prompt_path = os.path.join(os.path.dirname(os.path.dirname(__file__)), 'prompts', experiment, filename)
+    prompt_path = os.path.join(PROMPTS_DIR, experiment, filename)
     with open(prompt_path, 'r') as file:
         return file.read().strip()
 
 
-# ============ PIPELINE 0
-# Experiment 0
-exp0_system_prompt = load_prompt('experiment0', 'exp0_system_prompt.txt')
-exp0_user_prompt = load_prompt('experiment0', 'exp0_user_prompt.txt')
+class PromptRegistry:
+    """
+    Prompt texts and compiled chat templates, loaded on first use.
+
+    Each file is read once and each ChatPromptTemplate is parsed once, then shared: templates hold
+    no per-call state, so every thread and worker can invoke the same object and only fills in the
+    variables. hash() is a content hash of the messages of a template (computed when it is compiled)
+    or of a single prompt text, so results and caches can record exactly which prompt version
+    produced them.
+    """
+
+    def __init__(self, files=PROMPT_FILES, templates=PROMPT_TEMPLATES):
+        self.files = files
+        self.templates = templates
+        self._texts = {}
+        self._compiled = {}
+        self._hashes = {}
+        self._lock = threading.Lock()
+
+    def text(self, name):
+        if name not in self._texts:
+            if name not in self.files:
+                raise KeyError(f"Unknown prompt: {name}")
+            with self._lock:
+                if name not in self._texts:
+                    self._texts[name] = load_prompt(*self.files[name])
+        return self._texts[name]
+
+    def template(self, name):
+        if name not in self._compiled:
+            if name not in self.templates:
+                raise KeyError(f"Unknown prompt template: {name}")
+            from langchain_core.prompts import ChatPromptTemplate
+
+            messages = [(role, self.text(value)) for role, value in self.templates[name]]
+            with self._lock:
+                if name not in self._compiled:
+                    self._hashes[name] = content_hash(f"{role}\n{text}" for role, text in messages)
+                    self._compiled[name] = ChatPromptTemplate.from_messages(messages)
+        return self._compiled[name]
 
-# ============ PIPELINE 1
-# Experiment 1
-exp1_system_prompt = load_prompt('experiment1', 'exp1_system_prompt.txt')
-exp1_user_prompt = load_prompt('experiment1', 'exp1_user_prompt.txt')
-exp1_specific_question = load_prompt('experiment1', 'exp1_specific_question.txt')
+    def hash(self, name):
+        if name in self.templates:
+            self.template(name)
+        elif name not in self._hashes:
+            self._hashes[name] = content_hash([self.text(name)])
+        return self._hashes[name]
 
-# ============ PIPELINE 2
-# Experiment 2
-exp2_system_prompt = load_prompt('experiment2', 'exp2_system_prompt.txt')
-exp2_user_prompt = load_prompt('experiment2', 'exp2_user_prompt.txt')
 
-# Experiment 3
-exp3_system_prompt = load_prompt('experiment3', 'exp3_system_prompt.txt')
-exp3_user_prompt = load_prompt('experiment3', 'exp3_user_prompt.txt')
+prompt_registry = PromptRegistry()
 
-# # Experiment 4
-exp4_system_prompt = load_prompt('experiment4', 'exp4_system_prompt.txt')
-exp4_user_prompt = load_prompt('experiment4', 'exp4_user_prompt.txt')
 
-# ============ PIPELINE 3 -> NO LABEL
-# Experiment 5
-exp5_system_prompt = load_prompt('experiment5', 'exp5_system_prompt.txt')
-exp5_user_prompt = load_prompt('experiment5', 'exp5_user_prompt.txt')
+def get_prompt_template(name):
+    return prompt_registry.template(name)
 
 
-# ======== EXPERIMENT 6 -> FT
+def get_prompt_hash(name):
+    return prompt_registry.hash(name)
 
-## MCQ
-exp6_system_prompt_mcq= load_prompt('experiment6_ft_mcq', 'exp6_system_prompt_mcq.txt')
-exp6_user_prompt_mcq = load_prompt('experiment6_ft_mcq', 'exp6_user_prompt_mcq.txt')
 
-## XPL
-exp6_system_prompt_xpl = load_prompt('experiment6_ft_xpl', 'exp6_system_prompt_xpl.txt')
-exp6_user_prompt_xpl = load_prompt('experiment6_ft_xpl', 'exp6_user_prompt_xpl.txt')
\ No newline at end of file
+def __getattr__(name):
+    # Module-level access to the prompt texts (e.g. `from llm.prompts import exp2_system_prompt`),
+    # read from disk on first use only
+    if name in PROMPT_FILES:
+        return prompt_registry.text(name)
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
@@ -0,0 +1,217 @@
+import asyncio
+import random
+import threading
+import time
+from datetime import datetime, timezone
+from email.utils import parsedate_to_datetime
+
+from config.settings import PROVIDER_RATE_LIMITS
+from llm.costs import get_cost_ledger
+
+
+# ---- 1/ Token bucket
+class TokenBucket:
+    """
+    Token bucket refilled continuously at rate_per_minute, holding at most capacity tokens.
+
+    reserve() never blocks: it takes the tokens (possibly going into debt) and returns how long the
+    caller has to wait before its reservation is covered. Callers queue up behind each other in
+    reservation order, which spreads bursts evenly over time instead of letting them hit the provider.
+    Thread safe, and safe to share between threads and event loops since no lock is held across waits.
+    """
+
+    def __init__(self, rate_per_minute, capacity=None):
+        self.rate = rate_per_minute / 60.0
+        # Default burst of 10 s worth of budget: providers (Azure in particular) enforce limits over short windows
+        self.capacity = float(capacity if capacity is not None else max(1.0, rate_per_minute / 6))
+        self.tokens = self.capacity
+        self.updated = time.monotonic()
+        self.lock = threading.Lock()
+
+    def _refill(self, now):
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+    def reserve(self, amount=1):
+        amount = min(float(amount), self.capacity)
+        with self.lock:
+            now = time.monotonic()
+            self._refill(now)
+            self.tokens -= amount
+            if self.tokens >= 0:
+                return 0.0
+            return -self.tokens / self.rate
+
+    def adjust(self, amount):
+        """Give back (amount > 0) or take (amount < 0) tokens, e.g. once the real usage is known."""
+        with self.lock:
+            self._refill(time.monotonic())
+            self.tokens = min(self.capacity, self.tokens + amount)
+
+
+# ---- 2/ Error inspection
+def _iter_error_chain(error):
+    seen = set()
+    while error is not None and id(error) not in seen:
+        seen.add(id(error))
+        yield error
+        error = error.__cause__ or error.__context__
+
+
+def is_rate_limit_error(error):
+    for e in _iter_error_chain(error):
+        status = getattr(e, "status_code", None) or getattr(getattr(e, "response", None), "status_code", None)
+        if status == 429:
+            return True
+        message = str(e).lower()
+        if "429" in message or "rate limit" in message or "resource exhausted" in message:
+            return True
+    return False
+
+
+def retry_after_seconds(error):
+    """Seconds to wait according to the Retry-After(-ms) header of the error's HTTP response, or None."""
+    for e in _iter_error_chain(error):
+        headers = getattr(getattr(e, "response", None), "headers", None)
+        if not headers:
+            continue
+        value = headers.get("retry-after-ms")
+        if value is not None:
+            try:
+                return float(value) / 1000
+            except ValueError:
+                pass
+        value = headers.get("retry-after")
+        if value is not None:
+            try:
+                return float(value)
+            except ValueError:
+                try:
+                    retry_at = parsedate_to_datetime(value)
+                    return max(0.0, (retry_at - datetime.now(timezone.utc)).total_seconds())
+                except (TypeError, ValueError):
+                    pass
+    return None
+
+
+# ---- 3/ Token accounting
+def estimate_tokens(args, kwargs, expected_output_tokens=256):
+    """Rough token count of a request (~4 characters per token) plus the expected completion."""
+    text_length = sum(len(str(value)) for value in args) + sum(len(str(value)) for value in kwargs.values())
+    return text_length // 4 + expected_output_tokens
+
+
+def extract_token_usage(response):
+    """Total tokens reported by a LangChain message or an OpenAI completion, or None."""
+    usage_metadata = getattr(response, "usage_metadata", None)
+    if usage_metadata:
+        return usage_metadata.get("total_tokens")
+    response_metadata = getattr(response, "response_metadata", None) or {}
+    token_usage = response_metadata.get("token_usage") or response_metadata.get("usage")
+    if isinstance(token_usage, dict) and token_usage.get("total_tokens") is not None:
+        return token_usage["total_tokens"]
+    usage = getattr(response, "usage", None)
+    if usage is not None:
+        return getattr(usage, "total_tokens", None)
+    return None
+
+
+# ---- 4/ Provider rate limiter
+class ProviderRateLimiter:
+    """
+    Request and token budget of one provider, shared by every model and worker calling it.
+
+    Calls wait for both budgets before being sent, and go through the run's cost ledger: slowed down
+    above the soft spend ceiling, refused (BudgetExceededError) at the hard one; the usage of every
+    response is recorded in it. On a 429 the whole provider is paused for the
+    Retry-After duration (or an exponential backoff if the header is missing), so other workers hold
+    back too instead of piling more requests on the limit. Async callers wait with asyncio.sleep and
+    never block the event loop.
+    """
+
+    def __init__(self, provider, requests_per_minute=None, tokens_per_minute=None, max_retries=8, base_wait=2, max_wait=120):
+        self.provider = provider
+        self.requests = TokenBucket(requests_per_minute) if requests_per_minute else None
+        self.tokens = TokenBucket(tokens_per_minute) if tokens_per_minute else None
+        self.max_retries = max_retries
+        self.base_wait = base_wait
+        self.max_wait = max_wait
+        self.paused_until = 0.0
+        self.lock = threading.Lock()
+
+    def _reserve(self, estimated_tokens):
+        wait_time = max(0.0, self.paused_until - time.monotonic())
+        if self.requests is not None:
+            wait_time = max(wait_time, self.requests.reserve(1))
+        if self.tokens is not None:
+            wait_time = max(wait_time, self.tokens.reserve(estimated_tokens))
+        return wait_time
+
+    def _reconcile(self, estimated_tokens, response):
+        get_cost_ledger().record_response(response)
+        if self.tokens is None:
+            return
+        used_tokens = extract_token_usage(response)
+        if used_tokens is not None:
+            self.tokens.adjust(estimated_tokens - used_tokens)
+
+    def _backoff(self, error, attempt):
+        wait_time = retry_after_seconds(error)
+        if wait_time is None:
+            wait_time = min(self.max_wait, self.base_wait * (2 ** attempt)) + random.uniform(0, 1)
+        with self.lock:
+            self.paused_until = max(self.paused_until, time.monotonic() + wait_time)
+        print(f"[{self.provider}] Rate limit reached. Pausing for {wait_time:.2f} seconds before retry {attempt + 1}/{self.max_retries}")
+
+    def call(self, func, *args, **kwargs):
+        estimated_tokens = estimate_tokens(args, kwargs)
+        for attempt in range(self.max_retries):
+            get_cost_ledger().wait_before_call()
+            wait_time = self._reserve(estimated_tokens)
+            if wait_time > 0:
+                time.sleep(wait_time)
+            try:
+                response = func(*args, **kwargs)
+            except Exception as e:
+                if not is_rate_limit_error(e):
+                    print(f"Unexpected error: {str(e)}")
+                    return None
+                self._backoff(e, attempt)
+                continue
+            self._reconcile(estimated_tokens, response)
+            return response
+        print("Max retries reached. Skipping this call.")
+        return None
+
+    async def acall(self, func, *args, **kwargs):
+        estimated_tokens = estimate_tokens(args, kwargs)
+        for attempt in range(self.max_retries):
+            await get_cost_ledger().await_before_call()
+            wait_time = self._reserve(estimated_tokens)
+            if wait_time > 0:
+                await asyncio.sleep(wait_time)
+            try:
+                response = await func(*args, **kwargs)
+            except Exception as e:
+                if not is_rate_limit_error(e):
+                    print(f"Unexpected error: {str(e)}")
+                    return None
+                self._backoff(e, attempt)
+                continue
+            self._reconcile(estimated_tokens, response)
+            return response
+        print("Max retries reached. Skipping this call.")
+        return None
+
+
+_rate_limiters = {}
+_rate_limiters_lock = threading.Lock()
+
+
+def get_rate_limiter(provider=None):
+    """Shared limiter for provider (see PROVIDER_RATE_LIMITS in config/settings.py); unknown providers are unlimited."""
+    provider = provider or "default"
+    with _rate_limiters_lock:
+        if provider not in _rate_limiters:
+            _rate_limiters[provider] = ProviderRateLimiter(provider, **PROVIDER_RATE_LIMITS.get(provider, {}))
+        return _rate_limiters[provider]
@@ -0,0 +1,78 @@
+import threading
+from collections.abc import Mapping
+
+
+class ModelDescriptor(Mapping):
+    """
+    Description of one model whose client is only built the first time it is used.
+
+    Behaves like the llm_data dicts the pipelines expect: llm_data["model"] / llm_data.get("model")
+    calls factory() once (thread safe) and returns the same client afterwards, while "model_name",
+    "type", "provider" and any other field are plain values that never trigger construction.
+    """
+
+    def __init__(self, factory, **fields):
+        self.factory = factory
+        self.fields = fields
+        self._model = None
+        self._lock = threading.Lock()
+
+    @property
+    def model(self):
+        if self._model is None:
+            with self._lock:
+                if self._model is None:
+                    self._model = self.factory()
+        return self._model
+
+    @property
+    def is_loaded(self):
+        return self._model is not None
+
+    def __getitem__(self, key):
+        if key == "model":
+            return self.model
+        return self.fields[key]
+
+    def __contains__(self, key):
+        return key == "model" or key in self.fields
+
+    def __iter__(self):
+        yield "model"
+        yield from self.fields
+
+    def __len__(self):
+        return len(self.fields) + 1
+
+    def __repr__(self):
+        status = "loaded" if self.is_loaded else "not loaded"
+        return f"ModelDescriptor({self.factory.__name__}, {self.fields}, {status})"
+
+
+class ModelRegistry(Mapping):
+    """
+    Ordered name -> ModelDescriptor mapping.
+
+    filter() selects models by their fields (e.g. type='open') before anything is constructed.
+    """
+
+    def __init__(self, descriptors):
+        self.descriptors = dict(descriptors)
+
+    def filter(self, **criteria):
+        return ModelRegistry({
+            name: descriptor for name, descriptor in self.descriptors.items()
+            if all(descriptor.fields.get(field) == value for field, value in criteria.items())
+        })
+
+    def __getitem__(self, name):
+        return self.descriptors[name]
+
+    def __iter__(self):
+        return iter(self.descriptors)
+
+    def __len__(self):
+        return len(self.descriptors)
+
+    def __repr__(self):
+        return f"ModelRegistry({list(self.descriptors)})"
@@ -0,0 +1,114 @@
+import threading
+
+# Chat format overhead (OpenAI cookbook, gpt-3.5-turbo-0613 / gpt-4 and later): every message is wrapped as
+# <|start|>{role}\n{content}<|end|>\n and every reply is primed with <|start|>assistant<|message|>
+TOKENS_PER_MESSAGE = 3
+TOKENS_PER_NAME = 1
+TOKENS_PER_REPLY = 3
+
+
+class TokenCounter:
+    """
+    tiktoken-based token counts for chat requests.
+
+    Static prompt parts (system prompts, roles, templates) are counted once and memoized with
+    count_static(); everything else is encoded in batches with count_batch(), which runs tiktoken's
+    encode_ordinary_batch on several threads. count_messages() adds the per-message overhead of
+    the chat format, so the totals match the prompt_tokens the API bills.
+
+    The encoding is loaded on first use. Safe to share between threads.
+    """
+
+    def __init__(self, model="gpt-4", encoding_name=None, num_threads=8):
+        self.model = model
+        self.encoding_name = encoding_name
+        self.num_threads = num_threads
+        self._encoding = None
+        self._static_counts = {}
+        self._lock = threading.Lock()
+
+    @property
+    def encoding(self):
+        if self._encoding is None:
+            import tiktoken
+
+            with self._lock:
+                if self._encoding is None:
+                    if self.encoding_name is not None:
+                        self._encoding = tiktoken.get_encoding(self.encoding_name)
+                    else:
+                        try:
+                            self._encoding = tiktoken.encoding_for_model(self.model)
+                        except KeyError:
+                            # Unknown model name (e.g. a fine-tuned id): use the encoding of recent OpenAI chat models
+                            self._encoding = tiktoken.get_encoding("o200k_base")
+        return self._encoding
+
+    def count(self, text):
+        """Number of tokens in text (special tokens are counted as plain text)."""
+        return len(self.encoding.encode_ordinary(text))
+
+    def count_static(self, text):
+        """count() memoized, for text that repeats across requests."""
+        count = self._static_counts.get(text)
+        if count is None:
+            count = self.count(text)
+            with self._lock:
+                self._static_counts[text] = count
+        return count
+
+    def count_batch(self, texts):
+        """Token counts of texts, encoded in one batch."""
+        texts = list(texts)
+        if not texts:
+            return []
+        return [len(tokens) for tokens in self.encoding.encode_ordinary_batch(texts, num_threads=self.num_threads)]
+
+    def message_overhead(self, message):
+        """Tokens a chat message costs on top of its content: wrapper, role and optional name."""
+        overhead = TOKENS_PER_MESSAGE + self.count_static(message["role"])
+        if message.get("name"):
+            overhead += TOKENS_PER_NAME + self.count_static(message["name"])
+        return overhead
+
+    def count_messages(self, messages, static_roles=("system",)):
+        """Prompt tokens of one chat request. Contents of messages with a role in static_roles are memoized."""
+        return self.count_messages_batch([messages], static_roles=static_roles)[0]
+
+    def count_messages_batch(self, requests, static_roles=("system",)):
+        """
+        Prompt tokens of many chat requests (lists of {"role", "content"} messages).
+
+        Contents of static_roles messages are counted once; all other contents are encoded together.
+        """
+        requests = [list(messages) for messages in requests]
+        dynamic_texts = [
+            message["content"]
+            for messages in requests for message in messages
+            if message["role"] not in static_roles
+        ]
+        dynamic_counts = iter(self.count_batch(dynamic_texts))
+
+        totals = []
+        for messages in requests:
+            total = TOKENS_PER_REPLY
+            for message in messages:
+                if message["role"] in static_roles:
+                    total += self.count_static(message["content"])
+                else:
+                    total += next(dynamic_counts)
+                total += self.message_overhead(message)
+            totals.append(total)
+        return totals
+
+
+_token_counters = {}
+_token_counters_lock = threading.Lock()
+
+
+def get_token_counter(model="gpt-4"):
+    """Shared TokenCounter per model name, so memoized counts are reused across calls."""
+    with _token_counters_lock:
+        if model not in _token_counters:
+            _token_counters[model] = TokenCounter(model)
+        return _token_counters[model]
@@ -1,6 +1,33 @@
+import numpy as np
 from nltk.translate.bleu_score import sentence_bleu, SmoothingFunction
 
+from metrics.parallel import map_chunks, is_missing
+
+# Use a smoothing function to handle cases with 0 counts of n-gram overlaps
+# (stateless, so one per process is shared by every pair)
+SMOOTHING = SmoothingFunction().method1
+
 def calculate_bleu(reference, candidate):
-    # Use a smoothing function to handle cases with 0 counts of n-gram overlaps
-    smoothie = SmoothingFunction().method1
-    return sentence_bleu([reference.split()], candidate.split(), smoothing_function=smoothie)
+    return sentence_bleu([reference.split()], candidate.split(), smoothing_function=SMOOTHING)
+
+
+def _bleu_chunk(pairs):
+    return [
+        np.nan if is_missing(reference) or is_missing(candidate)
+        else sentence_bleu([reference.split()], candidate.split(), smoothing_function=SMOOTHING)
+        for reference, candidate in pairs
+    ]
+
+
+def calculate_bleu_batch(references, candidates, workers=None, chunksize=None):
+    """
+    BLEU of aligned reference/candidate sequences (lists, Series, e.g. two result columns).
+
+    Same scores as calculate_bleu, pair by pair, computed in chunks of chunksize pairs over a pool
+    of worker processes (see metrics/parallel.py). Pairs with a missing text (failed response) score NaN.
+    Returns a float array.
+    """
+    references, candidates = list(references), list(candidates)
+    if len(references) != len(candidates):
+        raise ValueError(f"references and candidates differ in length ({len(references)} != {len(candidates)})")
+    return np.asarray(map_chunks(_bleu_chunk, zip(references, candidates), workers, chunksize), dtype=float)
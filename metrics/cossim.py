@@ -1,16 +1,80 @@
 import numpy as np
-import torch
 from sklearn.metrics.pairwise import cosine_similarity
 
+BLOCK_ROWS = 4096  # rows of the left matrix per matmul: a block of the output is BLOCK_ROWS x m float32
+
+
+def to_numpy(embeddings):
+    """numpy array from an array, a list or a torch tensor (torch itself is not needed)."""
+    if hasattr(embeddings, "detach"):
+        embeddings = embeddings.detach().cpu().numpy()
+    return np.asarray(embeddings)
+
+
 def cosine_similarity_score(emb1, emb2):
     # Convert tensors to numpy arrays if necessary
-    if isinstance(emb1, torch.Tensor):
-        emb1 = emb1.detach().cpu().numpy()
-    if isinstance(emb2, torch.Tensor):
-        emb2 = emb2.detach().cpu().numpy()
+    emb1 = to_numpy(emb1)
+    emb2 = to_numpy(emb2)
     
     # Ensure both embeddings are 2D
     emb1 = emb1.reshape(1, -1)
     emb2 = emb2.reshape(1, -1)
     
-    return cosine_similarity(emb1, emb2)[0][0]
\ No newline at end of file
+    return cosine_similarity(emb1, emb2)[0][0]
+
+
+# ---- Batched
+def normalize_rows(embeddings):
+    """(n, d) float32 copy with unit-norm rows; all-zero rows stay zero (similarity 0, as in sklearn)."""
+    embeddings = np.array(to_numpy(embeddings), dtype=np.float32, ndmin=2)
+    norms = np.linalg.norm(embeddings, axis=1, keepdims=True)
+    norms[norms == 0] = 1.0
+    embeddings /= norms
+    return embeddings
+
+
+def rowwise_cosine_similarity(emb1, emb2, block_rows=BLOCK_ROWS):
+    """Similarity of each row of emb1 with the same row of emb2, both (n, d): a (n,) float32 array."""
+    emb1, emb2 = normalize_rows(emb1), normalize_rows(emb2)
+    if emb1.shape != emb2.shape:
+        raise ValueError(f"Embeddings must have the same shape, got {emb1.shape} and {emb2.shape}")
+    similarities = np.empty(len(emb1), dtype=np.float32)
+    for start in range(0, len(emb1), block_rows):
+        stop = start + block_rows
+        similarities[start:stop] = np.einsum("ij,ij->i", emb1[start:stop], emb2[start:stop])
+    return np.clip(similarities, -1.0, 1.0, out=similarities)
+
+
+def pairwise_cosine_similarity(emb1, emb2=None, block_rows=BLOCK_ROWS, output_path=None):
+    """
+    All-pairs similarities: (n, m) float32 matrix of emb1 (n, d) against emb2 (m, d), or of emb1 against itself.
+
+    Rows are normalized once, then the matrix is filled block_rows rows at a time, so the memory used
+    on top of the output is one block. Against itself only the upper blocks are computed and mirrored.
+    With output_path the matrix is written to a .npy memory map (np.load(output_path, mmap_mode="r")
+    reads it back) instead of RAM, for n too large to hold n x n floats.
+    """
+    symmetric = emb2 is None
+    emb1 = normalize_rows(emb1)
+    emb2 = emb1 if symmetric else normalize_rows(emb2)
+    if emb1.shape[1] != emb2.shape[1]:
+        raise ValueError(f"Embeddings must have the same dimension, got {emb1.shape[1]} and {emb2.shape[1]}")
+
+    shape = (len(emb1), len(emb2))
+    if output_path is not None:
+        similarities = np.lib.format.open_memmap(output_path, mode="w+", dtype=np.float32, shape=shape)
+    else:
+        similarities = np.empty(shape, dtype=np.float32)
+
+    for start in range(0, len(emb1), block_rows):
+        stop = min(start + block_rows, len(emb1))
+        first_column = start if symmetric else 0
+        block = emb1[start:stop] @ emb2[first_column:].T
+        np.clip(block, -1.0, 1.0, out=block)
+        similarities[start:stop, first_column:] = block
+        if symmetric:
+            similarities[stop:, start:stop] = block[:, stop - start:].T
+
+    if output_path is not None:
+        similarities.flush()
+    return similarities
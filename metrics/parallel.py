@@ -0,0 +1,36 @@
+import os
+from concurrent.futures import ProcessPoolExecutor
+
+import pandas as pd
+
+from config.settings import METRICS_WORKERS, METRICS_CHUNK_ROWS
+
+
+def is_missing(text):
+    """None or NaN, e.g. the response of a failed row."""
+    return text is None or (not isinstance(text, str) and pd.isna(text))
+
+
+def resolve_workers(workers=None):
+    workers = METRICS_WORKERS if workers is None else workers
+    return max(1, workers or os.cpu_count() or 1)
+
+
+def map_chunks(fn, items, workers=None, chunksize=None, initializer=None, initargs=()):
+    """
+    fn over consecutive chunks of items in a process pool; returns the concatenated results, in order.
+
+    fn(chunk) takes a list and returns a list of the same length, and must be picklable (a module-level
+    function, or a functools.partial of one). initializer(*initargs) runs once per worker, e.g. to build a scorer reused for
+    every chunk. Inputs that fit in one chunk, or workers=1, are scored in this process.
+    """
+    items = list(items)
+    chunksize = chunksize or METRICS_CHUNK_ROWS
+    chunks = [items[start:start + chunksize] for start in range(0, len(items), chunksize)]
+    workers = min(resolve_workers(workers), len(chunks))
+    if workers <= 1:
+        if initializer is not None:
+            initializer(*initargs)
+        return [result for chunk in chunks for result in fn(chunk)]
+    with ProcessPoolExecutor(max_workers=workers, initializer=initializer, initargs=initargs) as executor:
+        return [result for chunk_results in executor.map(fn, chunks) for result in chunk_results]
@@ -1,6 +1,77 @@
-from rouge_score import rouge_scorer
+from functools import lru_cache, partial
+
+import numpy as np
+from rouge_score import rouge_scorer, tokenizers
+
+from metrics.parallel import map_chunks, is_missing
+
+TOKEN_CACHE_SIZE = 100_000  # distinct texts whose stemmed tokens are kept, per process
+
+
+class CachedTokenizer(tokenizers.Tokenizer):
+    """
+    rouge_score's default tokenizer (lowercase, punctuation removed, Porter stemming) with an LRU
+    cache of the tokens of each text. References repeat across the demographic versions of a case,
+    so most of them are stemmed once instead of once per row.
+    """
+
+    def __init__(self, use_stemmer=True, cache_size=TOKEN_CACHE_SIZE):
+        self.tokenizer = tokenizers.DefaultTokenizer(use_stemmer)
+        self._tokenize = lru_cache(maxsize=cache_size)(self.tokenizer.tokenize)
+
+    def tokenize(self, text):
+        return self._tokenize(text)
+
+
+class RougeLScorer:
+    """ROUGE-L F-measure, same scores as calculate_rouge_l, built once and reused for every pair."""
+
+    def __init__(self, use_stemmer=True, cache_size=TOKEN_CACHE_SIZE):
+        self.scorer = rouge_scorer.RougeScorer(['rougeL'], tokenizer=CachedTokenizer(use_stemmer, cache_size))
+
+    def score(self, reference, candidate):
+        return self.scorer.score(reference, candidate)['rougeL'].fmeasure
+
+    def score_pairs(self, pairs):
+        """Scores of (reference, candidate) pairs; NaN when a text is missing (failed response)."""
+        return [
+            np.nan if is_missing(reference) or is_missing(candidate) else self.score(reference, candidate)
+            for reference, candidate in pairs
+        ]
+
+
+# Scorers of this process (main process or pool worker), one per (use_stemmer, cache_size): each keeps
+# its token cache across calls, and a batch with other settings never replaces the default scorer
+_scorers = {}
+
+
+def get_scorer(use_stemmer=True, cache_size=TOKEN_CACHE_SIZE):
+    key = (use_stemmer, cache_size)
+    if key not in _scorers:
+        _scorers[key] = RougeLScorer(use_stemmer, cache_size)
+    return _scorers[key]
+
+
+def _rouge_l_chunk(pairs, use_stemmer=True, cache_size=TOKEN_CACHE_SIZE):
+    return get_scorer(use_stemmer, cache_size).score_pairs(pairs)
+
 
 def calculate_rouge_l(reference, candidate):
-    scorer = rouge_scorer.RougeScorer(['rougeL'], use_stemmer=True)
-    scores = scorer.score(reference, candidate)
-    return scores['rougeL'].fmeasure
\ No newline at end of file
+    return get_scorer().score(reference, candidate)
+
+
+def calculate_rouge_l_batch(references, candidates, workers=None, chunksize=None, use_stemmer=True,
+                            cache_size=TOKEN_CACHE_SIZE):
+    """
+    ROUGE-L F-measure of aligned reference/candidate sequences (lists, Series, e.g. two result columns).
+
+    Same scores as calculate_rouge_l, computed in chunks of chunksize pairs over a pool of worker
+    processes (see metrics/parallel.py), each with its own scorer and token cache. Pairs with a
+    missing text score NaN. Returns a float array.
+    """
+    references, candidates = list(references), list(candidates)
+    if len(references) != len(candidates):
+        raise ValueError(f"references and candidates differ in length ({len(references)} != {len(candidates)})")
+    scores = map_chunks(partial(_rouge_l_chunk, use_stemmer=use_stemmer, cache_size=cache_size),
+                        zip(references, candidates), workers, chunksize)
+    return np.asarray(scores, dtype=float)
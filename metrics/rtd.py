@@ -1,6 +1,71 @@
-def rtd(ranks1, ranks2, alpha=1):
+import numpy as np
+from scipy.stats import rankdata
+
+PAIR_BLOCK_ELEMENTS = 1 << 22  # ranks compared at once by rtd_matrix (x 8 bytes per temporary array)
+
+
+def rtd_loop(ranks1, ranks2, alpha=1):
+    # Reference implementation, one rank at a time (see scripts/bench_rtd.py)
     n = len(ranks1)
     rtd = 0
     for i in range(n):
         rtd += abs(1 / (ranks1[i] + 1)**alpha - 1 / (ranks2[i] + 1)**alpha)**(1/(alpha + 1))
     return ((alpha + 1) / alpha) * rtd
+
+
+def ranks_from_scores(scores):
+    """
+    0-based ranks of scores (e.g. word importances), highest score first, along the last axis.
+
+    Tied scores share the mean of the ranks they span (1 and 2 -> 1.5), as in rank-turbulence divergence.
+    """
+    return rankdata(-np.asarray(scores, dtype=float), method="average", axis=-1) - 1
+
+
+def _rtd_terms(log_ranks1, log_ranks2, alpha):
+    """Per-element terms of rtd, from the logs of the (1-based) ranks."""
+    low = np.minimum(log_ranks1, log_ranks2)
+    gap = np.abs(log_ranks1 - log_ranks2)
+    if alpha == 0:
+        return gap
+    if np.isinf(alpha):
+        return np.where(gap > 0, np.exp(-low), 0.0)
+    # |r1^-a - r2^-a|^(1/(a+1)) written as exp((-a ln r + ln(1 - (r/R)^a)) / (a+1)) with r the smaller rank:
+    # stable for alpha close to 0 (no cancellation) and for large alpha (no underflow); equal ranks give 0
+    with np.errstate(divide="ignore"):
+        return ((alpha + 1) / alpha) * np.exp((-alpha * low + np.log(-np.expm1(-alpha * gap))) / (alpha + 1))
+
+
+def rtd(ranks1, ranks2, alpha=1):
+    """
+    Rank-turbulence divergence of two rankings of the same items (0-based ranks, ties as mean ranks).
+
+    Same value as rtd_loop, vectorized. alpha=0 and alpha=np.inf give the limits of the divergence:
+    sum |ln(r1 / r2)|, and the sum of max(1/r1, 1/r2) over the items whose rank changed.
+    """
+    log_ranks1 = np.log(np.asarray(ranks1, dtype=float) + 1)
+    log_ranks2 = np.log(np.asarray(ranks2, dtype=float) + 1)
+    if log_ranks1.shape != log_ranks2.shape:
+        raise ValueError(f"Rankings must have the same length, got {log_ranks1.shape} and {log_ranks2.shape}")
+    return float(_rtd_terms(log_ranks1, log_ranks2, alpha).sum())
+
+
+def rtd_matrix(rankings, alpha=1):
+    """
+    rtd of every pair of rankings: rankings is (k, n), k rankings of the same n items (e.g. the word
+    importance ranks of each demographic version), the result a symmetric (k, k) matrix.
+
+    Logs are taken once; pairs are compared a block of rows at a time against the rankings after them.
+    """
+    log_ranks = np.log(np.asarray(rankings, dtype=float) + 1)
+    if log_ranks.ndim != 2:
+        raise ValueError(f"rankings must be a (k, n) array, got shape {log_ranks.shape}")
+    k, n = log_ranks.shape
+    divergences = np.zeros((k, k))
+    block_rows = max(1, PAIR_BLOCK_ELEMENTS // max(1, k * n))
+    for start in range(0, k, block_rows):
+        stop = min(start + block_rows, k)
+        block = _rtd_terms(log_ranks[start:stop, None, :], log_ranks[None, start:, :], alpha).sum(axis=-1)
+        divergences[start:stop, start:] = block
+        divergences[start:, start:stop] = block.T
+    return divergences
@@ -1,3 +1,7 @@
+from scipy.stats import rankdata
+
+from metrics.rtd import rtd
+
 def rtd2(rtd_emp, rtd_emb):
     n = len(rtd_emp)
     ranks_emp = rankdata(rtd_emp)
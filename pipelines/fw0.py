@@ -1,57 +1,44 @@
-from llm.prompts import exp0_system_prompt,exp0_user_prompt
-from langchain_core.prompts import ChatPromptTemplate
+from llm.prompts import get_prompt_template
 import time
 
+from config.settings import MAX_CONCURRENCY
+from llm.rate_limit import get_rate_limiter
+from llm.cache import setup_response_cache, print_cache_stats
+from llm.http_pool import print_http_stats
+from llm.costs import get_cost_ledger, response_model_name
+from llm.engine import run_rows_async, run_sync
+from pipelines.sink import ResultSink, shard_path_for, cost_summary_path_for
+
 
 # =========== Heart of the experiment
-def experiment0_llm_pipeline(llm,question_original,answer_choices):
+async def aexperiment0_llm_pipeline(llm,question_original,answer_choices, provider=None):
   # Debugging
   if llm is None:
         raise ValueError("LLM model is None. Please ensure a valid model is provided.")
       
   # --- 1. Prompts 
-  system_prompt=exp0_system_prompt
-  user_prompt=exp0_user_prompt
+  # Compiled once and shared by every row (see llm/prompts.py)
+  prompt_1 = get_prompt_template('exp0')
   
   # --- 2. Initialisation
   chat_history = []
   
   # -------- Q1
-  # prompt
-  prompt_1 = ChatPromptTemplate.from_messages([
-    ("system", system_prompt),
-    ("user", user_prompt),
-])
-  # chain
-  chain_1 = prompt_1 | llm
-  
-  # invoke
+  # invoke: the prompt is rendered once and sent as is (rate limits are handled by the provider limiter)
   examples="" #zero shot because no difference 
-  try: 
-    prompt_value_1 = prompt_1.invoke({"question": question_original,"answer_choices":answer_choices,"few-shot examples":examples})
-    start_time_1 = time.time()
-    response_1 = chain_1.invoke({"question": question_original,"answer_choices":answer_choices,"few-shot examples":examples})
-    end_time_1 = time.time()
-    running_time_1=end_time_1-start_time_1
+  prompt_value_1 = prompt_1.invoke({"question": question_original,"answer_choices":answer_choices,"few-shot examples":examples})
+  start_time_1 = time.time()
+  response_1 = await get_rate_limiter(provider).acall(llm.ainvoke, prompt_value_1)
+  end_time_1 = time.time()
+  running_time_1=end_time_1-start_time_1
+  if response_1 is not None:
     chat_history.extend([prompt_value_1.messages[0].content,prompt_value_1.messages[1].content, response_1.content])
-  except ValueError as e: 
-    if "Azure rate limit" in str(e):
-      print("Azure rate limit reached. Waiting for 10 seconds before retrying.")
-      time.sleep(10)
-      prompt_value_1 = prompt_1.invoke({"question": question_original,"answer_choices":answer_choices,"few-shot examples":examples})
-      start_time_1 = time.time()
-      response_1 = chain_1.invoke({"question": question_original,"answer_choices":answer_choices,"few-shot examples":examples})
-      end_time_1 = time.time()
-      running_time_1=end_time_1-start_time_1
-      chat_history.extend([prompt_value_1.messages[0].content,prompt_value_1.messages[1].content, response_1.content])
-    else:
-      print(f"Unexpected error occurred: {str(e)}")
-      print(f"Question: {question_original}")
-      running_time_1 = None
-      response_1 = None
-      prompt_value_1 = None
-      chat_history.extend([None, None, None])
-      print("Skipping this question.")
+  else:
+    print(f"Question: {question_original}")
+    running_time_1 = None
+    prompt_value_1 = None
+    chat_history.extend([None, None, None])
+    print("Skipping this question.")
 
   
   # metadata
@@ -68,14 +55,75 @@ def experiment0_llm_pipeline(llm,question_original,answer_choices):
   return response_1, prompt_value_1, completion_tokens_1, prompt_tokens_1, finish_reason_1, running_time_1, chat_history
 
 
+def experiment0_llm_pipeline(llm,question_original,answer_choices, provider=None):
+  return run_sync(aexperiment0_llm_pipeline(llm, question_original, answer_choices, provider))
+
+
+def results_to_record_0(llm_name, llm_data, results, correct_answer):
+    response_1, prompt_value_1, completion_tokens_1, prompt_tokens_1, finish_reason_1, running_time_1, chat_history = results
+    correct_answer_lower = correct_answer.lower()
+    record = {}
+
+    # chat history
+    if all(item is not None for item in chat_history):
+      chat_history = '\n'.join(chat_history)
+    else:
+      chat_history = None
+    record[f'{llm_name}_chat_history'] = chat_history
+
+    # Metadata
+    if prompt_value_1 is not None:
+      ## Q1
+      # postprocessing
+      prompt_value_1_str = f"System_prompt: {prompt_value_1.messages[0].content}\nUser Prompt: {prompt_value_1.messages[1].content}"
+      response_1_str = response_1.content
+      response_1_parts = response_1_str.split('\n', 1)
+      response_1_label = response_1_parts[0] if len(response_1_parts) > 0 else ''
+      response_1_explanation = response_1_parts[1] if len(response_1_parts) > 1 else ''
+      response_1_label_lower = response_1_label.lower()
+      row_performance = 1 if response_1_label_lower == correct_answer_lower else 0
+      # Store
+      record[f'{llm_name}_prompt1'] = prompt_value_1_str
+      record[f'{llm_name}_response1'] = response_1_str
+      record[f'{llm_name}_finish_reason_1'] = finish_reason_1
+      record[f'{llm_name}_prompt_tokens_1'] = prompt_tokens_1
+      record[f'{llm_name}_completion_tokens_1'] = completion_tokens_1
+      record[f'{llm_name}_running_time_1'] = running_time_1
+      # Pricing
+      ## Q1
+      # (price table of the cost ledger, by the model name the provider reported)
+      model_id = response_model_name(response_1) or llm_data.get("model_name")
+      record[f'{llm_name}_input_price_1'], record[f'{llm_name}_output_price_1'] = get_cost_ledger().token_costs(model_id, prompt_tokens_1, completion_tokens_1)
+      ## Total
+      record[f'{llm_name}_total_price'] = record[f'{llm_name}_input_price_1'] + record[f'{llm_name}_output_price_1']
+      # ---- Store experiment results
+      record[f'{llm_name}_label1'] = response_1_label
+      record[f'{llm_name}_explanation1'] = response_1_explanation
+      # Performance
+      record[f'{llm_name}_performance'] = row_performance
+    else:
+      record[f'{llm_name}_finish_reason_1'] = None
+      record[f'{llm_name}_prompt_tokens_1'] = None
+      record[f'{llm_name}_completion_tokens_1'] = None
+      record[f'{llm_name}_running_time_1'] = None
+      record[f'{llm_name}_input_price_1'] = None
+      record[f'{llm_name}_output_price_1'] = None
+      record[f'{llm_name}_total_price'] = None
+      record[f'{llm_name}_label1'] = None
+      record[f'{llm_name}_explanation1'] = None
+      record[f'{llm_name}_performance'] = None
+    return record
+
+
 # =========== Experiment pipeline
-def process_llms_and_df_0(llms, df,saving_path=None):
+def process_llms_and_df_0(llms, df,saving_path=None, max_concurrency=None):
+    setup_response_cache()
+
     # Create df_results as a copy of df
     df_results = df.copy()
 
     # Initialization
     total_rows = len(df)
-    progress_interval = max(1, total_rows // 10)  # Calculate 10% of total rows
 
     # LLM loop
     for llm_name, llm_data in llms.items():
@@ -91,89 +139,36 @@ def process_llms_and_df_0(llms, df,saving_path=None):
             print(f"Warning: No model found for {llm_name}. Skipping this LLM.")
             continue
 
-        # df loop
-        for idx_val, row_val in df_results.iterrows():
-            # Extracting the data
-            question_original = row_val['question']
-            answer_choices = f"A. {row_val['opa_shuffled']}\nB. {row_val['opb_shuffled']}\nC. {row_val['opc_shuffled']}\nD. {row_val['opd_shuffled']}"
-            correct_answer=row_val['answer_idx_shuffled']; correct_answer_lower = correct_answer.lower()
+        # Rows run concurrently; each record is collected in a sink (JSONL shard next to saving_path)
+        # and the columns are attached to df_results once at the end
+        sink = ResultSink(shard_path_for(saving_path, llm_name) if saving_path is not None else None, overwrite=True)
+
+        def jobs():
+            for idx_val, row_val in df.iterrows():
+                yield idx_val, (
+                    llm_model,
+                    row_val['question'],
+                    f"A. {row_val['opa_shuffled']}\nB. {row_val['opb_shuffled']}\nC. {row_val['opc_shuffled']}\nD. {row_val['opd_shuffled']}",
+                    llm_data.get("provider")
+                )
 
-            # Run the LLM
+        def on_result(idx_val, results):
+            if results is None:
+                return
             try:
-              response_1, prompt_value_1, completion_tokens_1, prompt_tokens_1, finish_reason_1, running_time_1,chat_history = experiment0_llm_pipeline(
-              llm=llm_model,
-              question_original=question_original,
-              answer_choices=answer_choices,
-          )
-            except KeyError as e:
-              print(f"KeyError in llm_data for {llm_name}: {e}")
-              print(f"Available keys in llm_data: {llm_data.keys()}")
-              continue
-            
-            # POSTPROCESSING
-            
-            # chat history
-            if all(item is not None for item in chat_history):
-              chat_history = '\n'.join(chat_history)
-            else:
-              chat_history = None
+                sink.write(idx_val, results_to_record_0(llm_name, llm_data, results, df.at[idx_val, 'answer_idx_shuffled']))
+            except Exception as e:
+                print(f"Error processing row {idx_val} for {llm_name}: {str(e)}")
 
-            
-            
-            
-            # ----- Store experiment parameters in df_results
-            
-            # Responses
-
-            # Chat History
-            df_results.loc[idx_val, f'{llm_name}_chat_history'] = chat_history
-            # Metadata
-            if prompt_value_1 is not None:
-              ## Q1
-              # postprocessing
-              prompt_value_1_str = f"System_prompt: {prompt_value_1.messages[0].content}\nUser Prompt: {prompt_value_1.messages[1].content}"
-              response_1_str = response_1.content
-              response_1_parts = response_1_str.split('\n', 1)
-              response_1_label = response_1_parts[0] if len(response_1_parts) > 0 else ''
-              response_1_explanation = response_1_parts[1] if len(response_1_parts) > 1 else ''
-              response_1_label_lower = response_1_label.lower()
-              row_performance = 1 if response_1_label_lower == correct_answer_lower else 0
-              # Store
-              df_results.loc[idx_val, f'{llm_name}_prompt1'] = prompt_value_1_str
-              df_results.loc[idx_val, f'{llm_name}_response1'] = response_1_str
-              df_results.loc[idx_val, f'{llm_name}_finish_reason_1'] = finish_reason_1
-              df_results.loc[idx_val, f'{llm_name}_prompt_tokens_1'] = prompt_tokens_1
-              df_results.loc[idx_val, f'{llm_name}_completion_tokens_1'] = completion_tokens_1
-              df_results.loc[idx_val, f'{llm_name}_running_time_1'] = running_time_1
-              # Pricing
-              ## Q1
-              df_results.loc[idx_val, f'{llm_name}_input_price_1'] = llm_data["price_per_input_token"] * prompt_tokens_1
-              df_results.loc[idx_val, f'{llm_name}_output_price_1'] = llm_data["price_per_output_token"] * completion_tokens_1
-              ## Total
-              df_results.loc[idx_val, f'{llm_name}_total_price'] = df_results.loc[idx_val, f'{llm_name}_input_price_1'] + df_results.loc[idx_val, f'{llm_name}_output_price_1']
-              # ---- Store experiment results in df_results
-              df_results.loc[idx_val, f'{llm_name}_label1'] = response_1_label
-              df_results.loc[idx_val, f'{llm_name}_explanation1'] = response_1_explanation
-              # Performance
-              df_results.loc[idx_val, f'{llm_name}_performance'] = row_performance
-            else:
-              df_results.loc[idx_val, f'{llm_name}_finish_reason_1'] = None
-              df_results.loc[idx_val, f'{llm_name}_prompt_tokens_1'] = None
-              df_results.loc[idx_val, f'{llm_name}_completion_tokens_1'] = None
-              df_results.loc[idx_val, f'{llm_name}_running_time_1'] = None
-              df_results.loc[idx_val, f'{llm_name}_input_price_1'] = None
-              df_results.loc[idx_val, f'{llm_name}_output_price_1'] = None
-              df_results.loc[idx_val, f'{llm_name}_total_price'] = None
-              df_results.loc[idx_val, f'{llm_name}_label1'] = None
-              df_results.loc[idx_val, f'{llm_name}_explanation1'] = None
-              df_results.loc[idx_val, f'{llm_name}_performance'] = None
-            
-            # ----- Print progress every 10%
-            if (idx_val + 1) % progress_interval == 0:
-                progress_percentage = ((idx_val + 1) / total_rows) * 100
-                print(f"Progress: {progress_percentage:.1f}% complete")
-                if saving_path is not None:
-                    df_results.to_csv(saving_path, index=False)
+        run_sync(run_rows_async(aexperiment0_llm_pipeline, jobs(), on_result=on_result, desc=f"Processing {llm_name}", total=total_rows,
+                                max_concurrency=max_concurrency or llm_data.get("max_concurrency", MAX_CONCURRENCY)))
+
+        # Compaction: attach this LLM's columns and write the CSV once
+        sink.close()
+        df_results = sink.compact(df_results, saving_path)
+        if f'{llm_name}_performance' not in df_results.columns:
+            print(f"Warning: no results for {llm_name}.")
+            continue
 
         # You can also keep a running total if needed
         total_performance = df_results[f'{llm_name}_performance'].sum()
@@ -183,5 +178,9 @@ def process_llms_and_df_0(llms, df,saving_path=None):
         print(f"Accuracy for {llm_name}: {accuracy:.2f}%")
         print(f"Finished processing with LLM: {llm_name}")  # Print when finished with current LLM
             
+    print_cache_stats()
+    print_http_stats()
+    if saving_path is not None:
+        get_cost_ledger().write_summary(cost_summary_path_for(saving_path))
     print("\nAll LLMs processed. Returning results.")
     return df_results
@@ -1,184 +1,238 @@
-from llm.prompts import exp1_system_prompt, exp1_user_prompt, exp1_specific_question
-from langchain_core.prompts import ChatPromptTemplate
+from llm.prompts import get_prompt_template
+from langchain_core.messages import AIMessage
+from langchain_core.prompt_values import ChatPromptValue
+import asyncio
 import time
-import random
-
-def handle_api_call(func, *args, **kwargs):
-    max_retries = 5
-    base_wait = 10
-
-    for attempt in range(max_retries):
-        try:
-            return func(*args, **kwargs)
-        except Exception as e:
-            if "429" in str(e) or "rate limit" in str(e).lower():
-                wait_time = base_wait * (2 ** attempt) + random.uniform(0, 1)
-                print(f"Rate limit reached. Waiting for {wait_time:.2f} seconds before retry {attempt + 1}/{max_retries}")
-                time.sleep(wait_time)
-                if attempt == max_retries - 1:
-                    print("Max retries reached. Skipping this call.")
-                    return None
-            else:
-                print(f"Unexpected error: {str(e)}")
-                return None
+
+from config.settings import MAX_CONCURRENCY
+from llm.rate_limit import get_rate_limiter
+from llm.cache import setup_response_cache, print_cache_stats
+from llm.http_pool import print_http_stats
+from llm.costs import get_cost_ledger, response_model_name
+from llm.engine import run_rows_async, run_sync
+from pipelines.sink import ResultSink, shard_path_for, cost_summary_path_for
+
 
 
 # =========== Heart of the experiment
-def experiment1_llm_pipeline_b(llm,case,question,options,specific_question_type):
+async def run_turn(llm, prompt_value, provider=None):
+  # One request on an already rendered prompt: response, running time and token metadata
+  start_time = time.time()
+  response = await get_rate_limiter(provider).acall(llm.ainvoke, prompt_value)
+  running_time = time.time() - start_time
+  if response is None:
+    return None, running_time, None, None, None
+  completion_tokens = response.response_metadata['token_usage']['completion_tokens']
+  prompt_tokens = response.response_metadata['token_usage']['prompt_tokens']
+  finish_reason = response.response_metadata['finish_reason']
+  return response, running_time, completion_tokens, prompt_tokens, finish_reason
+
+
+async def run_followup(llm, prompt_value_1, response_1, specific, provider=None, label="2"):
+  # Q2 = Q1 conversation + the model's answer + the specific question, built from the rendered Q1
+  # messages (the answer is never parsed as a template)
+  try:
+    prompt_value = ChatPromptValue(messages=[
+      *prompt_value_1.messages,
+      AIMessage(content=response_1.content),
+      *get_prompt_template('exp1_specific_question').invoke({"SPECIFIC": specific}).messages,
+    ])
+    response, running_time, completion_tokens, prompt_tokens, finish_reason = await run_turn(llm, prompt_value, provider)
+    if response is None:
+      raise ValueError("Failed to get a valid response")
+    return prompt_value, response, running_time, completion_tokens, prompt_tokens, finish_reason
+  except Exception as e:
+    print(f"ERROR - Prompt {label}: {str(e)}")
+    return None, None, None, None, None, None
+
+
+async def aexperiment1_llm_pipeline_b(llm,case,question,options,specific_question_type, provider=None):
+  """
+  Q1, then Q2a and Q2b at the same time: both follow-ups only depend on the Q1 answer.
+
+  Each prompt is rendered once and the rendered messages are sent to the model directly.
+  """
   # Debugging
   if llm is None:
         raise ValueError("LLM model is None. Please ensure a valid model is provided.")
-      
-  # --- 1. Prompts 
-  system_prompt = exp1_system_prompt
-  user_prompt = exp1_user_prompt
-  specific_question = exp1_specific_question
-  
+
+  # question selection: Q2a asks about the attribute that was changed, Q2b about the other one
+  if specific_question_type=='gender':
+    specific_2a, specific_2b = 'gender', 'ethnicity'
+  elif specific_question_type=='ethnicity':
+    specific_2a, specific_2b = 'ethnicity', 'gender'
+  else:
+    raise ValueError("Unrecognised question type")
+
+  # --- 1. Prompts
+  # Compiled once and shared by every row (see llm/prompts.py)
+  prompt_1 = get_prompt_template('exp1')
+
   # --- 2. Initialisation
   chat_history = []
-  
+
   # -------- Q1
-  # prompt
-  prompt_1 = ChatPromptTemplate.from_messages([
-    ("system", system_prompt),
-    ("user", user_prompt)
-])
-  # chain
-  chain_1 = prompt_1 | llm
-  
-  # invoke
-  # PROMPT1
-  prompt_value_1 = handle_api_call(prompt_1.invoke, {"CLINICAL_CASE": case, "QUESTION": question, "OPTIONS": options})
+  try:
+    prompt_value_1 = prompt_1.invoke({"CLINICAL_CASE": case, "QUESTION": question, "OPTIONS": options})
+  except Exception as e:
+    print(f"ERROR - Prompt 1: {str(e)}")
+    prompt_value_1 = None
   if prompt_value_1 is None:
         print("ERROR - Prompt 1: Failed to get a valid response")
         print(f"Case: {case}")
         print("Skipping this question.")
         return None, None, None, None, None, None, None, None, None, None, None, None, None, None, None, None, None, None, [None, None, None]
-  # CHAIN1
-  start_time_1 = time.time()
-  response_1 = handle_api_call(chain_1.invoke, {"CLINICAL_CASE": case, "QUESTION": question, "OPTIONS": options})
-  end_time_1 = time.time()
-  running_time_1 = end_time_1 - start_time_1
+  response_1, running_time_1, completion_tokens_1, prompt_tokens_1, finish_reason_1 = await run_turn(llm, prompt_value_1, provider)
   if response_1 is None:
         print("ERROR - Response 1: Failed to get a valid response")
         print(f"Case: {case}")
         print("Skipping this question.")
         return None, prompt_value_1, None, None, None, None, None, None, None, None, None, None, None, None, None, None, None, None, [None, None, None]
-  
-  # metadata
-  if prompt_value_1 is not None:
-    prompt_tokens_1 = response_1.response_metadata['token_usage']['prompt_tokens']
-    completion_tokens_1 = response_1.response_metadata['token_usage']['completion_tokens']
-    finish_reason_1=response_1.response_metadata['finish_reason']
-  else:
-    prompt_tokens_1 = None
-    completion_tokens_1 = None
-    finish_reason_1 = None
-  
-  # -------- Q2a
-  # question selection
-  if specific_question_type=='gender':
-    specific='gender'
-  elif specific_question_type=='ethnicity':
-    specific='ethnicity'
-  else:
-    raise ValueError("Unrecognised question type")
-  
-  # prompt
-  prompt_2a = ChatPromptTemplate.from_messages([
-    ("system", system_prompt),
-    ("user", user_prompt),
-    ("assistant", response_1.content),
-    ("user", specific_question)
-])
-  # chain
-  chain_2a = prompt_2a | llm
-  
-  # invoke
-  # -------- Q2a
-  try:
-      prompt_value_2a = handle_api_call(prompt_2a.invoke, {"CLINICAL_CASE": case,"QUESTION":question,"OPTIONS":options,"SPECIFIC":specific})
-      start_time_2a = time.time()
-      response_2a = handle_api_call(chain_2a.invoke, {"CLINICAL_CASE": case,"QUESTION":question,"OPTIONS":options, "SPECIFIC":specific})
-      end_time_2a = time.time()
-      running_time_2a = end_time_2a - start_time_2a
-      chat_history.extend([prompt_value_2a.messages[3].content, response_2a.content])
-  except Exception as e:
-      print(f"ERROR - Prompt 2a: {str(e)}")
-      running_time_2a = None
-      response_2a = None
-      prompt_value_2a = None
+
+  # -------- Q2a and Q2b
+  (prompt_value_2a, response_2a, running_time_2a, completion_tokens_2a, prompt_tokens_2a, finish_reason_2a), \
+  (prompt_value_2b, response_2b, running_time_2b, completion_tokens_2b, prompt_tokens_2b, finish_reason_2b) = await asyncio.gather(
+    run_followup(llm, prompt_value_1, response_1, specific_2a, provider, label="2a"),
+    run_followup(llm, prompt_value_1, response_1, specific_2b, provider, label="2b"),
+  )
+  for prompt_value, response in ((prompt_value_2a, response_2a), (prompt_value_2b, response_2b)):
+    if prompt_value is not None:
+      chat_history.extend([prompt_value.messages[3].content, response.content])
+    else:
       chat_history.extend([None, None])
-  
-  
-  # metadata
-  if prompt_value_2a is not None:
-    completion_tokens_2a = response_2a.response_metadata['token_usage']['completion_tokens']
-    prompt_tokens_2a = response_2a.response_metadata['token_usage']['prompt_tokens']
-    finish_reason_2a=response_2a.response_metadata['finish_reason']
-  else:
-    completion_tokens_2a = None
-    prompt_tokens_2a = None
-    finish_reason_2a = None
-  
-  # -------- Q2b - first one
-  # question selection
-  if specific_question_type=='gender':
-    specific='ethnicity'
-  elif specific_question_type=='ethnicity':
-    specific='gender'
-  else:
-    raise ValueError("Unrecognised question type")
-  
-  # prompt
-  prompt_2b = ChatPromptTemplate.from_messages([
-    ("system", system_prompt),
-    ("user", user_prompt),
-    ("assistant", response_1.content),
-    ("user", specific_question)
-])
-  # chain
-  chain_2b = prompt_2b | llm
-  
-  # invoke
-  try:
-    prompt_value_2b = handle_api_call(prompt_2b.invoke,{"CLINICAL_CASE": case,"QUESTION":question,"OPTIONS":options,"SPECIFIC":specific})
-    start_time_2b = time.time()
-    response_2b = handle_api_call(chain_2b.invoke,{"CLINICAL_CASE": case,"QUESTION":question,"OPTIONS":options, "SPECIFIC":specific})  # Pass chat history to question 2
-    end_time_2b=time.time()
-    running_time_2b=end_time_2b-start_time_2b
-    chat_history.extend([prompt_value_2b.messages[3].content, response_2b.content])
-  except Exception as e:
-    print(f"ERROR - Prompt 2b: {str(e)}")
-    print(f"Case: {case}")
-    running_time_2b = None
-    response_2b = None
-    prompt_value_2b = None
-    chat_history.extend([None, None])
-    print("Skipping this question due to error.")
-    
-  # metadata
-  if response_2b is not None:
-    completion_tokens_2b = response_2b.response_metadata['token_usage']['completion_tokens']
-    prompt_tokens_2b = response_2b.response_metadata['token_usage']['prompt_tokens']
-    finish_reason_2b=response_2b.response_metadata['finish_reason']
-  else:
-    completion_tokens_2b = None
-    prompt_tokens_2b = None
-    finish_reason_2b = None
 
   # ====== RETURN
   return response_1, prompt_value_1, completion_tokens_1, prompt_tokens_1, finish_reason_1, running_time_1, response_2a, prompt_value_2a, completion_tokens_2a, prompt_tokens_2a, finish_reason_2a, running_time_2a, response_2b, prompt_value_2b, completion_tokens_2b, prompt_tokens_2b, finish_reason_2b, running_time_2b, chat_history
 
 
+def experiment1_llm_pipeline_b(llm,case,question,options,specific_question_type, provider=None):
+  return run_sync(aexperiment1_llm_pipeline_b(llm, case, question, options, specific_question_type, provider))
+
+
+def results_to_record_b(llm_name, llm_data, results, correct_answer):
+    response_1, prompt_value_1, completion_tokens_1, prompt_tokens_1, finish_reason_1, running_time_1, response_2a, prompt_value_2a, completion_tokens_2a, prompt_tokens_2a, finish_reason_2a, running_time_2a, response_2b, prompt_value_2b, completion_tokens_2b, prompt_tokens_2b, finish_reason_2b, running_time_2b, chat_history = results
+    correct_answer_lower = correct_answer.lower()
+    record = {}
+
+    # WORK
+    if prompt_value_1 is not None and hasattr(prompt_value_1, 'messages'):
+        # prompts
+        prompt_value_1_str = f"System_prompt: {prompt_value_1.messages[0].content}\nUser Prompt: {prompt_value_1.messages[1].content}"
+
+        # response 1
+        response_1_str = response_1.content if response_1 else ''
+        response_1_parts = response_1_str.split('\n', 1)
+        response_1_label = response_1_parts[0] if len(response_1_parts) > 0 else ''
+        response_1_explanation = response_1_parts[1] if len(response_1_parts) > 1 else ''
+
+        # performance
+        response_1_label_lower = response_1_label.lower()
+        row_performance = 1 if response_1_label_lower == correct_answer_lower else 0
+
+        # chat history
+        chat_history_str="\n".join(message for message in chat_history if message is not None)
+
+        # Store prompt_value_1 related data
+        record[f'{llm_name}_prompt1'] = prompt_value_1_str
+        record[f'{llm_name}_response1'] = response_1_str
+        record[f'{llm_name}_label1'] = response_1_label
+        record[f'{llm_name}_explanation1'] = response_1_explanation
+        record[f'{llm_name}_performance'] = row_performance
+        record[f'{llm_name}_completion_tokens_1'] = completion_tokens_1
+        record[f'{llm_name}_prompt_tokens_1'] = prompt_tokens_1
+        record[f'{llm_name}_finish_reason_1'] = finish_reason_1
+        record[f'{llm_name}_running_time_1'] = running_time_1
+        record[f'{llm_name}_chat_history'] = chat_history_str
+    else:
+        record[f'{llm_name}_prompt1'] = None
+        record[f'{llm_name}_response1'] = None
+        record[f'{llm_name}_label1'] = None
+        record[f'{llm_name}_completion_tokens_1'] = None
+        record[f'{llm_name}_prompt_tokens_1'] = None
+        record[f'{llm_name}_finish_reason_1'] = None
+        record[f'{llm_name}_running_time_1'] = None
+        record[f'{llm_name}_explanation1'] = None
+        record[f'{llm_name}_performance'] = None
+        record[f'{llm_name}_chat_history'] = None
+
+    # Processing for prompt_value_2a
+    if prompt_value_2a is not None and hasattr(prompt_value_2a, 'messages'):
+        prompt_value_2a_str = "\n".join([msg.content for msg in prompt_value_2a.messages if hasattr(msg, 'content')])
+
+        response_2a_str = response_2a.content if response_2a else ''
+        response_2a_parts = response_2a_str.split('\n', 1)
+        response_2a_label = response_2a_parts[0] if len(response_2a_parts) > 0 else ''
+        response_2a_explanation = response_2a_parts[1] if len(response_2a_parts) > 1 else ''
+
+        # Store prompt_value_2a related data
+        record[f'{llm_name}_prompt2a'] = prompt_value_2a_str
+        record[f'{llm_name}_response2a'] = response_2a_str
+        record[f'{llm_name}_label2a'] = response_2a_label
+        record[f'{llm_name}_explanation2a'] = response_2a_explanation
+        # Metadata
+        record[f'{llm_name}_completion_tokens_2a'] = completion_tokens_2a
+        record[f'{llm_name}_prompt_tokens_2a'] = prompt_tokens_2a
+        record[f'{llm_name}_finish_reason_2a'] = finish_reason_2a
+        record[f'{llm_name}_running_time_2a'] = running_time_2a
+    else:
+        record[f'{llm_name}_prompt2a'] = None
+        record[f'{llm_name}_response2a'] = None
+        record[f'{llm_name}_label2a'] = None
+        record[f'{llm_name}_explanation2a'] = None
+        # metadata
+        record[f'{llm_name}_completion_tokens_2a'] = None
+        record[f'{llm_name}_prompt_tokens_2a'] = None
+        record[f'{llm_name}_finish_reason_2a'] = None
+        record[f'{llm_name}_running_time_2a'] = None
+
+    # Processing for prompt_value_2b
+    if prompt_value_2b is not None and hasattr(prompt_value_2b, 'messages'):
+        prompt_value_2b_str = "\n".join([msg.content for msg in prompt_value_2b.messages if hasattr(msg, 'content')])
+
+        response_2b_str = response_2b.content if response_2b else ''
+        response_2b_parts = response_2b_str.split('\n', 1)
+        response_2b_label = response_2b_parts[0] if len(response_2b_parts) > 0 else ''
+        response_2b_explanation = response_2b_parts[1] if len(response_2b_parts) > 1 else ''
+
+        # Store prompt_value_2b related data
+        record[f'{llm_name}_prompt2b'] = prompt_value_2b_str
+        record[f'{llm_name}_response2b'] = response_2b_str
+        record[f'{llm_name}_label2b'] = response_2b_label
+        record[f'{llm_name}_explanation2b'] = response_2b_explanation
+        # metadata
+        record[f'{llm_name}_completion_tokens_2b'] = completion_tokens_2b
+        record[f'{llm_name}_prompt_tokens_2b'] = prompt_tokens_2b
+        record[f'{llm_name}_finish_reason_2b'] = finish_reason_2b
+        record[f'{llm_name}_running_time_2b'] = running_time_2b
+    else:
+        record[f'{llm_name}_prompt2b'] = None
+        record[f'{llm_name}_response2b'] = None
+        record[f'{llm_name}_label2b'] = None
+        record[f'{llm_name}_explanation2b'] = None
+        record[f'{llm_name}_completion_tokens_2b'] = None
+        record[f'{llm_name}_prompt_tokens_2b'] = None
+        record[f'{llm_name}_finish_reason_2b'] = None
+        record[f'{llm_name}_running_time_2b'] = None
+
+    # Pricing
+    input_tokens = (prompt_tokens_1 or 0) + (prompt_tokens_2a or 0) + (prompt_tokens_2b or 0)
+    output_tokens = (completion_tokens_1 or 0) + (completion_tokens_2a or 0) + (completion_tokens_2b or 0)
+    # (price table of the cost ledger, by the model name the provider reported)
+    model_id = response_model_name(response_1) or llm_data.get("model_name")
+    record[f'{llm_name}_input_price'], record[f'{llm_name}_output_price'] = get_cost_ledger().token_costs(model_id, input_tokens, output_tokens)
+    record[f'{llm_name}_total_price'] = record[f'{llm_name}_input_price'] + record[f'{llm_name}_output_price']
+    return record
+
+
 # =========== Experiment pipeline
-def process_llms_and_df_b(llms, df, specific_question_type, saving_path=None):
+def process_llms_and_df_b(llms, df, specific_question_type, saving_path=None, max_concurrency=None):
+    setup_response_cache()
+
     # Create df_results as a copy of df
     df_results = df.copy()
 
     # Initialization
     total_rows = len(df)
-    progress_interval = max(1, total_rows // 10)  # Calculate 10% of total rows
 
     # LLM loop
     for llm_name, llm_data in llms.items():
@@ -197,170 +251,36 @@ def process_llms_and_df_b(llms, df, specific_question_type, saving_path=None):
             print(f"Warning: No model found for {llm_name}. Skipping this LLM.")
             continue
 
-        # df loop
-        for idx_val, row_val in df_results.iterrows():
-            # Extracting the data
-            clinical_case = row_val['case']
-            question=row_val['normalized_question']
-            options = f"A. {row_val['opa_shuffled']}\nB. {row_val['opb_shuffled']}\nC. {row_val['opc_shuffled']}\nD. {row_val['opd_shuffled']}"
-            correct_answer=row_val['answer_idx_shuffled']; correct_answer_lower = correct_answer.lower()
+        # Rows run concurrently; each record is appended to a JSONL shard (kept in memory without saving_path)
+        # and the columns are attached to df_results once at the end
+        sink = ResultSink(shard_path_for(saving_path, llm_name) if saving_path is not None else None, overwrite=True)
+
+        def jobs():
+            for idx_val, row_val in df.iterrows():
+                yield idx_val, (
+                    llm_model,
+                    row_val['case'],
+                    row_val['normalized_question'],
+                    f"A. {row_val['opa_shuffled']}\nB. {row_val['opb_shuffled']}\nC. {row_val['opc_shuffled']}\nD. {row_val['opd_shuffled']}",
+                    specific_question_type,
+                    llm_data.get("provider")
+                )
 
-            # Run the LLM
+        def on_result(idx_val, results):
+            if results is None:
+                return
             try:
-              response_1, prompt_value_1, completion_tokens_1, prompt_tokens_1, finish_reason_1, running_time_1, response_2a, prompt_value_2a, completion_tokens_2a, prompt_tokens_2a, finish_reason_2a, running_time_2a, response_2b, prompt_value_2b, completion_tokens_2b, prompt_tokens_2b, finish_reason_2b, running_time_2b, chat_history = experiment1_llm_pipeline_b(
-              llm=llm_model,
-              case=clinical_case,
-              question=question,
-              options=options,
-              specific_question_type=specific_question_type
-          )
-            except KeyError as e:
-              print(f"KeyError in llm_data for {llm_name}: {e}")
-              print(f"Available keys in llm_data: {llm_data.keys()}")
-              continue
+                sink.write(idx_val, results_to_record_b(llm_name, llm_data, results, df.at[idx_val, 'answer_idx_shuffled']))
             except Exception as e:
-              print(f"Unexpected error occurred: {str(e)}")
-              print(f"Question: {question}")
-              response_1 = None
-              prompt_value_1 = None
-              completion_tokens_1 = None
-              prompt_tokens_1 = None
-              finish_reason_1 = None
-              running_time_1 = None
-              response_2a = None
-              prompt_value_2a = None
-              completion_tokens_2a = None
-              prompt_tokens_2a = None
-              finish_reason_2a = None
-              running_time_2a = None
-              response_2b = None
-              prompt_value_2b = None
-              completion_tokens_2b = None
-              prompt_tokens_2b = None
-              finish_reason_2b = None
-              running_time_2b = None
-              chat_history = [None, None, None, None, None, None, None, None]
-              print("Skipping this question.")
-            
-            
-            # WORK
-            if prompt_value_1 is not None and hasattr(prompt_value_1, 'messages'):
-                # prompts
-                prompt_value_1_str = f"System_prompt: {prompt_value_1.messages[0].content}\nUser Prompt: {prompt_value_1.messages[1].content}"
-                
-                # response 1
-                response_1_str = response_1.content if response_1 else ''
-                response_1_parts = response_1_str.split('\n', 1)
-                response_1_label = response_1_parts[0] if len(response_1_parts) > 0 else ''
-                response_1_explanation = response_1_parts[1] if len(response_1_parts) > 1 else ''
-                
-                # performance
-                response_1_label_lower = response_1_label.lower()
-                row_performance = 1 if response_1_label_lower == correct_answer_lower else 0
-                
-                # chat history
-                chat_history_str="\n".join(chat_history)
-
-                # Store prompt_value_1 related data
-                df_results.loc[idx_val, f'{llm_name}_prompt1'] = prompt_value_1_str
-                df_results.loc[idx_val, f'{llm_name}_response1'] = response_1_str
-                df_results.loc[idx_val, f'{llm_name}_label1'] = response_1_label
-                df_results.loc[idx_val, f'{llm_name}_explanation1'] = response_1_explanation
-                df_results.loc[idx_val, f'{llm_name}_performance'] = row_performance
-                df_results.loc[idx_val, f'{llm_name}_completion_tokens_1'] = completion_tokens_1
-                df_results.loc[idx_val, f'{llm_name}_prompt_tokens_1'] = prompt_tokens_1
-                df_results.loc[idx_val, f'{llm_name}_finish_reason_1'] = finish_reason_1
-                df_results.loc[idx_val, f'{llm_name}_running_time_1'] = running_time_1
-                df_results.loc[idx_val, f'{llm_name}_chat_history'] = chat_history_str
-            else:
-                df_results.loc[idx_val, f'{llm_name}_prompt1'] = None
-                df_results.loc[idx_val, f'{llm_name}_response1'] = None
-                df_results.loc[idx_val, f'{llm_name}_label1'] = None
-                df_results.loc[idx_val, f'{llm_name}_completion_tokens_1'] = None
-                df_results.loc[idx_val, f'{llm_name}_prompt_tokens_1'] = None
-                df_results.loc[idx_val, f'{llm_name}_finish_reason_1'] = None
-                df_results.loc[idx_val, f'{llm_name}_running_time_1'] = None
-                df_results.loc[idx_val, f'{llm_name}_explanation1'] = None
-                df_results.loc[idx_val, f'{llm_name}_performance'] = None
-                df_results.loc[idx_val, f'{llm_name}_chat_history'] = None
-
-            # Processing for prompt_value_2a
-            if prompt_value_2a is not None and hasattr(prompt_value_2a, 'messages'):
-                prompt_value_2a_str = "\n".join([msg.content for msg in prompt_value_2a.messages if hasattr(msg, 'content')])
-                
-                response_2a_str = response_2a.content if response_2a else ''
-                response_2a_parts = response_2a_str.split('\n', 1)
-                response_2a_label = response_2a_parts[0] if len(response_2a_parts) > 0 else ''
-                response_2a_explanation = response_2a_parts[1] if len(response_2a_parts) > 1 else ''
-
-                # Store prompt_value_2a related data
-                df_results.loc[idx_val, f'{llm_name}_prompt2a'] = prompt_value_2a_str
-                df_results.loc[idx_val, f'{llm_name}_response2a'] = response_2a_str
-                df_results.loc[idx_val, f'{llm_name}_label2a'] = response_2a_label
-                df_results.loc[idx_val, f'{llm_name}_explanation2a'] = response_2a_explanation
-                # Metadata
-                df_results.loc[idx_val, f'{llm_name}_completion_tokens_2a'] = completion_tokens_2a
-                df_results.loc[idx_val, f'{llm_name}_prompt_tokens_2a'] = prompt_tokens_2a
-                df_results.loc[idx_val, f'{llm_name}_finish_reason_2a'] = finish_reason_2a
-                df_results.loc[idx_val, f'{llm_name}_running_time_2a'] = running_time_2a
-            else:
-                df_results.loc[idx_val, f'{llm_name}_prompt2a'] = None
-                df_results.loc[idx_val, f'{llm_name}_response2a'] = None
-                df_results.loc[idx_val, f'{llm_name}_label2a'] = None
-                df_results.loc[idx_val, f'{llm_name}_explanation2a'] = None
-                # metadata
-                df_results.loc[idx_val, f'{llm_name}_completion_tokens_2a'] = None
-                df_results.loc[idx_val, f'{llm_name}_prompt_tokens_2a'] = None
-                df_results.loc[idx_val, f'{llm_name}_finish_reason_2a'] = None
-                df_results.loc[idx_val, f'{llm_name}_running_time_2a'] = None
-
-            # Processing for prompt_value_2b
-            if prompt_value_2b is not None and hasattr(prompt_value_2b, 'messages'):
-                prompt_value_2b_str = "\n".join([msg.content for msg in prompt_value_2b.messages if hasattr(msg, 'content')])
-                
-                response_2b_str = response_2b.content if response_2b else ''
-                response_2b_parts = response_2b_str.split('\n', 1)
-                response_2b_label = response_2b_parts[0] if len(response_2b_parts) > 0 else ''
-                response_2b_explanation = response_2b_parts[1] if len(response_2b_parts) > 1 else ''
-
-                # Store prompt_value_2b related data
-                df_results.loc[idx_val, f'{llm_name}_prompt2b'] = prompt_value_2b_str
-                df_results.loc[idx_val, f'{llm_name}_response2b'] = response_2b_str
-                df_results.loc[idx_val, f'{llm_name}_label2b'] = response_2b_label
-                df_results.loc[idx_val, f'{llm_name}_explanation2b'] = response_2b_explanation
-                # metadata
-                df_results.loc[idx_val, f'{llm_name}_completion_tokens_2b'] = completion_tokens_2b
-                df_results.loc[idx_val, f'{llm_name}_prompt_tokens_2b'] = prompt_tokens_2b
-                df_results.loc[idx_val, f'{llm_name}_finish_reason_2b'] = finish_reason_2b
-                df_results.loc[idx_val, f'{llm_name}_running_time_2b'] = running_time_2b
-            else:
-                df_results.loc[idx_val, f'{llm_name}_prompt2b'] = None
-                df_results.loc[idx_val, f'{llm_name}_response2b'] = None
-                df_results.loc[idx_val, f'{llm_name}_label2b'] = None
-                df_results.loc[idx_val, f'{llm_name}_explanation2b'] = None
-                df_results.loc[idx_val, f'{llm_name}_completion_tokens_2b'] = None
-                df_results.loc[idx_val, f'{llm_name}_prompt_tokens_2b'] = None
-                df_results.loc[idx_val, f'{llm_name}_finish_reason_2b'] = None
-                df_results.loc[idx_val, f'{llm_name}_running_time_2b'] = None
-            
-            # Pricing
-            input_tokens = (prompt_tokens_1 or 0) + (prompt_tokens_2a or 0) + (prompt_tokens_2b or 0)
-            output_tokens = (completion_tokens_1 or 0) + (completion_tokens_2a or 0) + (completion_tokens_2b or 0)
-            df_results.loc[idx_val, f'{llm_name}_input_price'] = llm_data["price_per_input_token"] * input_tokens
-            df_results.loc[idx_val, f'{llm_name}_output_price'] = llm_data["price_per_output_token"] * output_tokens
-            df_results.loc[idx_val, f'{llm_name}_total_price'] = df_results.loc[idx_val, f'{llm_name}_input_price'] + df_results.loc[idx_val, f'{llm_name}_output_price']  
-                
-            # ----- Print progress every 10%
-            if (idx_val + 1) % progress_interval == 0:
-                progress_percentage = ((idx_val + 1) / total_rows) * 100
-                print(f"----- Progress: {progress_percentage:.1f}% complete")
-                if saving_path is not None:
-                    df_results.to_csv(saving_path, index=False)
-                    print(f"Saved progress to {saving_path}")
-
-        # You can also keep a running total if needed
+                print(f"Error processing row {idx_val} for {llm_name}: {str(e)}")
+
+        run_sync(run_rows_async(aexperiment1_llm_pipeline_b, jobs(), on_result=on_result, desc=f"Processing {llm_name}", total=total_rows,
+                                max_concurrency=max_concurrency or llm_data.get("max_concurrency", MAX_CONCURRENCY)))
+
+        # Compaction: attach this LLM's columns and write the CSV once
+        sink.close()
+        df_results = sink.compact(df_results, saving_path)
         if saving_path is not None:
-                    df_results.to_csv(saving_path, index=False)
                     print(f"Saved progress for {llm_name} to {saving_path}")
                     
         # Check if performance column exists, if not, create it
@@ -388,5 +308,9 @@ def process_llms_and_df_b(llms, df, specific_question_type, saving_path=None):
         # DONE
         print(f"Finished processing with LLM: {llm_name}")  # Print when finished with current LLM
             
+    print_cache_stats()
+    print_http_stats()
+    if saving_path is not None:
+        get_cost_ledger().write_summary(cost_summary_path_for(saving_path))
     print("\nAll LLMs processed. Returning results.")
     return df_results
@@ -1,38 +1,27 @@
 # ---- 1/ Imports
 import os
 from datetime import datetime
+from functools import partial
 import pandas as pd
-from concurrent.futures import ThreadPoolExecutor, as_completed
 from tqdm import tqdm
 import time
-import random
 from langchain_core.prompt_values import ChatPromptValue
 from langchain_core.messages import BaseMessage
-from langchain_core.prompts import ChatPromptTemplate
 
-from llm.prompts import exp2_system_prompt, exp2_user_prompt, exp3_system_prompt, exp3_user_prompt, exp4_system_prompt, exp4_user_prompt
+from config.settings import MAX_CONCURRENCY
+from llm.rate_limit import get_rate_limiter
+from llm.cache import setup_response_cache, print_cache_stats
+from llm.http_pool import print_http_stats
+from llm.costs import get_cost_ledger
+from pipelines.sink import ResultSink, ColumnBuffer, shard_path_for, load_completed
+from pipelines.inputs import iter_input_chunks
+from llm.engine import run_rows_async, run_sync, create_provider_semaphores, run_models_async
+from llm.ollama_pool import schedule_model
+from llm.dedup import RequestPlan, request_key, print_plan_stats
+
+from llm.prompts import get_prompt_template, get_prompt_hash
 
 # ---- 2/ Helper functions
-def handle_api_call(func, *args, **kwargs):
-    max_retries = 5
-    base_wait = 10
-
-    for attempt in range(max_retries):
-        try:
-            return func(*args, **kwargs)
-        except Exception as e:
-            if "429" in str(e) or "rate limit" in str(e).lower():
-                wait_time = base_wait * (2 ** attempt) + random.uniform(0, 1)
-                print(f"Rate limit reached. Waiting for {wait_time:.2f} seconds before retry {attempt + 1}/{max_retries}")
-                time.sleep(wait_time)
-                if attempt == max_retries - 1:
-                    print("Max retries reached. Skipping this call.")
-                    return None
-            else:
-                print(f"Unexpected error: {str(e)}")
-                return None
-            
-            
 def extract_prompt_content(prompt_value):
     if isinstance(prompt_value, ChatPromptValue):
         return "\n".join(message.content for message in prompt_value.messages)
@@ -43,48 +32,60 @@ def extract_response_content(response):
         return response.content
     return str(response)
 
-def store_results_in_df(df, idx, llm_name, results, experiment_type):
+def prompt_variables(row):
+    return {
+        "CLINICAL_CASE": row['case'],
+        "QUESTION": row['normalized_question'],
+        "OPTIONS": f"A. {row['opa_shuffled']}\nB. {row['opb_shuffled']}\nC. {row['opc_shuffled']}\nD. {row['opd_shuffled']}",
+    }
+
+def result_column_dtypes(llm_name):
+    return {
+        f'{llm_name}_response1': "str",
+        f'{llm_name}_prompt1': "str",
+        f'{llm_name}_running_time_1': "float",
+        f'{llm_name}_chat_history': "str",
+        f'{llm_name}_performance': "int",
+    }
+
+def results_to_record(llm_name, results, correct_answer):
     # Unpack results
     response_1, prompt_value_1,  running_time_1, metadata, chat_history= results
+    record = {}
 
     # Store results for Q1
-    df.at[idx, f'{llm_name}_response1'] = extract_response_content(response_1)
-    df.at[idx, f'{llm_name}_prompt1'] = extract_prompt_content(prompt_value_1)
-    df.at[idx, f'{llm_name}_running_time_1'] = running_time_1
+    record[f'{llm_name}_response1'] = extract_response_content(response_1)
+    record[f'{llm_name}_prompt1'] = extract_prompt_content(prompt_value_1)
+    record[f'{llm_name}_running_time_1'] = running_time_1
 
     # Store chat history
     if chat_history:
-        df.at[idx, f'{llm_name}_chat_history'] = "\n".join(
+        record[f'{llm_name}_chat_history'] = "\n".join(
             str(message) for message in chat_history if isinstance(message, BaseMessage)
         )
     else:
-        df.at[idx, f'{llm_name}_chat_history'] = None
+        record[f'{llm_name}_chat_history'] = None
 
     # Calculate and store performance
-    correct_answer = df.at[idx, 'answer_idx_shuffled'].lower()
+    correct_answer = correct_answer.lower()
     response_label = extract_response_content(response_1).split('\n', 1)[0].lower()
-    df.at[idx, f'{llm_name}_performance'] = 1 if response_label == correct_answer else 0
+    record[f'{llm_name}_performance'] = 1 if response_label == correct_answer else 0
+    return record
 
 
 # ---- 3/ Experiment pipeline
 
 # ====== FRAMEWORK
 
-def fw2(llm, case, question, options, experiment_type,experiment_number):
+async def afw2(llm, case, question, options, experiment_type,experiment_number, provider=None, messages=None):
     # Debugging
     if llm is None:
         raise ValueError("LLM model is None. Please ensure a valid model is provided.")
       
     # --- 1. Prompts 
-    if experiment_number == 2:
-        system_prompt = exp2_system_prompt
-        user_prompt = exp2_user_prompt
-    elif experiment_number == 3:
-        system_prompt = exp3_system_prompt
-        user_prompt = exp3_user_prompt
-    elif experiment_number == 4:
-        system_prompt = exp4_system_prompt
-        user_prompt = exp4_user_prompt
+    # Compiled once and shared by every row (see llm/prompts.py)
+    if experiment_number in (2, 3, 4):
+        prompt_1 = get_prompt_template(f'exp{experiment_number}')
     else:
         raise ValueError("Invalid experiment number. Please provide a valid experiment number.")
   
@@ -92,23 +93,14 @@ def fw2(llm, case, question, options, experiment_type,experiment_number):
     chat_history = []
   
     # -------- Q1
-    prompt_1 = ChatPromptTemplate.from_messages([
-        ("system", system_prompt),
-        ("user", user_prompt)
-    ])
-    chain_1 = prompt_1 | llm
-  
-    # invoke
-    prompt_value_1 = handle_api_call(prompt_1.invoke, {"CLINICAL_CASE": case, "QUESTION": question, "OPTIONS": options})
+    # messages: prompt already rendered by the caller (see the request plan of process_single_llm_async)
+    if messages is None:
+        messages = prompt_1.format_messages(CLINICAL_CASE=case, QUESTION=question, OPTIONS=options)
+    prompt_value_1 = ChatPromptValue(messages=messages)
     chat_history.append(prompt_value_1)
-    if prompt_value_1 is None:
-        print("ERROR - Prompt 1: Failed to get a valid response")
-        # print(f"Case: {case}")
-        # print("Skipping this question.")
-        return None, None, None, None,[None, None]
 
     start_time_1 = time.time()
-    response_1 = handle_api_call(chain_1.invoke, {"CLINICAL_CASE": case, "QUESTION": question, "OPTIONS": options})
+    response_1 = await get_rate_limiter(provider).acall(llm.ainvoke, messages)
     chat_history.append(response_1)
     end_time_1 = time.time()
     running_time_1 = end_time_1 - start_time_1
@@ -127,68 +119,132 @@ def fw2(llm, case, question, options, experiment_type,experiment_number):
     return response_1, prompt_value_1,  running_time_1, metadata, chat_history
 
 
+def fw2(llm, case, question, options, experiment_type,experiment_number, provider=None):
+    return run_sync(afw2(llm, case, question, options, experiment_type, experiment_number, provider))
+
+
 
 # ====== PROCESSING
-import os
-from concurrent.futures import ThreadPoolExecutor
 
-def process_single_llm(llm_name, llm_data, df, experiment_type, experiment_number, saving_dir, saving_path):
+async def process_single_llm_async(llm_name, llm_data, df, experiment_type, experiment_number, saving_dir, saving_path, max_concurrency=None,
+                                   semaphore=None, position=None, resume=False, chunksize=None):
+    """
+    Run one model over df and write its results to saving_path.
+
+    df is a DataFrame, or the path of the input CSV, which is then streamed in chunks of chunksize rows
+    (see pipelines/inputs.py): each chunk goes through the model and is appended to the CSV before the
+    next one is read. Returns the results DataFrame, or saving_path when the input was streamed.
+    """
     print(f"\nProcessing with LLM: {llm_name}")
     
-    # Create a copy of the dataframe for this LLM
-    df_llm = df.copy()
-    
     # Get the LLM model
     llm_model = llm_data.get("model")
     if llm_model is None:
         print(f"Warning: No model found for {llm_name}. Skipping this LLM.")
         return None
 
-    total_rows = len(df_llm)
-    save_interval = max(1, total_rows // 10)  # Save every 10% of rows, minimum 1
+    # Concurrency limit: argument > per-model setting > global default
+    if max_concurrency is None:
+        max_concurrency = llm_data.get("max_concurrency", MAX_CONCURRENCY)
+
+    # Resume: skip the rows a previous run already answered (they have a running time)
+    streaming = not isinstance(df, pd.DataFrame)
+    completed = set()
+    if resume:
+        completed = load_completed(saving_path, llm_name, f'{llm_name}_running_time_1')
+        if streaming:
+            print(f"Resuming {llm_name}: {len(completed)} rows already done")
+        else:
+            completed &= set(df.index)
+            print(f"Resuming {llm_name}: {len(completed)} rows already done, {len(df) - len(completed)} to go")
+
+    total_rows = None if streaming else len(df) - len(completed)
+    save_interval = max(1, total_rows // 10) if total_rows is not None else None  # Report every 10% of rows, or once per chunk
     processed_rows = 0
 
-    # Use ThreadPoolExecutor for parallel processing
-    with ThreadPoolExecutor(max_workers=5) as executor:
-        futures = []
-        for idx, row in df_llm.iterrows():
-            future = executor.submit(
-                fw2,
+    # Each finished row is appended to a JSONL shard; the results of the current chunk are kept as typed columns
+    # and the CSV is written chunk by chunk (once, for a DataFrame)
+    sink = ResultSink(shard_path_for(saving_path), columns=ColumnBuffer([], result_column_dtypes(llm_name)))
+
+    # Rows rendering the same prompt (same case and question in several versions, duplicated rows) share one
+    # request: only the first row of each group is sent, with the messages rendered here, and its response
+    # is written for all of them
+    prompt_name = f'exp{experiment_number}'
+    prompt = get_prompt_template(prompt_name)
+    # Which prompt version produced the results
+    print(f"Prompt {prompt_name} for {llm_name}: sha256 {get_prompt_hash(prompt_name)}")
+    plan = None
+    planned_rows, unique_requests = 0, 0
+
+    def jobs(chunk):
+        for idx, row in chunk.iterrows():
+            if not plan.is_leader(idx):
+                continue
+            variables = prompt_variables(row)
+            yield idx, (
                 llm_model,
-                row['case'],
-                row['normalized_question'],
-                f"A. {row['opa_shuffled']}\nB. {row['opb_shuffled']}\nC. {row['opc_shuffled']}\nD. {row['opd_shuffled']}",
+                variables["CLINICAL_CASE"],
+                variables["QUESTION"],
+                variables["OPTIONS"],
                 experiment_type,
-                experiment_number
+                experiment_number,
+                llm_data.get("provider"),
+                plan.request_for(idx)
             )
-            futures.append((idx, future))
 
-        # Process results as they complete
-        for idx, future in tqdm(futures, total=total_rows, desc=f"Processing {llm_name}"):
+    # Process results as they complete
+    def on_result(idx, results):
+        nonlocal processed_rows
+        for row_idx in plan.rows_for(idx):
             try:
-                results = future.result()
-                # Store results in df_llm
-                store_results_in_df(df_llm, idx, llm_name, results, experiment_type)
-                
-                processed_rows += 1
-                
-                # Save every 10% of total rows
-                if processed_rows % save_interval == 0 or processed_rows == total_rows:
-                    df_llm.to_csv(saving_path, index=False)
-                    print(f"Saved results for {llm_name} at row {processed_rows} to {saving_path}")
-                
+                # Append results to the shard
+                sink.write(row_idx, results_to_record(llm_name, results, chunk.at[row_idx, 'answer_idx_shuffled']))
             except Exception as e:
-                print(f"Error processing row {idx} for {llm_name}: {str(e)}")
+                print(f"Error processing row {row_idx} for {llm_name}: {str(e)}")
+
+            processed_rows += 1
+
+            # Report every 10% of total rows
+            if save_interval is not None and (processed_rows % save_interval == 0 or processed_rows == total_rows):
+                print(f"Saved results for {llm_name} at row {processed_rows} to {sink.shard_path}")
+
+    df_llm = None
+    for chunk in iter_input_chunks(df, chunksize):
+        sink.start_chunk(chunk.index)
+        plan = RequestPlan()
+        for idx, row in chunk.iterrows():
+            if idx not in completed:
+                messages = prompt.format_messages(**prompt_variables(row))
+                plan.add(idx, request_key(llm_name, messages), messages)
+        planned_rows += plan.rows
+        unique_requests += plan.unique
+        await run_rows_async(afw2, jobs(chunk), max_concurrency=max_concurrency, on_result=on_result,
+                             desc=f"Processing {llm_name}", total=plan.unique, semaphore=semaphore, position=position)
 
-    # Final save is already done in the loop, so we don't need to do it again here
+        # Compaction: attach the chunk's results to its rows and append them to the CSV
+        df_llm = sink.compact(chunk, saving_path, append=True)
+        if streaming:
+            print(f"Saved results for {llm_name} ({processed_rows} rows so far) to {saving_path}")
+    print_plan_stats(llm_name, planned_rows, unique_requests)
+    sink.close()
     print(f"Completed processing for {llm_name}. Final results saved to {saving_path}")
     
-    return df_llm
+    return saving_path if streaming else df_llm
+
+
+def process_single_llm(llm_name, llm_data, df, experiment_type, experiment_number, saving_dir, saving_path, max_concurrency=None, resume=False,
+                       chunksize=None):
+    setup_response_cache()
+    return run_sync(process_single_llm_async(llm_name, llm_data, df, experiment_type, experiment_number, saving_dir, saving_path, max_concurrency,
+                                             resume=resume, chunksize=chunksize))
 
 # ====== MAIN PIPELINE
 
-def process_llms_and_df_fw2(llms, df, experiment_type,repo_dir,experiment_number, experiment_name):
+def process_llms_and_df_fw2(llms, df, experiment_type,repo_dir,experiment_number, experiment_name, resume_dir=None, chunksize=None):
+    # df: DataFrame, or path of the input CSV to stream in chunks of chunksize rows (constant memory; each model
+    # reads the file on its own, see process_single_llm_async)
     print(f"Starting experiment: #{experiment_number}, Experiment name: {experiment_name}")
+    setup_response_cache()
     
     # ----------------- RESULTS DIRECTORY -----------------
     timestamp = datetime.now().strftime("%Y%m%d_%H%M%S")
@@ -198,19 +254,41 @@ def process_llms_and_df_fw2(llms, df, experiment_type,repo_dir,experiment_number
         if not os.path.exists(saving_folder):
             os.makedirs(saving_folder)
         return saving_folder
-    saving_folder=create_saving_folder(experiment_number)
+    if resume_dir is not None:
+        # Continue an interrupted run in its own folder
+        if not os.path.isdir(resume_dir):
+            raise FileNotFoundError(f"Run directory to resume not found: {resume_dir}")
+        saving_folder = resume_dir
+        print(f"Resuming run in {saving_folder}")
+    else:
+        saving_folder=create_saving_folder(experiment_number)
     
     
     
 
-    results = {}
-    for llm_name, llm_data in llms.items():
-        # Saving path
-        saving_dir = os.path.join(saving_folder)
-        os.makedirs(saving_dir, exist_ok=True)
-        file_name = f"results_exp{experiment_number}_{experiment_type}_{llm_name}.csv"
-        saving_path = os.path.join(saving_dir, file_name)
-        # Process the LLM
-        results[llm_name] = process_single_llm(llm_name, llm_data, df, experiment_type, experiment_number, saving_dir, saving_path)
+    # Run every model at the same time; models of the same provider share its concurrency budget,
+    # Ollama models of the same host run one after another
+    async def run_all_models():
+        provider_semaphores = create_provider_semaphores(llms)
+        model_coros = {}
+        for position, (llm_name, llm_data) in enumerate(llms.items()):
+            # Saving path
+            saving_dir = os.path.join(saving_folder)
+            os.makedirs(saving_dir, exist_ok=True)
+            file_name = f"results_exp{experiment_number}_{experiment_type}_{llm_name}.csv"
+            saving_path = os.path.join(saving_dir, file_name)
+            # Process the LLM
+            # Ollama models wait for their host and are loaded first (see llm/ollama_pool.py)
+            model_coros[llm_name] = schedule_model(
+                llm_data, provider_semaphores[llm_data.get("provider", "default")],
+                partial(process_single_llm_async, llm_name, llm_data, df, experiment_type, experiment_number, saving_dir, saving_path,
+                        position=position, resume=resume_dir is not None, chunksize=chunksize)
+            )
+        return await run_models_async(model_coros)
+
+    results = run_sync(run_all_models())
+    print_cache_stats()
+    print_http_stats()
+    get_cost_ledger().write_summary(os.path.join(saving_folder, "cost_summary.csv"))
     print("\nAll LLMs processed. Experiment complete.")
     return results
@@ -0,0 +1,196 @@
+# ---- 1/ Imports
+import hashlib
+import json
+import os
+import sqlite3
+
+import pandas as pd
+from tqdm import tqdm
+
+from llm.tokens import get_token_counter
+from pipelines.inputs import read_input_chunks
+from pipelines.fw5 import create_user_prompt_function, render_messages
+from llm.prompts import exp6_user_prompt_mcq, exp6_user_prompt_xpl
+
+# Limits of the OpenAI fine-tuning API (gpt-4o-mini): tokens per training example, and a per-file budget
+# that keeps every shard well under the upload size limit
+MAX_EXAMPLE_TOKENS = 65536
+MAX_FILE_TOKENS = 20_000_000
+TOKEN_MODEL = "gpt-4o-mini"
+
+
+# ---- 2/ Examples
+def example_target(row, task="MCQ", explanation_column="explanation"):
+    """Assistant message of a training example: the answer label (MCQ) or the explanation (XPL), None if missing."""
+    value = row['answer_idx_shuffled'] if task == "MCQ" else row.get(explanation_column)
+    if value is None or pd.isna(value) or not str(value).strip():
+        return None
+    return str(value).strip().upper() if task == "MCQ" else str(value).strip()
+
+
+def example_hash(messages):
+    """Content hash of a training example, used to drop duplicates (e.g. identical augmented variants)."""
+    payload = json.dumps(messages, sort_keys=True, ensure_ascii=False)
+    return hashlib.blake2b(payload.encode("utf-8"), digest_size=16).digest()
+
+
+class SeenHashes:
+    """
+    Hashes of the examples already written.
+
+    Kept in memory by default; with path they live in a SQLite file instead (reset on open), so that
+    deduplication of datasets with more unique examples than fit in RAM only costs disk space.
+    """
+
+    def __init__(self, path=None):
+        self.path = path
+        self.hashes = set() if path is None else None
+        self.conn = None
+        if path is not None:
+            os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+            self.conn = sqlite3.connect(path)
+            # Starts empty: hashes of a previous build would mark every example as a duplicate
+            self.conn.execute("DROP TABLE IF EXISTS seen")
+            self.conn.execute("CREATE TABLE seen (hash BLOB PRIMARY KEY) WITHOUT ROWID")
+
+    def add(self, digest):
+        """Record digest; returns False when it was already there."""
+        if self.hashes is not None:
+            if digest in self.hashes:
+                return False
+            self.hashes.add(digest)
+            return True
+        return self.conn.execute("INSERT OR IGNORE INTO seen (hash) VALUES (?)", (digest,)).rowcount == 1
+
+    def commit(self):
+        if self.conn is not None:
+            self.conn.commit()
+
+    def close(self):
+        if self.conn is not None:
+            self.conn.commit()
+            self.conn.close()
+            self.conn = None
+
+
+# ---- 3/ Sharded writer
+class ShardWriter:
+    """
+    JSONL training files of at most max_file_tokens tokens: <output_dir>/<name>.<shard>.jsonl.
+
+    A new shard is started when the next example would go over the budget. Keeps per-shard counts
+    for the report.
+    """
+
+    def __init__(self, output_dir, name, max_file_tokens=MAX_FILE_TOKENS):
+        self.output_dir = output_dir
+        self.name = name
+        self.max_file_tokens = max_file_tokens
+        self.shards = []
+        self.file = None
+        os.makedirs(output_dir, exist_ok=True)
+
+    def _open_shard(self):
+        self.close()
+        path = os.path.join(self.output_dir, f"{self.name}.{len(self.shards):03d}.jsonl")
+        self.file = open(path, "w", encoding="utf-8")
+        self.shards.append({"path": path, "examples": 0, "tokens": 0, "target_tokens": 0})
+
+    def write(self, messages, tokens, target_tokens):
+        shard = self.shards[-1] if self.shards else None
+        if shard is None or self.file is None or (shard["examples"] and shard["tokens"] + tokens > self.max_file_tokens):
+            self._open_shard()
+            shard = self.shards[-1]
+        self.file.write(json.dumps({"messages": messages}, ensure_ascii=False) + "\n")
+        shard["examples"] += 1
+        shard["tokens"] += tokens
+        shard["target_tokens"] += target_tokens
+
+    def close(self):
+        if self.file is not None:
+            self.file.close()
+            self.file = None
+
+
+# ---- 4/ Builder
+def build_ft_dataset(input_paths, output_dir, task="MCQ", name=None, chunksize=None, explanation_column="explanation",
+                     max_example_tokens=MAX_EXAMPLE_TOKENS, max_file_tokens=MAX_FILE_TOKENS, dedup_path=None,
+                     token_model=TOKEN_MODEL):
+    """
+    Build chat-format fine-tuning files ({"messages": [system, user, assistant]}) from the G/GxE CSVs.
+
+    The CSVs are streamed chunk by chunk (see pipelines/inputs.py) through the exp6 MCQ or XPL templates,
+    so memory does not grow with the dataset. Identical examples are written once. Examples over
+    max_example_tokens are dropped, and the output is split into shards of at most max_file_tokens tokens.
+    dedup_path keeps the hashes of the seen examples in a SQLite file instead of memory.
+
+    Returns the report (also saved as <output_dir>/<name>.report.json): counts of examples written and
+    skipped, total and assistant (trained) tokens, and the shards.
+    """
+    if task not in ("MCQ", "XPL"):
+        raise ValueError("task must be 'MCQ' or 'XPL'")
+    if isinstance(input_paths, str):
+        input_paths = [input_paths]
+    name = name or f"ft_{task.lower()}"
+    template_str = exp6_user_prompt_mcq if task == "MCQ" else exp6_user_prompt_xpl
+    system_prompt, user_prompt_fct = create_user_prompt_function(template_str, task)
+    token_counter = get_token_counter(token_model)
+
+    seen = SeenHashes(dedup_path)
+    writer = ShardWriter(output_dir, name, max_file_tokens)
+    counts = {"rows": 0, "examples": 0, "duplicates": 0, "missing_target": 0, "too_long": 0}
+    try:
+        with tqdm(desc=f"Building {name}", unit=" rows") as progress:
+            for input_path in input_paths:
+                for chunk in read_input_chunks(input_path, chunksize):
+                    # Render the chunk, drop duplicates, then count the tokens of the new examples in one batch
+                    examples = []
+                    targets = []
+                    for _, row in chunk.iterrows():
+                        counts["rows"] += 1
+                        target = example_target(row, task, explanation_column)
+                        if target is None:
+                            counts["missing_target"] += 1
+                            continue
+                        messages = render_messages(row, system_prompt, user_prompt_fct, task)
+                        messages.append({"role": "assistant", "content": target})
+                        if not seen.add(example_hash(messages)):
+                            counts["duplicates"] += 1
+                            continue
+                        examples.append(messages)
+                        targets.append(target)
+                    seen.commit()
+
+                    example_tokens = token_counter.count_messages_batch(examples)
+                    target_tokens = token_counter.count_batch(targets)
+                    for messages, tokens, trained in zip(examples, example_tokens, target_tokens):
+                        if tokens > max_example_tokens:
+                            counts["too_long"] += 1
+                            continue
+                        writer.write(messages, tokens, trained)
+                        counts["examples"] += 1
+                    progress.update(len(chunk))
+    finally:
+        writer.close()
+        seen.close()
+
+    report = {
+        "task": task,
+        "inputs": list(input_paths),
+        **counts,
+        "tokens": sum(shard["tokens"] for shard in writer.shards),
+        "target_tokens": sum(shard["target_tokens"] for shard in writer.shards),
+        "max_example_tokens": max_example_tokens,
+        "max_file_tokens": max_file_tokens,
+        "shards": writer.shards,
+    }
+    report_path = os.path.join(output_dir, f"{name}.report.json")
+    with open(report_path, "w", encoding="utf-8") as file:
+        json.dump(report, file, indent=2)
+
+    print(f"\nRows read: {counts['rows']}")
+    print(f"Examples written: {counts['examples']} in {len(writer.shards)} files")
+    print(f"Skipped: {counts['duplicates']} duplicates, {counts['missing_target']} without target, {counts['too_long']} over {max_example_tokens} tokens")
+    print(f"Tokens: {report['tokens']} ({report['target_tokens']} in assistant messages)")
+    print(f"Report saved to {report_path}")
+    return report
@@ -11,17 +11,25 @@ import time
 import random
 import tiktoken
 from tqdm import tqdm
-from concurrent.futures import ThreadPoolExecutor
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
 from openai import OpenAI
 
 
-# Metadata
-PRICE_PER_1M_TOKENS_INPUT = 0.3
-PRICE_PER_1M_TOKENS_OUTPUT = 1.2
-api_key = os.getenv('OPENAI_API_KEY')
-client = OpenAI(api_key=api_key)
+# Metadata (prices: MODEL_PRICES_PER_1M_TOKENS in config/settings.py, see llm/costs.py)
+client = None  # created on first use (see get_client); base_url can point to a local stand-in server
 
 
+def get_client(api_key=None, base_url=None):
+    global client
+    if client is None or api_key is not None or base_url is not None:
+        client = make_openai_client(api_key=api_key, base_url=base_url)
+    return client
+
+
+# API client
+from llm.openai_batch import make_openai_client, run_batch, BATCH_PRICE_DISCOUNT
+from llm.costs import get_cost_ledger
+
 # Prompts
 from llm.prompts import exp6_system_prompt_xpl, exp6_system_prompt_mcq, exp6_user_prompt_xpl, exp6_user_prompt_mcq
 
@@ -50,84 +58,157 @@ def create_user_prompt_function(template_str, task="MCQ"):
     return system_prompt, user_prompt_fct
 
 
-# Initialize the tokenizer (using gpt-4 as a proxy for gpt-4o-mini)
-enc = tiktoken.encoding_for_model("gpt-4")
+def render_messages(row, system_prompt, user_prompt_fct, task="MCQ"):
+    case = row['case']
+    question = row['normalized_question']
+    options = f"A. {row['opa_shuffled']}\nB. {row['opb_shuffled']}\nC. {row['opc_shuffled']}\nD. {row['opd_shuffled']}"
+    if task == "XPL":
+        solution = f"{row['answer_idx_shuffled'].upper()} {row['answer']}"
+        user_prompt = user_prompt_fct(case, question, options, solution)
+    else:
+        user_prompt = user_prompt_fct(case, question, options)
+    return [
+        {"role": "system", "content": system_prompt},
+        {"role": "user", "content": user_prompt}
+    ]
+
+
+# Token accounting (using gpt-4 as a proxy for gpt-4o-mini): system prompts are counted once,
+# user prompts in batches, and the chat format overhead is included (see llm/tokens.py)
+from llm.tokens import get_token_counter
+token_counter = get_token_counter("gpt-4")
+COUNT_CHUNK_SIZE = 1000  # rows rendered and token-counted together
 
 
 def count_tokens(text):
     """Count the number of tokens in the text."""
-    return len(enc.encode(text))
+    return token_counter.count(text)
+
+
+def estimate_input_tokens(df, task="MCQ"):
+    """Prompt tokens of every row of df as a list (pre-run cost estimation, no API call)."""
+    template_str = exp6_user_prompt_mcq if task == "MCQ" else exp6_user_prompt_xpl
+    system_prompt, user_prompt_fct = create_user_prompt_function(template_str, task)
+    return token_counter.count_messages_batch(render_messages(row, system_prompt, user_prompt_fct, task) for _, row in df.iterrows())
 
 # API handling
-def handle_api_call(func, *args, **kwargs):
-    max_retries = 5
-    base_wait = 10
-
-    for attempt in range(max_retries):
-        try:
-            return func(*args, **kwargs)
-        except Exception as e:
-            if "429" in str(e) or "rate limit" in str(e).lower():
-                wait_time = base_wait * (2 ** attempt) + random.uniform(0, 1)
-                print(f"Rate limit reached. Waiting for {wait_time:.2f} seconds before retry {attempt + 1}/{max_retries}")
-                time.sleep(wait_time)
-                if attempt == max_retries - 1:
-                    print("Max retries reached. Skipping this call.")
-                    return None
-            else:
-                print(f"Unexpected error: {str(e)}")
-                return None
+from config.settings import MAX_CONCURRENCY
+from llm.rate_limit import get_rate_limiter
+from llm.cache import setup_response_cache, print_cache_stats, cached_chat_completion
+from llm.http_pool import print_http_stats
+from pipelines.sink import ResultSink, ColumnBuffer, shard_path_for
+from pipelines.inputs import read_input, read_input_chunks
 
 # Processing
-def process_batch(batch, model,system_prompt, user_prompt_fct,llm_used,ft_or_baseline):
-    results = []
-    batch_input_tokens = 0
-    batch_output_tokens = 0
-    
-    for _, row in batch.iterrows():
-        case = row['case']
-        question = row['normalized_question']
-        options = f"A. {row['opa_shuffled']}\nB. {row['opb_shuffled']}\nC. {row['opc_shuffled']}\nD. {row['opd_shuffled']}"
-        solution=f"{row['answer_idx_shuffled'].upper()} {row['answer']}"
-        user_prompt = user_prompt_fct(case, question, options,solution)
-        
-        messages = [
-            {"role": "system", "content": system_prompt},
-            {"role": "user", "content": user_prompt}
-        ]
-        
-        input_tokens = count_tokens(system_prompt) + count_tokens(user_prompt)
-        batch_input_tokens += input_tokens
-        
-        start_time = time.time()
-        completion = handle_api_call(
-            client.chat.completions.create,
-            model=model,
-            messages=messages
-        )
-        end_time = time.time()
-        running_time = end_time - start_time
-        
+def result_column_dtypes(llm_used, ft_or_baseline):
+    prefix = f'llm_{llm_used}_{ft_or_baseline}'
+    return {
+        f'{prefix}_running_time': "float",
+        f'{prefix}_prompt': "str",
+        f'{prefix}_response': "str",
+        f'{prefix}_input_tokens': "int",
+        f'{prefix}_output_tokens': "int",
+    }
+
+
+def process_row(row, model, system_prompt, user_prompt_fct, llm_used, ft_or_baseline, task="MCQ", messages=None, input_tokens=None):
+    """
+    One request; returns (result, input_tokens, output_tokens). Safe to run from several threads.
+
+    messages and input_tokens can be passed when already rendered and counted (see process_csv).
+    """
+    if messages is None:
+        messages = render_messages(row, system_prompt, user_prompt_fct, task)
+    if input_tokens is None:
+        input_tokens = token_counter.count_messages(messages)
+
+    start_time = time.time()
+    completion = cached_chat_completion(
+        lambda **request: get_rate_limiter("openai").call(get_client().chat.completions.create, **request),
+        model=model,
+        messages=messages
+    )
+    end_time = time.time()
+    running_time = end_time - start_time
+
+    if completion is not None:
+        response = completion.choices[0].message.content
+        output_tokens = completion.usage.completion_tokens
+    else:
+        response = "Error: API call failed"
+        output_tokens = 0
+
+    result = {
+        f'llm_{llm_used}_{ft_or_baseline}_running_time': running_time,
+        f'llm_{llm_used}_{ft_or_baseline}_prompt': str(messages),
+        f'llm_{llm_used}_{ft_or_baseline}_response': response,
+        f'llm_{llm_used}_{ft_or_baseline}_input_tokens': input_tokens,
+        f'llm_{llm_used}_{ft_or_baseline}_output_tokens': output_tokens
+    }
+    return result, input_tokens, output_tokens
+
+
+def process_csv_batch_api(df, sink, save_path, model, llm_used, ft_or_baseline, task="MCQ", client=None, poll_interval=None, timeout=None):
+    """
+    Send every row through the OpenAI Batch API (half price, no per-request rate limits) and write the
+    results to sink. Rows are matched back by custom_id ("row-<index>"). The batch input is kept next to
+    save_path and the submitted batch id is recorded, so a rerun waits for the same batch instead of
+    submitting it again. Returns (total_input_tokens, total_output_tokens).
+    """
+    template_str = exp6_user_prompt_mcq if task == "MCQ" else exp6_user_prompt_xpl
+    system_prompt, user_prompt_fct = create_user_prompt_function(template_str, task)
+
+    messages_by_id = {}
+    requests = {}
+    for idx, row in df.iterrows():
+        messages = render_messages(row, system_prompt, user_prompt_fct, task)
+        messages_by_id[f"row-{idx}"] = (idx, messages)
+        requests[f"row-{idx}"] = {"model": model, "messages": messages}
+
+    base_path = os.path.splitext(save_path)[0]
+    completions = run_batch(requests, f"{base_path}.batch_input.jsonl", client=client or get_client(),
+                            state_path=f"{base_path}.batch_state.json", poll_interval=poll_interval, timeout=timeout)
+
+    total_input_tokens = 0
+    total_output_tokens = 0
+    input_counts = token_counter.count_messages_batch(messages for _, messages in messages_by_id.values())
+    for (custom_id, (idx, messages)), input_tokens in zip(messages_by_id.items(), input_counts):
+        completion = completions.get(custom_id)
+        total_input_tokens += input_tokens
         if completion is not None:
             response = completion.choices[0].message.content
             output_tokens = completion.usage.completion_tokens
-            batch_output_tokens += output_tokens
+            total_output_tokens += output_tokens
         else:
             response = "Error: API call failed"
             output_tokens = 0
-        
-        results.append({
-            f'llm_{llm_used}_{ft_or_baseline}_running_time': running_time,
+        sink.write(idx, {
+            f'llm_{llm_used}_{ft_or_baseline}_running_time': None,  # no per-request latency in batch mode
             f'llm_{llm_used}_{ft_or_baseline}_prompt': str(messages),
             f'llm_{llm_used}_{ft_or_baseline}_response': response,
             f'llm_{llm_used}_{ft_or_baseline}_input_tokens': input_tokens,
             f'llm_{llm_used}_{ft_or_baseline}_output_tokens': output_tokens
         })
-    
-    return results, batch_input_tokens, batch_output_tokens
+    return total_input_tokens, total_output_tokens
+
 
-def process_csv(file_path, save_dir, model, model_name, batch_size=10):
+def process_csv(file_path, save_dir, model, model_name, batch_size=10, task="MCQ", mode="sync", openai_client=None, poll_interval=None,
+                max_in_flight=None, chunksize=None):
+    """
+    mode="sync" sends one request per row; mode="batch" sends all rows through the OpenAI Batch API
+    (see process_csv_batch_api). In sync mode at most max_in_flight requests (default MAX_CONCURRENCY) run at
+    the same time and progress is reported every batch_size rows. openai_client replaces the default client (e.g. one pointed at a local
+    stand-in server, see llm.openai_batch.make_openai_client).
+    With chunksize the input is streamed chunksize rows at a time (see pipelines/inputs.py): each chunk is sent
+    (one batch per chunk in batch mode) and appended to the results CSV before the next one is read.
+    """
+    global client
+    if mode not in ("sync", "batch"):
+        raise ValueError("mode must be 'sync' or 'batch'")
+    if openai_client is not None:
+        client = openai_client
     os.makedirs(save_dir, exist_ok=True)
+    setup_response_cache()
     print(f"Saving results to: {save_dir}")
     print(f"Processing file: {file_path}")
     print(f"Using model: {model}")
@@ -136,56 +217,115 @@ def process_csv(file_path, save_dir, model, model_name, batch_size=10):
     total_input_tokens = 0
     total_output_tokens = 0
     num_calls = 0
+    ledger = get_cost_ledger()
 
     
-    df = pd.read_csv(file_path)
-    total_rows = len(df)
+    if chunksize is None:
+        df = read_input(file_path)
+        total_rows = len(df)
+        chunks = [df]
+    else:
+        total_rows = None  # unknown until the end of the file
+        chunks = read_input_chunks(file_path, chunksize)
     
-    # Initialize new columns
+    # New columns, accumulated as typed arrays (float running time, int token counts, text)
     llm_used=model_name
     ft_or_baseline= "ft" if model.startswith("ft") else "baseline"
-    new_columns = [f'llm_{llm_used}_{ft_or_baseline}_running_time', f'llm_{llm_used}_{ft_or_baseline}_prompt', f'llm_{llm_used}_{ft_or_baseline}_response', 
-                  f'llm_{llm_used}_{ft_or_baseline}_input_tokens',f'llm_{llm_used}_{ft_or_baseline}_output_tokens']
-    for col in new_columns:
-        df[col] = None
-    
-    for i in tqdm(range(0, total_rows, batch_size)):
-        batch = df.iloc[i:i+batch_size]
-        
-        with ThreadPoolExecutor() as executor:
-            future = executor.submit(process_batch, batch, model)
-            results, batch_input_tokens, batch_output_tokens = future.result()
-        
-        total_input_tokens += batch_input_tokens
-        total_output_tokens += batch_output_tokens
-        
-        for j, result in enumerate(results):
-            idx = i + j
-            for col, value in result.items():
-                df.loc[idx, col] = value
-        
-        num_calls += len(batch)
-        
-        # Save progress at row 1 and every 10 rows after that
-        if i == 0 or (i + batch_size) % 10 == 0 or (i + batch_size) >= total_rows:
-            save_path = os.path.join(save_dir, "results_fw4_GxE_gpt4omini.csv")
-            df.to_csv(save_path, index=False)
-            
-            progress_percentage = ((i + batch_size) / total_rows) * 100
-            input_cost = (total_input_tokens / 1_000_000) * PRICE_PER_1M_TOKENS_INPUT
-            output_cost = (total_output_tokens / 1_000_000) * PRICE_PER_1M_TOKENS_OUTPUT
-            total_cost = input_cost + output_cost
-            
-            print(f"\nProgress: {progress_percentage:.1f}%")
-            print(f"Input tokens: {total_input_tokens}, Cost: ${input_cost:.4f}")
-            print(f"Output tokens: {total_output_tokens}, Cost: ${output_cost:.4f}")
-            print(f"Total cost so far: ${total_cost:.4f}")
-    
+    columns = ColumnBuffer([], result_column_dtypes(llm_used, ft_or_baseline))
+
+    # Rows are appended to a JSONL shard as they finish (checkpoint); the columns of each chunk are attached and appended to the CSV
+    save_path = os.path.join(save_dir, "results_fw4_GxE_gpt4omini.csv")
+    sink = ResultSink(shard_path_for(save_path), overwrite=True, columns=columns)
+
+    price_factor = BATCH_PRICE_DISCOUNT if mode == "batch" else 1.0
+    template_str = exp6_user_prompt_mcq if task == "MCQ" else exp6_user_prompt_xpl
+    system_prompt, user_prompt_fct = create_user_prompt_function(template_str, task)
+    max_in_flight = max_in_flight or MAX_CONCURRENCY
+
+    # Sync mode: one pool for the whole file with at most max_in_flight requests in flight. Rows are submitted as
+    # slots free up (no wait for the slowest row of a batch); batch_size only sets how often progress
+    # and costs are reported. Totals are only updated here, from the finished rows.
+    with ThreadPoolExecutor(max_workers=max_in_flight) as executor, tqdm(total=total_rows) as progress:
+        def collect(futures):
+            nonlocal total_input_tokens, total_output_tokens, num_calls
+            for future in futures:
+                idx = in_flight.pop(future)
+                try:
+                    result, input_tokens, output_tokens = future.result()
+                except Exception as e:
+                    print(f"Error processing row {idx}: {str(e)}")
+                    continue
+                finally:
+                    progress.update(1)
+                sink.write(idx, result)
+                total_input_tokens += input_tokens
+                total_output_tokens += output_tokens
+                num_calls += 1
+
+                # Report progress at row 1 and every batch_size rows after that
+                if num_calls == 1 or num_calls % batch_size == 0 or num_calls == total_rows:
+                    input_cost, output_cost = ledger.token_costs(model, total_input_tokens, total_output_tokens)
+                    total_cost = input_cost + output_cost
+
+                    print(f"\nProgress: {f'{num_calls / total_rows * 100:.1f}%' if total_rows else f'{num_calls} rows'}")
+                    print(f"Input tokens: {total_input_tokens}, Cost: ${input_cost:.4f}")
+                    print(f"Output tokens: {total_output_tokens}, Cost: ${output_cost:.4f}")
+                    print(f"Total cost so far: ${total_cost:.4f}")
+
+        in_flight = {}
+        for chunk_number, chunk in enumerate(chunks):
+            # Hard ceiling reached: later chunks are not read
+            if ledger.exhausted:
+                break
+            sink.start_chunk(chunk.index)
+            if mode == "batch":
+                # One batch per chunk, each with its own input and state files
+                batch_path = save_path if chunksize is None else f"{os.path.splitext(save_path)[0]}.chunk{chunk_number}.csv"
+                input_tokens, output_tokens = process_csv_batch_api(chunk, sink, batch_path, model, llm_used, ft_or_baseline,
+                                                                    task=task, poll_interval=poll_interval)
+                total_input_tokens += input_tokens
+                total_output_tokens += output_tokens
+                num_calls += len(chunk)
+                progress.update(len(chunk))
+            else:
+                submitted = 0
+                for start in range(0, len(chunk), COUNT_CHUNK_SIZE):
+                    if ledger.exhausted:
+                        break
+                    # Render and count a slice of rows at once, then submit its rows one by one
+                    part = chunk.iloc[start:start + COUNT_CHUNK_SIZE]
+                    part_messages = [render_messages(row, system_prompt, user_prompt_fct, task) for _, row in part.iterrows()]
+                    part_counts = token_counter.count_messages_batch(part_messages)
+                    for (idx, row), messages, input_tokens in zip(part.iterrows(), part_messages, part_counts):
+                        if ledger.exhausted:
+                            break
+                        future = executor.submit(process_row, row, model, system_prompt, user_prompt_fct, llm_used, ft_or_baseline, task,
+                                                 messages=messages, input_tokens=input_tokens)
+                        in_flight[future] = idx
+                        submitted += 1
+                        if len(in_flight) >= max_in_flight:
+                            done, _ = wait(in_flight, return_when=FIRST_COMPLETED)
+                            collect(done)
+                # The chunk is written once all its rows are done
+                collect(list(in_flight))
+                # Rows never submitted stay out of the CSV, so a later run can pick them up
+                chunk = chunk.iloc[:submitted]
+
+            # Compaction: attach the results to the chunk's rows and append them to the CSV
+            sink.compact(chunk, save_path, append=True)
+    sink.close()
+    if ledger.exhausted:
+        print("\nHard spend ceiling reached: stopped before the end of the input, the remaining rows were not processed")
+
     # Final statistics
     print("\nProcessing complete!")
     print(f"Total calls: {num_calls}")
+    print_cache_stats()
+    print_http_stats()
     print(f"Total input tokens: {total_input_tokens}")
     print(f"Total output tokens: {total_output_tokens}")
-    print(f"Final input cost: ${(total_input_tokens / 1_000_000) * PRICE_PER_1M_TOKENS_INPUT:.4f}")
-    print(f"Final output cost: ${(total_output_tokens / 1_000_000) * PRICE_PER_1M_TOKENS_OUTPUT:.4f}")
-    print(f"Total final cost: ${((total_input_tokens / 1_000_000) * PRICE_PER_1M_TOKENS_INPUT + (total_output_tokens / 1_000_000) * PRICE_PER_1M_TOKENS_OUTPUT):.4f}")
+    input_cost, output_cost = ledger.token_costs(model, total_input_tokens, total_output_tokens, price_factor)
+    print(f"Final input cost: ${input_cost:.4f}")
+    print(f"Final output cost: ${output_cost:.4f}")
+    print(f"Total final cost: ${input_cost + output_cost:.4f}")
+    ledger.write_summary(os.path.join(save_dir, "cost_summary.csv"))
@@ -0,0 +1,35 @@
+import pandas as pd
+
+from config.settings import INPUT_CHUNK_ROWS
+
+# Explicit dtypes of the dataset columns (text columns are read as strings). The demographic columns and the
+# answer label repeat a handful of values over every augmented variant of a case, so they are stored as
+# categories; columns missing from a file are ignored.
+INPUT_DTYPES = {
+    'version': 'category',
+    'gender': 'category',
+    'ethnicity': 'category',
+    'answer_idx_shuffled': 'category',
+}
+
+
+def read_input(path, dtype=None):
+    """Load a whole dataset CSV with the INPUT_DTYPES schema."""
+    return pd.read_csv(path, dtype=INPUT_DTYPES if dtype is None else dtype)
+
+
+def read_input_chunks(path, chunksize=None, dtype=None):
+    """
+    Read a dataset CSV chunk by chunk (chunksize rows, default INPUT_CHUNK_ROWS) with the INPUT_DTYPES schema.
+
+    The chunks keep the row numbers of the file as index, so results can be matched back to their rows.
+    """
+    return pd.read_csv(path, dtype=INPUT_DTYPES if dtype is None else dtype, chunksize=chunksize or INPUT_CHUNK_ROWS)
+
+
+def iter_input_chunks(data, chunksize=None):
+    """The input as DataFrame chunks: a DataFrame is a single chunk, a path to a CSV is streamed."""
+    if isinstance(data, pd.DataFrame):
+        yield data
+    else:
+        yield from read_input_chunks(data, chunksize)
@@ -0,0 +1,301 @@
+import json
+import os
+import threading
+
+import numpy as np
+import pandas as pd
+
+from config.settings import INPUT_CHUNK_ROWS
+
+
+def shard_path_for(saving_path, name=None):
+    """JSONL shard next to the final CSV: results.csv -> results.jsonl (or results.<name>.jsonl)."""
+    base = os.path.splitext(saving_path)[0]
+    return f"{base}.{name}.jsonl" if name else f"{base}.jsonl"
+
+
+def cost_summary_path_for(saving_path):
+    """Spend summary next to the final CSV: results.csv -> results.costs.csv."""
+    return f"{os.path.splitext(saving_path)[0]}.costs.csv"
+
+
+def _json_default(value):
+    # numpy scalars and other non-JSON values
+    if hasattr(value, "item"):
+        return value.item()
+    return str(value)
+
+
+class ResultSink:
+    """
+    Append-only store of per-row results.
+
+    Every finished row is appended to a JSONL shard as {"idx": <row index>, <column>: <value>, ...}
+    and flushed straight away, so a checkpoint costs one line instead of a rewrite of the whole
+    DataFrame. compact() joins the shard back onto the input DataFrame and writes the final CSV once.
+    If a row is written twice the last record wins.
+
+    With shard_path=None the records are only kept in memory (nothing is written before compact()).
+    overwrite=True starts a fresh shard instead of appending to the records of a previous run.
+    With columns (a ColumnBuffer) every record is also stored in typed column arrays, and compact()
+    attaches those instead of parsing the records back; records of a previous run found in the
+    shard are loaded into the buffer.
+
+    Streaming input: call start_chunk() with the index of each input chunk, then
+    compact(chunk, saving_path, append=True) once its rows are done. Only that chunk's results are
+    held in memory and the CSV grows chunk by chunk (the first chunk rewrites it with the header).
+    """
+
+    def __init__(self, shard_path=None, overwrite=False, columns=None):
+        self.shard_path = shard_path
+        self.columns = columns
+        self.records = [] if shard_path is None and columns is None else None
+        self.lock = threading.Lock()
+        self.file = None
+        self.previous = {}  # row index -> offset of its last record in the shard of a previous run
+        self.csv_started = False
+        if shard_path is not None:
+            os.makedirs(os.path.dirname(os.path.abspath(shard_path)), exist_ok=True)
+            if not overwrite:
+                # A run killed mid-write leaves a cut-off last line: the next record must not be glued to it
+                truncate_partial_line(shard_path)
+            if columns is not None and not overwrite:
+                self.previous = shard_offsets(shard_path)
+            self.file = open(shard_path, "w" if overwrite else "a", encoding="utf-8")
+        if columns is not None:
+            self._load_previous()
+
+    def _load_previous(self):
+        # Fill the buffer with the records of a previous run for its rows
+        offsets = [self.previous[idx] for idx in self.columns.index if idx in self.previous]
+        for record in read_shard_at(self.shard_path, offsets):
+            idx = record.pop("idx")
+            self.columns.write(idx, {col: value for col, value in record.items() if col in self.columns.dtypes})
+
+    def start_chunk(self, index):
+        """Hold the results of the rows in index (the next input chunk) in fresh typed columns."""
+        with self.lock:
+            self.columns = ColumnBuffer(index, self.columns.dtypes)
+            self._load_previous()
+
+    def write(self, idx, record):
+        with self.lock:
+            if self.columns is not None:
+                self.columns.write(idx, record)
+            record = {"idx": idx, **record}
+            if self.shard_path is None:
+                if self.records is not None:
+                    self.records.append(record)
+                return
+            self.file.write(json.dumps(record, default=_json_default, ensure_ascii=False) + "\n")
+            self.file.flush()
+
+    def close(self):
+        with self.lock:
+            if self.file is not None:
+                self.file.close()
+                self.file = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def read_records(self):
+        """All records, in write order."""
+        if self.shard_path is None:
+            return list(self.records)
+        if self.file is not None:
+            self.file.flush()
+        return read_shard(self.shard_path)
+
+    def read(self):
+        """Records as a DataFrame indexed by row index (last record per row)."""
+        return records_to_frame(self.read_records())
+
+    def compact(self, df, saving_path=None, append=False):
+        """
+        Attach the recorded columns to df and write the final CSV.
+
+        Rows without a record get NaN. Returns the combined DataFrame.
+        With append=True df is one input chunk (see start_chunk()) and its rows are appended to the CSV.
+        """
+        df_out = df.copy()
+        if self.columns is not None:
+            df_out = self.columns.attach(df_out)
+        else:
+            results = self.read()
+            for col in results.columns:
+                df_out[col] = results[col].reindex(df_out.index)
+        if saving_path is not None:
+            if append:
+                df_out.to_csv(saving_path, index=False, mode="a" if self.csv_started else "w", header=not self.csv_started)
+                self.csv_started = True
+            else:
+                df_out.to_csv(saving_path, index=False)
+        return df_out
+
+
+class ColumnBuffer:
+    """
+    Result columns of a DataFrame as typed arrays, filled row by row and attached in one go.
+
+    dtypes maps each column to "float", "int" or "str". Float columns are float64 arrays (missing
+    values are NaN), int columns int64 arrays with a missing-value mask (attached as nullable Int64),
+    str columns object arrays (attached as the pandas string dtype). Rows are addressed by their
+    label in index. Not thread safe on its own: ResultSink.write() holds its lock while writing.
+    """
+
+    def __init__(self, index, dtypes):
+        self.index = pd.Index(index)
+        self.dtypes = dict(dtypes)
+        size = len(self.index)
+        self.values = {}
+        self.missing = {}
+        for col, dtype in self.dtypes.items():
+            if dtype == "float":
+                self.values[col] = np.full(size, np.nan, dtype=np.float64)
+            elif dtype == "int":
+                self.values[col] = np.zeros(size, dtype=np.int64)
+                self.missing[col] = np.ones(size, dtype=bool)
+            elif dtype == "str":
+                self.values[col] = np.full(size, None, dtype=object)
+            else:
+                raise ValueError(f"Unknown column dtype for {col}: {dtype} (expected 'float', 'int' or 'str')")
+
+    def write(self, idx, record):
+        position = self.index.get_loc(idx)
+        for col, value in record.items():
+            if col not in self.values:
+                raise KeyError(f"Column {col} is not in the buffer schema")
+            if value is None or (isinstance(value, float) and np.isnan(value)):
+                if col in self.missing:
+                    self.missing[col][position] = True
+                elif self.dtypes[col] == "str":
+                    self.values[col][position] = None
+                continue
+            dtype = self.dtypes[col]
+            if dtype == "int":
+                self.values[col][position] = int(value)
+                self.missing[col][position] = False
+            elif dtype == "float":
+                self.values[col][position] = float(value)
+            else:
+                self.values[col][position] = str(value)
+
+    def attach(self, df):
+        """Set the buffered columns on df (same index as the buffer) and return it."""
+        for col, dtype in self.dtypes.items():
+            if dtype == "int":
+                array = pd.arrays.IntegerArray(self.values[col].copy(), self.missing[col].copy())
+            elif dtype == "str":
+                array = pd.array(self.values[col], dtype="string")
+            else:
+                array = self.values[col].copy()
+            column = pd.Series(array, index=self.index)
+            df[col] = column if column.index.equals(df.index) else column.reindex(df.index)
+        return df
+
+
+def truncate_partial_line(shard_path, block_size=65536):
+    """Cut a JSONL shard after its last newline, dropping a record whose write was interrupted."""
+    if not os.path.exists(shard_path):
+        return
+    with open(shard_path, "r+b") as file:
+        end = file.seek(0, os.SEEK_END)
+        position = end
+        while position > 0:
+            start = max(0, position - block_size)
+            file.seek(start)
+            newline = file.read(position - start).rfind(b"\n")
+            if newline != -1:
+                position = start + newline + 1
+                break
+            position = start
+        if position != end:
+            file.truncate(position)
+
+
+def iter_shard(shard_path):
+    """Records of a JSONL shard one at a time, skipping a line cut short by an interrupted write."""
+    if not os.path.exists(shard_path):
+        return
+    with open(shard_path, "r", encoding="utf-8") as file:
+        for line in file:
+            try:
+                yield json.loads(line)
+            except json.JSONDecodeError:
+                continue
+
+
+def read_shard(shard_path):
+    """Parse a JSONL shard, skipping a line cut short by an interrupted write."""
+    return list(iter_shard(shard_path))
+
+
+def shard_offsets(shard_path):
+    """Row index -> byte offset of the last complete record of that row in a JSONL shard."""
+    offsets = {}
+    if shard_path is None or not os.path.exists(shard_path):
+        return offsets
+    with open(shard_path, "rb") as file:
+        offset = 0
+        for line in file:
+            try:
+                offsets[json.loads(line)["idx"]] = offset
+            except (json.JSONDecodeError, KeyError, UnicodeDecodeError):
+                pass
+            offset += len(line)
+    return offsets
+
+
+def read_shard_at(shard_path, offsets):
+    """Records starting at the given byte offsets of a JSONL shard (see shard_offsets)."""
+    if not offsets:
+        return []
+    records = []
+    with open(shard_path, "rb") as file:
+        for offset in sorted(offsets):
+            file.seek(offset)
+            records.append(json.loads(file.readline()))
+    return records
+
+
+def records_to_frame(records):
+    if not records:
+        return pd.DataFrame()
+    results = pd.DataFrame.from_records(records)
+    results = results.drop_duplicates(subset="idx", keep="last").set_index("idx")
+    results.index.name = None
+    return results
+
+
+def load_completed(saving_path, llm_name, done_column):
+    """
+    Indices of the rows already completed for llm_name by a previous run writing to saving_path.
+
+    A row is done when done_column is filled in its record. The JSONL shard is the source of truth;
+    a run that only left a CSV (no shard) is imported into a new shard first, so that the final
+    compaction of the resumed run keeps those rows. The CSV is assumed to be in input row order.
+    """
+    shard_path = shard_path_for(saving_path)
+    if not os.path.exists(shard_path) and os.path.exists(saving_path):
+        header = pd.read_csv(saving_path, nrows=0).columns
+        if done_column in header:
+            columns = [col for col in header if col.startswith(f"{llm_name}_")]
+            with ResultSink(shard_path) as sink:
+                # Chunks of a CSV reader keep counting the row index from one chunk to the next
+                for previous in pd.read_csv(saving_path, usecols=columns, chunksize=INPUT_CHUNK_ROWS):
+                    for idx, row in previous.loc[previous[done_column].notna()].iterrows():
+                        sink.write(idx, row.astype(object).where(row.notna(), None).to_dict())
+
+    # Streamed: only the indices are kept, the last record of a row decides whether it is done
+    completed = set()
+    for record in iter_shard(shard_path):
+        value = record.get(done_column)
+        if value is None or pd.isna(value):
+            completed.discard(record.get("idx"))
+        else:
+            completed.add(record.get("idx"))
+    return completed
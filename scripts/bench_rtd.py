@@ -0,0 +1,52 @@
+import sys
+import time
+from pathlib import Path
+import argparse
+
+import numpy as np
+
+# Add the project root directory to the Python path
+project_root = Path(__file__).resolve().parent.parent
+sys.path.append(str(project_root))
+
+from metrics.rtd import rtd, rtd_loop, rtd_matrix, ranks_from_scores
+
+
+def best_time(fn, repeat):
+    times = []
+    for _ in range(repeat):
+        start_time = time.perf_counter()
+        fn()
+        times.append(time.perf_counter() - start_time)
+    return min(times)
+
+
+# Compare the vectorized rank-turbulence divergence with the loop version on random rankings
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark of metrics/rtd.py: vectorized vs loop")
+    parser.add_argument("--items", type=int, default=5000, help="Items per ranking (e.g. words)")
+    parser.add_argument("--rankings", type=int, default=36, help="Rankings compared all-pairs (e.g. demographic versions)")
+    parser.add_argument("--alpha", type=float, default=1.0)
+    parser.add_argument("--repeat", type=int, default=3, help="Timings kept: best of repeat runs")
+    args = parser.parse_args()
+
+    rng = np.random.default_rng(0)
+    # Scores rounded so that rankings have ties
+    rankings = ranks_from_scores(rng.normal(size=(args.rankings, args.items)).round(2))
+    ranks1, ranks2 = rankings[0], rankings[1]
+    list1, list2 = ranks1.tolist(), ranks2.tolist()
+
+    loop_pair = best_time(lambda: rtd_loop(list1, list2, args.alpha), args.repeat)
+    vectorized_pair = best_time(lambda: rtd(ranks1, ranks2, args.alpha), args.repeat)
+    print(f"One pair, {args.items} items: loop {loop_pair * 1e3:.2f} ms, vectorized {vectorized_pair * 1e3:.3f} ms "
+          f"({loop_pair / vectorized_pair:.0f}x)")
+    print(f"  same value: {np.isclose(rtd_loop(list1, list2, args.alpha), rtd(ranks1, ranks2, args.alpha))}")
+
+    pairs = args.rankings * (args.rankings - 1) // 2
+    loop_all = loop_pair * pairs  # estimated: one loop call per pair
+    vectorized_all = best_time(lambda: rtd_matrix(rankings, args.alpha), args.repeat)
+    print(f"All pairs of {args.rankings} rankings ({pairs} pairs): loop ~{loop_all:.2f} s (estimated), "
+          f"rtd_matrix {vectorized_all:.3f} s ({loop_all / vectorized_all:.0f}x)")
+
+if __name__ == "__main__":
+    main()
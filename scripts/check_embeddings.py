@@ -0,0 +1,76 @@
+import sys
+import os
+import tempfile
+from pathlib import Path
+
+import numpy as np
+
+# Add the project root directory to the Python path
+project_root = Path(__file__).resolve().parent.parent
+sys.path.append(str(project_root))
+
+from llm.embeddings import EmbeddingStore, HashingEmbedder
+
+
+def check(condition, message):
+    print(f"{'ok  ' if condition else 'FAIL'} {message}")
+    return condition
+
+
+# Offline check of llm/embeddings.py with the HashingEmbedder stand-in: no provider, no network
+def main():
+    texts = ["the patient has a fever", "cough and chest pain", "the patient has a fever", None, "",
+             "acute chest pain", "chronic cough", "cough and chest pain"]
+    results = []
+    with tempfile.TemporaryDirectory() as store_dir:
+        embedder = HashingEmbedder(dim=64)
+        store = EmbeddingStore(store_dir, embedder, "hashing-64", batch_size=2)
+
+        # Dedup and batching: 4 distinct texts, 2 per request
+        vectors = store.embed(texts)
+        results.append(check(vectors.shape == (len(texts), 64) and vectors.dtype == np.float32, "one float32 row per text"))
+        results.append(check(embedder.texts == 4 and embedder.requests == 2, "distinct texts sent once, in batches of 2"))
+        results.append(check(np.array_equal(vectors[0], vectors[2]), "duplicates share a vector"))
+        results.append(check(np.isnan(vectors[3]).all() and np.isnan(vectors[4]).all(), "missing and empty texts give NaN rows"))
+
+        # Reuse: a second call only sends the new text
+        again = store.embed(texts + ["new text"])
+        results.append(check(embedder.texts == 5 and len(store) == 5, "stored texts are not embedded again"))
+        results.append(check(np.array_equal(again[:-1], vectors, equal_nan=True), "same vectors on the second call"))
+        store.close()
+
+        # Memmap reuse after reopening, and rows written but never indexed (interrupted run) are dropped
+        with open(os.path.join(store_dir, "vectors.f32"), "ab") as file:
+            file.write(np.zeros(64, dtype=np.float32).tobytes())
+        reopened = EmbeddingStore(store_dir, embedder, "hashing-64")
+        results.append(check(isinstance(reopened.vectors, np.memmap) and reopened.vectors.shape == (5, 64),
+                             "reopened store maps the indexed rows only"))
+        rows = reopened.rows_for(texts)
+        results.append(check(np.array_equal(reopened.vectors[rows[0]], vectors[0]) and embedder.texts == 5,
+                             "reopened store answers from disk"))
+        reopened.close()
+
+        # Model mismatch
+        try:
+            EmbeddingStore(store_dir, embedder, "other-model")
+            results.append(check(False, "opening with another model raises ValueError"))
+        except ValueError:
+            results.append(check(True, "opening with another model raises ValueError"))
+
+    # Crash during the very first batch: vectors written, index never committed (no dimension recorded yet)
+    with tempfile.TemporaryDirectory() as store_dir:
+        embedder = HashingEmbedder(dim=64)
+        with open(os.path.join(store_dir, "vectors.f32"), "wb") as file:
+            file.write(np.asarray(embedder.embed_documents(["alpha beta"]), dtype=np.float32).tobytes())
+        store = EmbeddingStore(store_dir, embedder, "hashing-64")
+        results.append(check(os.path.getsize(os.path.join(store_dir, "vectors.f32")) == 0, "unindexed first batch dropped"))
+        vector = store.embed(["delta epsilon"])[0]
+        results.append(check(np.allclose(vector, embedder.embed_query("delta epsilon")), "new text gets its own vector"))
+        store.close()
+
+    if not all(results):
+        sys.exit(1)
+    print("Embedding store OK")
+
+if __name__ == "__main__":
+    main()
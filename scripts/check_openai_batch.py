@@ -0,0 +1,143 @@
+import sys
+import os
+import json
+import re
+import tempfile
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from pathlib import Path
+
+# Add the project root directory to the Python path
+project_root = Path(__file__).resolve().parent.parent
+sys.path.append(str(project_root))
+
+from llm.openai_batch import make_openai_client, run_batch
+
+
+# ---- Local stand-in of the OpenAI files and batches endpoints
+class StandInState:
+    def __init__(self):
+        self.files = {}
+        self.batches = {}
+        self.outcomes = []  # final status of the next batches created ("completed" when empty)
+        self.polls_before_done = 1
+        self.lock = threading.Lock()
+
+
+def completion_body(body, index):
+    return {"id": f"chatcmpl-{index}", "object": "chat.completion", "created": 0, "model": body["model"],
+            "choices": [{"index": 0, "finish_reason": "stop",
+                         "message": {"role": "assistant", "content": f"A\n{body['messages'][-1]['content']}"}}],
+            "usage": {"prompt_tokens": 5, "completion_tokens": 2, "total_tokens": 7}}
+
+
+def make_handler(state):
+    class Handler(BaseHTTPRequestHandler):
+        protocol_version = "HTTP/1.1"
+
+        def log_message(self, *args):
+            pass
+
+        def send_json(self, payload=None, raw=None):
+            data = raw if raw is not None else json.dumps(payload).encode("utf-8")
+            self.send_response(200)
+            self.send_header("content-type", "application/json")
+            self.send_header("content-length", str(len(data)))
+            self.end_headers()
+            self.wfile.write(data)
+
+        def batch_object(self, batch_id):
+            batch = state.batches[batch_id]
+            done = batch["polls"] > state.polls_before_done
+            status = batch["outcome"] if done else "in_progress"
+            completed = status == "completed"
+            return {"id": batch_id, "object": "batch", "endpoint": batch["endpoint"], "completion_window": "24h",
+                    "input_file_id": batch["input_file_id"], "created_at": 0, "status": status,
+                    "output_file_id": f"output-{batch_id}" if completed else None, "error_file_id": None,
+                    "request_counts": {"total": batch["total"], "completed": batch["total"] if completed else 0, "failed": 0}}
+
+        def do_POST(self):
+            data = self.rfile.read(int(self.headers["content-length"]))
+            with state.lock:
+                if self.path.endswith("/files"):
+                    content = re.search(rb"filename=[^\r]*\r\n(?:[^\r]+\r\n)*\r\n(.*?)\r\n--", data, re.S).group(1)
+                    file_id = f"file-{len(state.files)}"
+                    state.files[file_id] = content
+                    return self.send_json({"id": file_id, "object": "file", "bytes": len(content), "created_at": 0,
+                                           "filename": "input.jsonl", "purpose": "batch", "status": "processed"})
+                request = json.loads(data)
+                batch_id = f"batch-{len(state.batches)}"
+                lines = [json.loads(line) for line in state.files[request["input_file_id"]].decode("utf-8").splitlines()]
+                output = "\n".join(json.dumps({"id": f"response-{index}", "custom_id": line["custom_id"], "error": None,
+                                               "response": {"status_code": 200, "body": completion_body(line["body"], index)}})
+                                   for index, line in enumerate(lines))
+                state.files[f"output-{batch_id}"] = output.encode("utf-8")
+                state.batches[batch_id] = {"polls": 0, "total": len(lines), "endpoint": request["endpoint"],
+                                           "input_file_id": request["input_file_id"],
+                                           "outcome": state.outcomes.pop(0) if state.outcomes else "completed"}
+                return self.send_json(self.batch_object(batch_id))
+
+        def do_GET(self):
+            with state.lock:
+                match = re.match(r".*/batches/([^/]+)$", self.path)
+                if match:
+                    state.batches[match.group(1)]["polls"] += 1
+                    return self.send_json(self.batch_object(match.group(1)))
+                match = re.match(r".*/files/([^/]+)/content$", self.path)
+                return self.send_json(raw=state.files[match.group(1)])
+
+    return Handler
+
+
+def check(condition, message):
+    print(f"{'ok  ' if condition else 'FAIL'} {message}")
+    return condition
+
+
+# Offline check of llm/openai_batch.py: upload, poll, download and resume against the stand-in server
+def main():
+    state = StandInState()
+    server = ThreadingHTTPServer(("127.0.0.1", 0), make_handler(state))
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    client = make_openai_client(api_key="stand-in", base_url=f"http://127.0.0.1:{server.server_address[1]}/v1")
+    requests = {f"row-{index}": {"model": "gpt-4o-mini", "messages": [{"role": "user", "content": f"question {index}"}]}
+                for index in range(3)}
+    results = []
+
+    try:
+        with tempfile.TemporaryDirectory() as run_dir:
+            def run(name, **kwargs):
+                return run_batch(requests, os.path.join(run_dir, f"{name}.jsonl"), client=client, poll_interval=0,
+                                 state_path=os.path.join(run_dir, f"{name}.state.json"), use_cache=False, **kwargs)
+
+            # Success: one batch, every request answered
+            completions = run("success")
+            results.append(check(len(state.batches) == 1 and all(completions.values()), "success: 3 completions from 1 batch"))
+            results.append(check(completions["row-2"].choices[0].message.content == "A\nquestion 2", "success: matched by custom_id"))
+
+            # Resume: the poll is interrupted, the rerun waits for the same batch
+            state.polls_before_done = 5
+            try:
+                run("resume", timeout=0)
+                results.append(check(False, "resume: first poll times out"))
+            except TimeoutError:
+                results.append(check(True, "resume: first poll times out"))
+            completions = run("resume")
+            results.append(check(len(state.batches) == 2 and all(completions.values()), "resume: no new batch, 3 completions"))
+            state.polls_before_done = 1
+
+            # Expired: no results, and the rerun submits the requests again instead of reattaching
+            state.outcomes = ["expired"]
+            completions = run("expired")
+            results.append(check(len(state.batches) == 3 and not any(completions.values()), "expired: no completions"))
+            completions = run("expired")
+            results.append(check(len(state.batches) == 4 and all(completions.values()), "expired: rerun resubmits and completes"))
+    finally:
+        server.shutdown()
+
+    if not all(results):
+        sys.exit(1)
+    print("Batch API OK")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,40 @@
+import ast
+import sys
+from pathlib import Path
+
+# Add the project root directory to the Python path
+project_root = Path(__file__).resolve().parent.parent
+sys.path.append(str(project_root))
+
+from llm.costs import CostLedger
+
+# Loaders of llm/models.py whose models are billed. Ollama models run locally and are free; Azure
+# deployments are named in .env and priced by the model name Azure reports (e.g. gpt-4o-2024-05-13).
+PRICED_LOADERS = ("load_anthropic_model", "load_gemini_model", "load_nvidia_model")
+
+
+def model_names(models_path):
+    """(loader, model name) of every loader call with a literal name in models_path."""
+    tree = ast.parse(Path(models_path).read_text(encoding="utf-8"))
+    for node in ast.walk(tree):
+        if (isinstance(node, ast.Call) and isinstance(node.func, ast.Name) and node.func.id in PRICED_LOADERS
+                and node.args and isinstance(node.args[0], ast.Constant) and isinstance(node.args[0].value, str)):
+            yield node.func.id, node.args[0].value
+
+
+# Every hosted model must resolve to an entry of MODEL_PRICES_PER_1M_TOKENS, or its spend would count as $0
+def main():
+    ledger = CostLedger()
+    missing = []
+    for loader, name in model_names(project_root / "llm" / "models.py"):
+        prefix = ledger.price_prefix(name)
+        print(f"{name!r:45} ({loader}) -> {prefix!r}")
+        if prefix is None:
+            missing.append(name)
+    if missing:
+        print(f"No price for {len(missing)} models: {', '.join(missing)} (add them to MODEL_PRICES_PER_1M_TOKENS)")
+        sys.exit(1)
+    print("Every hosted model has a price")
+
+if __name__ == "__main__":
+    main()
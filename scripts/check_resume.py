@@ -0,0 +1,64 @@
+import sys
+import os
+import tempfile
+from pathlib import Path
+
+import pandas as pd
+
+# Add the project root directory to the Python path
+project_root = Path(__file__).resolve().parent.parent
+sys.path.append(str(project_root))
+
+from pipelines.sink import ResultSink, ColumnBuffer, shard_path_for, load_completed, read_shard, truncate_partial_line
+
+ROWS = 30
+DONE_COLUMN = "m_running_time_1"
+DTYPES = {"m_response1": "str", DONE_COLUMN: "float"}
+
+
+def check(condition, message):
+    print(f"{'ok  ' if condition else 'FAIL'} {message}")
+    return condition
+
+
+# Resume of a run killed while it was writing a record (pipelines/sink.py): no row may be lost
+def main():
+    results = []
+    with tempfile.TemporaryDirectory() as run_dir:
+        saving_path = os.path.join(run_dir, "results.csv")
+        shard_path = shard_path_for(saving_path)
+
+        # First run: every row but the last is written, then the process dies halfway through row 7's record
+        with ResultSink(shard_path, columns=ColumnBuffer(list(range(ROWS)), DTYPES)) as sink:
+            for idx in range(ROWS):
+                if idx != 7:
+                    sink.write(idx, {"m_response1": f"answer {idx}", DONE_COLUMN: 1.0})
+        with open(shard_path, "a", encoding="utf-8") as file:
+            file.write('{"idx": 7, "m_response1": "answ')
+
+        completed = load_completed(saving_path, "m", DONE_COLUMN)
+        results.append(check(completed == set(range(ROWS)) - {7}, f"{len(completed)} rows done before the resume"))
+
+        # Resume: only row 7 is run again
+        with ResultSink(shard_path, columns=ColumnBuffer(list(range(ROWS)), DTYPES)) as sink:
+            for idx in sorted(set(range(ROWS)) - completed):
+                sink.write(idx, {"m_response1": f"answer {idx}", DONE_COLUMN: 1.0})
+            frame = sink.compact(pd.DataFrame(index=range(ROWS)))
+
+        completed = load_completed(saving_path, "m", DONE_COLUMN)
+        results.append(check(completed == set(range(ROWS)), f"{len(completed)} of {ROWS} rows done after the resume"))
+        results.append(check(len(read_shard(shard_path)) == ROWS, "every shard line parses"))
+        results.append(check(frame.loc[7, "m_response1"] == "answer 7", "row 7 compacted"))
+
+        # A shard with no complete line at all is emptied
+        with open(shard_path, "w", encoding="utf-8") as file:
+            file.write('{"idx": 0, "m_resp')
+        truncate_partial_line(shard_path)
+        results.append(check(os.path.getsize(shard_path) == 0, "cut-off first record dropped"))
+
+    if not all(results):
+        sys.exit(1)
+    print("Resume OK")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,50 @@
+import sys
+from pathlib import Path
+
+import numpy as np
+from rouge_score import rouge_scorer
+
+# Add the project root directory to the Python path
+project_root = Path(__file__).resolve().parent.parent
+sys.path.append(str(project_root))
+
+from metrics.rouge_l import calculate_rouge_l, calculate_rouge_l_batch
+
+
+def check(condition, message):
+    print(f"{'ok  ' if condition else 'FAIL'} {message}")
+    return condition
+
+
+def reference_score(reference, candidate, use_stemmer=True):
+    # The scorer calculate_rouge_l used to build on every call
+    return rouge_scorer.RougeScorer(['rougeL'], use_stemmer=use_stemmer).score(reference, candidate)['rougeL'].fmeasure
+
+
+# Check of metrics/rouge_l.py: same scores as a fresh RougeScorer, whatever batches ran before
+def main():
+    reference, candidate = "the patients were coughing", "patient coughs"
+    results = []
+
+    before = calculate_rouge_l(reference, candidate)
+    results.append(check(before == reference_score(reference, candidate), f"calculate_rouge_l stems ({before:.3f})"))
+
+    unstemmed = calculate_rouge_l_batch([reference], [candidate], workers=1, use_stemmer=False)
+    results.append(check(unstemmed[0] == reference_score(reference, candidate, use_stemmer=False),
+                         f"batch without stemming ({unstemmed[0]:.3f})"))
+    after = calculate_rouge_l(reference, candidate)
+    results.append(check(after == before, f"calculate_rouge_l unchanged after a non-default batch ({after:.3f})"))
+
+    references = ["the patient has a fever", "acute chest pains", None] * 50
+    candidates = ["patient fevers", "chest pain, acute", "anything"] * 50
+    expected = [reference_score(r, c) if r is not None else np.nan for r, c in zip(references, candidates)]
+    for workers in (1, 2):
+        scores = calculate_rouge_l_batch(references, candidates, workers=workers, chunksize=40)
+        results.append(check(np.array_equal(scores, expected, equal_nan=True), f"batch scores with {workers} worker(s)"))
+
+    if not all(results):
+        sys.exit(1)
+    print("ROUGE-L OK")
+
+if __name__ == "__main__":
+    main()
@@ -10,14 +10,18 @@ sys.path.append(str(project_root))
 # Now you can import from config
 from config.settings import AZURE_OPENAI_API_KEY, AZURE_OPENAI_ENDPOINT
 
-os.environ['AZURE_OPENAI_API_KEY'] = AZURE_OPENAI_API_KEY
-os.environ['AZURE_OPENAI_ENDPOINT'] = AZURE_OPENAI_ENDPOINT
+# Only needed by the Azure models; runs of other providers work without these credentials
+if AZURE_OPENAI_API_KEY is not None:
+    os.environ['AZURE_OPENAI_API_KEY'] = AZURE_OPENAI_API_KEY
+if AZURE_OPENAI_ENDPOINT is not None:
+    os.environ['AZURE_OPENAI_ENDPOINT'] = AZURE_OPENAI_ENDPOINT
 
 # Rest of your imports
 import pandas as pd
 from config.repo_dir import get_repo_dir
 from llm.llm_config import llms
-from frameworks.fw2 import process_llms_and_df_fw2
+from pipelines.inputs import read_input
+from pipelines.fw2 import process_llms_and_df_fw2
 
 
 # --- 2/ Directories
@@ -46,6 +50,10 @@ def main():
     parser.add_argument("experiment_number", type=int, choices=[2, 3, 4], help="Experiment number (2, 3, or 4)")
     parser.add_argument("experiment_name", help="Name of the experiment")
     parser.add_argument("llm_type", help="Type of LLM to use")
+    parser.add_argument("--resume", metavar="RUN_DIR", default=None,
+                        help="Results folder of an interrupted run; only the missing (row, model) pairs are sent")
+    parser.add_argument("--chunksize", type=int, default=None,
+                        help="Stream the dataset in chunks of this many rows instead of loading it whole (constant memory)")
 
     args = parser.parse_args()
 
@@ -56,7 +64,7 @@ def main():
     
     print("Imported llms:", llms)  # Debugging line
     
-    filtered_llms = {key: value for key, value in llms.items() if value.get('type') == llm_type}
+    filtered_llms = llms.filter(type=llm_type)  # only the selected models' clients get built
     print("Filtered llms:", filtered_llms) 
     
    
@@ -66,8 +74,15 @@ def main():
     # Load the dataset
     try:
         data_path = get_data_path(experiment_type)
-        df = pd.read_csv(data_path)
-        print(f"Loaded dataset with {len(df)} rows.")
+        if args.chunksize:
+            # Streaming: the frameworks read the file chunk by chunk
+            if not os.path.exists(data_path):
+                raise FileNotFoundError(data_path)
+            df = data_path
+            print(f"Streaming dataset in chunks of {args.chunksize} rows.")
+        else:
+            df = read_input(data_path)
+            print(f"Loaded dataset with {len(df)} rows.")
     except FileNotFoundError:
         print(f"Error: File not found at {data_path}")
         return
@@ -80,7 +95,8 @@ def main():
 
     # Run the experiment
     try:
-        results = process_llms_and_df_fw2(filtered_llms, df, experiment_type, repo_dir, experiment_number, experiment_name)
+        results = process_llms_and_df_fw2(filtered_llms, df, experiment_type, repo_dir, experiment_number, experiment_name,
+                                           resume_dir=args.resume, chunksize=args.chunksize)
         print("Experiment completed successfully.")
     except Exception as e:
         print(f"An error occurred during the experiment: {str(e)}")
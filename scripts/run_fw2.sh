@@ -40,5 +40,7 @@ echo "Pulling models with Ollama..."
 echo "Running the script"
 # ! HYPERPARAMETERS
 python scripts/run_exp2.py GxE 2 "test3_cluster" "open"
+# If the job was killed by h_rt, resubmit with the run folder to only send the missing rows:
+# python scripts/run_fw2.py GxE 2 "test3_cluster" "open" --resume results/fw2/exp2/<timestamp>_test3_cluster
 echo "Script running done"
 echo "END"
\ No newline at end of file
@@ -0,0 +1,41 @@
+import sys
+import os
+from pathlib import Path
+import argparse
+
+# Add the project root directory to the Python path
+project_root = Path(__file__).resolve().parent.parent
+sys.path.append(str(project_root))
+
+from config.repo_dir import get_repo_dir
+from pipelines.fw4_ft_gpt import build_ft_dataset, MAX_EXAMPLE_TOKENS, MAX_FILE_TOKENS
+
+
+# --- 2/ Directories
+repo_dir = get_repo_dir()
+
+# Data directory
+def get_data_path(experiment_type):
+    return os.path.join(repo_dir,'data', f'{experiment_type}.csv')
+
+
+# --- 3/ Build
+def main():
+    parser = argparse.ArgumentParser(description="Build fine-tuning JSONL files from the G/GxE datasets")
+    parser.add_argument("task", choices=["MCQ", "XPL"], help="Training target: answer label (MCQ) or explanation (XPL)")
+    parser.add_argument("experiment_types", nargs="+", choices=["G", "GxE"], help="Datasets to include")
+    parser.add_argument("--name", default=None, help="File name prefix (default ft_<task>)")
+    parser.add_argument("--chunksize", type=int, default=None, help="Rows read at a time")
+    parser.add_argument("--explanation-column", default="explanation", help="Column with the XPL targets")
+    parser.add_argument("--max-example-tokens", type=int, default=MAX_EXAMPLE_TOKENS)
+    parser.add_argument("--max-file-tokens", type=int, default=MAX_FILE_TOKENS)
+    parser.add_argument("--dedup-db", default=None, help="SQLite file for the seen-example hashes (very large datasets)")
+    args = parser.parse_args()
+
+    output_dir = os.path.join(repo_dir, "data", "ft")
+    build_ft_dataset([get_data_path(experiment_type) for experiment_type in args.experiment_types], output_dir,
+                     task=args.task, name=args.name, chunksize=args.chunksize, explanation_column=args.explanation_column,
+                     max_example_tokens=args.max_example_tokens, max_file_tokens=args.max_file_tokens, dedup_path=args.dedup_db)
+
+if __name__ == "__main__":
+    main()
@@ -1,4 +1,4 @@
-from pipelines.fw5 import process_csv, handle_api_call, count_tokens, create_user_prompt_function, process_batch
+from pipelines.fw5 import process_csv, count_tokens, create_user_prompt_function
 
 # ===== HYPERPARAMETERS =====
 TASK= # "MCQ" or "XPL"